@@ -35,6 +35,7 @@ import subprocess
 import tempfile
 import json
 import shutil
+import threading
 
 import narviversion
 import pwhash
@@ -103,6 +104,42 @@ class TemporaryClipboard(object):
 		return False
 
 
+class ProgressBar(object):
+	# Shown on the terminal once a key derivation has run long enough to
+	# notice, and erased when it is done.  Called as bar(done, total).
+
+	width = 40
+	delay = 0.5
+
+	def __init__(self, stream=sys.stderr):
+		self.stream = stream
+		self.start = time.time()
+		self.shown = None
+
+	def __call__(self, done, total):
+		if not total or time.time() - self.start < self.delay:
+			return
+		try:
+			if not self.stream.isatty():
+				return
+		except AttributeError:
+			return
+		percent = (100 * done) // total
+		if percent == self.shown:
+			return
+		self.shown = percent
+		n = (self.width * done) // total
+		self.stream.write('\r[' + '#' * n + '.' * (self.width - n) + '] ' +
+			str(percent).rjust(3) + '%')
+		self.stream.flush()
+
+	def clear(self):
+		if self.shown is not None:
+			self.stream.write('\r' + ' ' * (self.width + 7) + '\r')
+			self.stream.flush()
+			self.shown = None
+
+
 def maxstringlen(l):
 	m = 0
 	for s in l:
@@ -202,7 +239,17 @@ def cmd_hash(args, pwh, completer):
 		else:
 			print('ERROR: Passwords do not match.')
 	#
-	password = pwh.generate_password(salt, master)
+	# Ctrl-C lands between chunks of the derivation; setting cancel also
+	# stops any engine threads or processes still working on it
+	cancel = threading.Event()
+	bar = ProgressBar()
+	try:
+		password = pwh.generate_password(salt, master, bar, cancel)
+	except KeyboardInterrupt:
+		cancel.set()
+		raise
+	finally:
+		bar.clear()
 	#
 	clipboardtime = pwh.user_settings['clipboard-time']
 	with TemporaryClipboard(password):
@@ -266,9 +313,26 @@ forget_parser.completions = cmd_hash_completions
 
 #
 #
+def costline(cost):
+	mib = (cost['memory'] + (1 << 20) - 1) >> 20
+	if mib >= 1024:
+		line = ('%.1f' % (mib / 1024.0)) + ' GiB'
+	else:
+		line = str(mib) + ' MiB'
+	if cost['file-backed']:
+		line += ' (file-backed)'
+	elif cost['available'] and cost['memory'] > cost['available']:
+		line += ' (more than is available)'
+	if cost['seconds'] is not None:
+		line = '~' + ('%.2f' % cost['seconds']) + ' s, ' + line
+	return line + ' on this machine'
+#
 def cmd_lshashschemes(args, pwh):
 	for sid in sorted(pwh.hashschemes):
 		print(sid)
+		cost = pwh.hash_cost(sid, True)
+		if cost:
+			print(wrapped(costline(cost)))
 		if pwh.hashschemes[sid]['description']:
 			print(wrapped(pwh.hashschemes[sid]['description']))
 #
@@ -360,6 +424,46 @@ version_parser = subparsers.add_parser(
 version_parser.set_defaults(func=cmd_version)
 
 
+#
+#
+def cmd_calibrate(args, pwh):
+	def report(params, seconds):
+		print('N=2^' + str(params['N'].bit_length() - 1) +
+			', r=' + str(params['r']) + ', p=' + str(params['p']) +
+			': ' + ('%.2f' % seconds) + ' s')
+	memory = None
+	if args.memory:
+		memory = args.memory << 20
+	sid, seconds = pwh.calibrate_hashscheme(args.seconds, memory, report)
+	print(sid)
+	print(wrapped(pwh.hashschemes[sid]['description']))
+	if args.default:
+		pwh.update_setting('default-hashscheme', lambda old: sid)
+	pwh.save_config()
+calibrate_parser = subparsers.add_parser(
+	'calibrate',
+	description='Benchmarks the scrypt hash function on this machine and saves a hash scheme whose parameters take about SECONDS to hash (default 1) and whose scratch memory fits in MIB mebibytes (default: a share of physical memory, at most 1024).',
+	help='Create a hash scheme tuned to this machine',
+	formatter_class=NarviHelpFormatter)
+calibrate_parser.add_argument(
+	'--time',
+	dest='seconds',
+	metavar='SECONDS',
+	type=float,
+	default=1.0,
+	help='Target time to hash a password')
+calibrate_parser.add_argument(
+	'--memory',
+	metavar='MIB',
+	type=int,
+	help='Scratch memory budget in MiB')
+calibrate_parser.add_argument(
+	'--default',
+	action='store_true',
+	help='Also make the new scheme the default for new salts')
+calibrate_parser.set_defaults(func=cmd_calibrate)
+
+
 #
 #
 def cmd_help(args, pwh):
@@ -536,20 +640,23 @@ def interactive(parser, prompt, pwh, completer):
 
 try:
 	pwh = pwhash.PWHash('.narvi')
-	if len(sys.argv) == 1:
-		interactive(parser, 'narvi> ', pwh, completer)
-	else:
-		try:
-			args = parser.parse_args()
-		except NarviParserError as e:
-			if e.errstr:
-				sys.stderr.write(e.errstr)
-			sys.exit(2)
+	try:
+		if len(sys.argv) == 1:
+			interactive(parser, 'narvi> ', pwh, completer)
 		else:
-			if args.func == cmd_hash:
-				args.func(args, pwh, completer)
+			try:
+				args = parser.parse_args()
+			except NarviParserError as e:
+				if e.errstr:
+					sys.stderr.write(e.errstr)
+				sys.exit(2)
 			else:
-				args.func(args, pwh)
+				if args.func == cmd_hash:
+					args.func(args, pwh, completer)
+				else:
+					args.func(args, pwh)
+	finally:
+		pwh.close()
 except KeyboardInterrupt:
 	sys.stderr.write('\nInterrupted.\n')
 	sys.exit(1)
@@ -25,6 +25,21 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+import py_compile
+
+
+# Each module goes in with its bytecode, as zipimport cannot cache what it
+# compiles, so the source would be compiled again on every start.  The
+# bytecode is not checked against the source, which cannot change inside
+# the zip; a Python that cannot read it falls back to the source.
+def _narvizip_bytecode(build, k):
+	pyc = os.path.join(build.objroot, 'narvizip', 'bytecode', k + 'c')
+	py_compile.compile(build.zipcontents[k], cfile=pyc, dfile=k,
+		doraise=True,
+		invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+	return pyc
+
+
 @build_step('narvizip', ['zipcontents'], [])
 def build_narvizip(build):
 	build.narvizipfile = os.path.join(build.objroot, 'narvizip', 'narvi.zip')
@@ -34,5 +49,7 @@ def build_narvizip(build):
 	for k in sorted(build.zipcontents.keys()):
 		print('\t\t' + k)
 		narvizip.write(build.zipcontents[k], k)
+		if k.endswith('.py'):
+			narvizip.write(_narvizip_bytecode(build, k), k + 'c')
 	narvizip.close()
 
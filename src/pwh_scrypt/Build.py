@@ -27,5 +27,9 @@
 @build_step('pwh_scrypt', [], ['zipcontents'])
 def build_pwh_scrypt(build):
 	build.zipcontents['pwhash/plugins/pwh_scrypt/__init__.py'] = os.path.join(build.srcdir, '__init__.py')
+	build.zipcontents['pwhash/plugins/pwh_scrypt/checkpoint.py'] = os.path.join(build.srcdir, 'checkpoint.py')
+	build.zipcontents['pwhash/plugins/pwh_scrypt/npscrypt.py'] = os.path.join(build.srcdir, 'npscrypt.py')
+	build.zipcontents['pwhash/plugins/pwh_scrypt/purescrypt.py'] = os.path.join(build.srcdir, 'purescrypt.py')
+	build.zipcontents['pwhash/plugins/pwh_scrypt/scratch.py'] = os.path.join(build.srcdir, 'scratch.py')
 
 
@@ -25,37 +25,843 @@
 
 
 import os
+import json
+import time
+import hashlib
+import binascii
+import threading
 
-def _scrypt_hash(pwh, params, pw, salt):
-	try:
-		from . import scrypthash
-		scrypthash.init(pwh.lib_path)
-	except Exception as e:
-		print(e)
-		print("INFO: using pure Python scrypt")
-		from . import pyscrypt
-		hashbytes = pyscrypt.hash(
-			password = pw.encode('utf-8'),
-			salt     = salt.encode('utf-8'),
-			N        = params['N'],
-			r        = params['r'],
-			p        = params['p'],
-			dkLen    = params['dklen'])
+
+class _Unsupported(Exception): pass
+
+
+class _Progress(object):
+	# The engines call this with the number of SMix iterations they have
+	# just completed (2N per lane in all), between chunks of work.  It adds
+	# them up for the caller's progress(done, total), and once the caller's
+	# cancel event is set, or abandon() is called, it raises
+	# PWHashCancelled so that the engine gives up within one chunk.
+
+	def __init__(self, total, report=None, cancel=None):
+		self.total = total
+		self.done = 0
+		self._report = report
+		self._cancel = cancel
+		self._abandoned = False
+		self._lock = threading.Lock()
+
+	def abandon(self):
+		self._abandoned = True
+
+	def check(self):
+		if self._abandoned or (self._cancel and self._cancel.is_set()):
+			from ... import PWHashCancelled
+			raise PWHashCancelled('key derivation cancelled')
+
+	def __call__(self, steps):
+		self.check()
+		if steps and self._report:
+			with self._lock:
+				self.done = min(self.done + steps, self.total)
+				self._report(self.done, self.total)
+
+
+# pre-faulted scratch buffers for the native lib, reused across derivations
+_scratch_pool = None
+
+
+def _lane_workers(pwh, N, r, p):
+	# How many of the p independent SMix lanes of one derivation to run at
+	# once: 'scrypt-threads' (default: one per CPU), but no more than p, and
+	# few enough that each worker's V fits in 'scratch-mmap-fraction' of
+	# physical memory.
+	from . import scratch
+	workers = pwh.user_settings.get('scrypt-threads', 0)
+	if not workers:
+		workers = os.cpu_count() or 1
+	workers = max(1, min(int(workers), p))
+	while workers > 1 and scratch.exceeds_memory(
+		workers * 128 * r * N, _scratch_fraction(pwh)):
+		workers -= 1
+	return workers
+
+
+def _smix_threads(scrypthash, pwh, password, salt, N, r, p, workers,
+	scratch=None, progress=None):
+	# PBKDF2 on this thread, then the lanes on worker threads (the ctypes
+	# call releases the GIL), each with its own pooled scratch buffer;
+	# returns the mixed lanes for the final PBKDF2.  With one worker, the
+	# lanes run on this thread, in scratch if it is given.  Worker threads
+	# always run SMix stepwise, so that they can be abandoned if this thread
+	# is interrupted.
+	if workers > 1 and progress is None:
+		progress = _Progress(2 * N * p)
+	blen = 128 * r
+	size = scrypthash.smix_size(N, r)
+	hugepages = bool(pwh.user_settings.get('hugepages', False))
+	B = bytearray(hashlib.pbkdf2_hmac('sha256', password, salt, 1, p * blen))
+	errors = []
+	def _worker(first):
+		try:
+			if scratch is not None:
+				pooled = None
+				buf = scratch
+			else:
+				pooled = _scratch_pool.acquire(size, hugepages)
+				buf = pooled.buffer
+			try:
+				for i in range(first, p, workers):
+					lane = memoryview(B)[i * blen:(i + 1) * blen]
+					try:
+						scrypthash.smix(lane, N, r, buf, progress)
+					finally:
+						lane.release()
+			finally:
+				if pooled:
+					_scratch_pool.release(pooled)
+		except Exception as e:
+			errors.append(e)
+	if workers == 1:
+		_worker(0)
 	else:
-		hashbytes = scrypthash.hash(
-			password = pw,
-			salt     = salt,
-			N        = params['N'],
-			r        = params['r'],
-			p        = params['p'],
-			buflen   = params['dklen'])
+		threads = [threading.Thread(target=_worker, args=(k,))
+			for k in range(workers)]
+		for t in threads:
+			t.start()
+		try:
+			for t in threads:
+				t.join()
+		except BaseException:
+			progress.abandon()
+			for t in threads:
+				t.join()
+			B[:] = bytes(len(B))
+			raise
+	if errors:
+		B[:] = bytes(len(B))
+		raise errors[0]
+	# handed over as is; PBKDF2KeyMaterial wipes it once absorbed
+	return B
+
+
+#
+# A backend is a function f(pwh, password, salt, N, r, p, buflen, scratch,
+# progress), loaded once per process.  pwh is the snapshot of the
+# derivation at hand, passed on every call, so that settings such as
+# 'hugepages' and 'scrypt-threads' are read as they are now; a backend
+# keeps nothing of the snapshot it was loaded with but, for the native
+# lib, the lib itself.
+#
+
+
+def _hash_from_mix(mix):
+	# A backend that can stop short of scrypt's final PBKDF2 offers that as
+	# f.mix, so that the final stage can be computed lazily (see
+	# _key_material()); f itself adds the final stage, so the self-test
+	# covers both.
+	def _hash(pwh, password, salt, N, r, p, buflen, scratch=None,
+		progress=None):
+		return hashlib.pbkdf2_hmac('sha256', password,
+			mix(pwh, password, salt, N, r, p, scratch, progress), 1, buflen)
+	_hash.mix = mix
+	return _hash
+
+
+def _load_scrypthash(pwh):
+	global _scratch_pool
+	from . import scrypthash
+	from . import scratch as _scratch
+	scrypthash.init(pwh.lib_path)
+	if not _scratch_pool:
+		_scratch_pool = _scratch.ScratchPool()
+	if scrypthash.has_smix():
+		def _mix(pwh, password, salt, N, r, p, scratch=None, progress=None):
+			try:
+				if scratch is None:
+					return _smix_threads(scrypthash, pwh, password, salt,
+						N, r, p, _lane_workers(pwh, N, r, p), None, progress)
+				if len(scratch) < scrypthash.smix_size(N, r):
+					raise _Unsupported('scratch memory too small')
+				return _smix_threads(scrypthash, pwh, password, salt,
+					N, r, p, 1, scratch, progress)
+			except (scrypthash.error, MemoryError, OSError) as e:
+				raise _Unsupported(e)
+		return _hash_from_mix(_mix)
+	def _hash(pwh, password, salt, N, r, p, buflen, scratch=None,
+		progress=None):
+		try:
+			if not scrypthash.has_scratch():
+				if scratch is not None:
+					raise _Unsupported('cannot use external scratch memory')
+				return scrypthash.hash(password, salt, N, r, p, buflen,
+					bytearray(buflen))
+			size = scrypthash.scratch_size(N, r, p)
+			if scratch is not None:
+				if len(scratch) < size:
+					raise _Unsupported('scratch memory too small')
+				return scrypthash.hash_scratch(password, salt, N, r, p,
+					buflen, scratch, bytearray(buflen))
+			pooled = _scratch_pool.acquire(
+				size, bool(pwh.user_settings.get('hugepages', False)))
+			try:
+				return scrypthash.hash_scratch(password, salt, N, r, p,
+					buflen, pooled.buffer, bytearray(buflen))
+			finally:
+				_scratch_pool.release(pooled)
+		except (scrypthash.error, MemoryError, OSError) as e:
+			# e.g. a 32-bit lib that cannot allocate V for large N
+			raise _Unsupported(e)
+	return _hash
+
+
+def _hashlib_maxmem(N, r, p):
+	# OpenSSL's accounting: B, plus V and XY in one allocation
+	return 128 * r * p + 128 * r * (N + 2) + 65536
+
+
+def _load_hashlib(pwh):
+	scrypt = hashlib.scrypt
+	def _hash(pwh, password, salt, N, r, p, buflen, scratch=None,
+		progress=None):
+		if scratch is not None:
+			raise _Unsupported('cannot use external scratch memory')
+		maxmem = _hashlib_maxmem(N, r, p)
+		if maxmem > 0x7fffffff:
+			raise _Unsupported('hashlib.scrypt maxmem limit exceeded')
+		return scrypt(password, salt=salt, n=N, r=r, p=p,
+			maxmem=maxmem, dklen=buflen)
+	return _hash
+
+
+def _load_numpy(pwh):
+	from . import npscrypt
+	def _mix(pwh, password, salt, N, r, p, scratch=None, progress=None):
+		if p < npscrypt.min_lanes:
+			raise _Unsupported('too few lanes for the NumPy engine')
+		if scratch is not None and len(scratch) < 128 * r * N * p:
+			raise _Unsupported('scratch memory too small for all lanes')
+		return npscrypt.mix(password, salt, N, r, p, scratch, progress)
+	return _hash_from_mix(_mix)
+
+
+def _checkpoint_for(pwh, password, salt, N, r, p):
+	# With 'scrypt-checkpoint-interval' set, the Python engine saves its
+	# progress that often (in seconds), and on interruption, to an encrypted
+	# file under the config dir, and resumes from it next time.
+	interval = pwh.user_settings.get('scrypt-checkpoint-interval', 0)
+	if not interval or not os.path.isdir(pwh.config_dir):
+		return None
+	from . import checkpoint
+	return checkpoint.Checkpoint(pwh.config_dir, password, salt,
+		N, r, p, interval)
+
+
+def _load_python(pwh):
+	from . import purescrypt
+	def _mix(pwh, password, salt, N, r, p, scratch=None, progress=None):
+		ckpt = _checkpoint_for(pwh, password, salt, N, r, p)
+		workers = 1
+		if scratch is None and p > 1 and ckpt is None:
+			workers = _lane_workers(pwh, N, r, p)
+		return purescrypt.mix(password, salt, N, r, p, scratch, workers,
+			progress, ckpt)
+	return _hash_from_mix(_mix)
+
+
+# fastest first
+_backends = [
+	('scrypthash', _load_scrypthash),
+	('hashlib',    _load_hashlib),
+	('numpy',      _load_numpy),
+	('python',     _load_python)
+	]
+
+_selftest_vectors = [
+	# RFC 7914, section 12, first test vector
+	{
+	'password': b'',
+	'salt':     b'',
+	'N':        16,
+	'r':        1,
+	'p':        1,
+	'buflen':   64,
+	'hash':     binascii.unhexlify(
+		'77d6576238657b203b19ca42c18a0497f16b4844e3074ae8dfdffa3fede2144'
+		'2fcd0069ded0948f8326a753a0fc81f17e8d3e0fb2e0d3628cf35e20c38d18906')
+	},
+	# wide enough for the lane-parallel engines; from scrypthash.hash
+	{
+	'password': b'narvi',
+	'salt':     b'self-test',
+	'N':        16,
+	'r':        1,
+	'p':        32,
+	'buflen':   64,
+	'hash':     binascii.unhexlify(
+		'c7477ef358ee146d345c27521afcdf43fd45d7a0d89dd0e59fd8bca9b5130ff'
+		'f3b26fbfa6d4ebd8934b3c5a93c54715e232b557b0be9e6fd1ea5e50413386250')
+	}
+	]
+
+# backend name -> hash function, or None if the backend is unusable
+_backend_cache = {}
+
+# held while a backend is loaded and self-tested, so that threads starting
+# derivations at once load each backend (and the native lib) only once
+_backend_lock = threading.RLock()
+
+# lib version -> name of the first backend that passed the self-test
+_chosen_backend = {}
+
+
+def _selftest(pwh, f):
+	# every vector the backend accepts must match, and it must accept one
+	passed = 0
+	for v in _selftest_vectors:
+		try:
+			h = f(pwh, v['password'], v['salt'],
+				v['N'], v['r'], v['p'], v['buflen'])
+		except _Unsupported:
+			continue
+		if h != v['hash']:
+			raise ValueError('known-answer self-test failed')
+		passed += 1
+	if not passed:
+		raise ValueError('no applicable known-answer self-test')
+
+
+def _backend(pwh, name, selftest=True):
+	try:
+		return _backend_cache[name]
+	except KeyError:
+		pass
+	with _backend_lock:
+		if name in _backend_cache:
+			return _backend_cache[name]
+		try:
+			f = dict(_backends)[name](pwh)
+			if selftest:
+				_selftest(pwh, f)
+		except Exception as e:
+			print('INFO: scrypt backend \'' + name + '\' unavailable:', e)
+			f = None
+		_backend_cache[name] = f
+		return f
+
+
+def _backend_chain(pwh):
+	# The first backend to pass the self-test is remembered for the rest of
+	# the process, keyed by the lib version, so that later derivations skip
+	# the probing.  The slower backends that follow it remain as fallbacks
+	# for hash parameters that the faster ones cannot handle.  The choice is
+	# not saved, as hashing must not write the config; probing again costs
+	# a few tiny derivations per process.
+	names = [n for n, l in _backends]
+	libversion = pwh.user_settings.get('lib-version', '')
+	chosen = _chosen_backend.get(libversion)
+	if chosen in names:
+		return names[names.index(chosen):]
+	with _backend_lock:
+		if libversion in _chosen_backend:
+			return _backend_chain(pwh)
+		for i, n in enumerate(names):
+			if _backend(pwh, n):
+				if i:
+					print('INFO: using scrypt backend \'' + n + '\'')
+				_chosen_backend[libversion] = n
+				return names[i:]
+	return []
+
+
+def _scratch_fraction(pwh):
+	return pwh.user_settings.get('scratch-mmap-fraction', 0.5)
+
+
+def _needs_mapped_scratch(pwh, N, r):
+	from . import scratch
+	return scratch.exceeds_memory(128 * r * N, _scratch_fraction(pwh))
+
+
+def _scratch_for(pwh, N, r, p):
+	# Past 'scratch-mmap-fraction' of physical memory, V goes into a
+	# memory-mapped file under the config dir; backends that can only
+	# allocate their own memory will decline the derivation.
+	from . import scratch
+	if not _needs_mapped_scratch(pwh, N, r):
+		return None
+	print('INFO: scrypt scratch memory is file-backed')
+	size = scratch.scrypt_size(N, r, p)
+	if os.path.isdir(pwh.config_dir):
+		return scratch.MappedScratch(size, pwh.config_dir)
+	return scratch.MappedScratch(size)
+
+
+def _in_background(progress, f, *args):
+	# For backends that cannot stop part way: run f on a daemon thread and
+	# wait, so that cancelling, or interrupting this thread, returns control
+	# at once.  An abandoned thread finishes in the background and its
+	# result is dropped.
+	result = []
+	errors = []
+	def _run():
+		try:
+			result.append(f(*args))
+		except Exception as e:
+			errors.append(e)
+	t = threading.Thread(target=_run)
+	t.daemon = True
+	t.start()
+	while t.is_alive():
+		progress.check()
+		t.join(0.1)
+	if errors:
+		raise errors[0]
+	return result[0]
+
+
+def _key_material(pwh, f, password, salt, params, scratch=None,
+	progress=None):
+	# The final PBKDF2's output is a run of independent 32-byte blocks, and
+	# word functions usually read only the first few, so when the backend
+	# can hand over the mixed lanes, the blocks are computed as they are
+	# read.  progress, if given, is a _Progress.
+	from ... import keymaterial
+	N, r, p, dklen = params['N'], params['r'], params['p'], params['dklen']
+	mix = getattr(f, 'mix', None)
+	if mix is not None:
+		return keymaterial.PBKDF2KeyMaterial(password,
+			mix(pwh, password, salt, N, r, p, scratch, progress), dklen)
+	if progress is None:
+		return keymaterial.KeyMaterial(
+			f(pwh, password, salt, N, r, p, dklen, scratch))
+	progress(0)
+	hashbytes = _in_background(progress, f,
+		pwh, password, salt, N, r, p, dklen, scratch)
+	progress(2 * N * p)
+	return keymaterial.KeyMaterial(hashbytes)
+
+
+def _derive(pwh, params, password, salt, progress=None):
+	chain = _backend_chain(pwh)
+	mapped = _scratch_for(pwh, params['N'], params['r'], params['p'])
+	try:
+		for name in chain:
+			f = _backend(pwh, name)
+			if not f:
+				continue
+			start = time.time()
+			try:
+				hashbytes = _key_material(pwh, f, password, salt, params,
+					mapped and mapped.buffer, progress)
+			except _Unsupported:
+				continue
+			if not mapped:
+				_record_cost(pwh, name, params, time.time() - start)
+			if name != chain[0]:
+				print('INFO: used scrypt backend \'' + name + '\'')
+			return hashbytes
+	finally:
+		if mapped:
+			mapped.close()
+	raise ValueError('no scrypt backend available for these parameters')
+
+
+def _scrypt_hash(pwh, params, pw, salt, progress=None, cancel=None):
+	# progress, if given, is called with (done, total) as the derivation
+	# goes; cancel, if given, is a threading.Event that abandons the
+	# derivation, with PWHashCancelled, soon after it is set
+	tracker = None
+	if progress or cancel:
+		tracker = _Progress(2 * params['N'] * params['p'], progress, cancel)
+	hashbytes = _derive(pwh, params, pw.encode('utf-8'),
+		salt.encode('utf-8'), tracker)
+	_save_cost_model(pwh)
 	return hashbytes
 
 
+# V table budget for one lockstep pass of the lane engine
+_lane_scratch_budget = 1 << 30
+
+
+def _scrypt_hash_lanes(pwh, pw, jobs, N, r, progress=None):
+	# pack whole jobs into passes of at most _lane_scratch_budget bytes of V,
+	# but never fewer lanes than it takes for the engine to pay off
+	from ... import keymaterial
+	from . import npscrypt
+	from . import scratch
+	budget = _lane_scratch_budget
+	total = scratch.physical_memory()
+	if total and _scratch_fraction(pwh) > 0:
+		budget = min(budget, int(total * _scratch_fraction(pwh)))
+	maxlanes = max(npscrypt.min_lanes, budget // (128 * r * N))
+	hashes = []
+	passjobs = []
+	passlanes = 0
+	for salt, params in jobs + [(None, None)]:
+		if passjobs and (salt is None or
+			passlanes + params['p'] > maxlanes):
+			if passlanes < npscrypt.min_lanes:
+				hashes.extend([_derive(pwh, pp, pw.encode('utf-8'),
+					ps.encode('utf-8'), progress) for ps, pp in passjobs])
+			else:
+				password = pw.encode('utf-8')
+				mixes = npscrypt.mix_many(
+					[(password, ps.encode('utf-8'), pp['p'])
+					 for ps, pp in passjobs], N, r, progress)
+				hashes.extend([keymaterial.PBKDF2KeyMaterial(
+					password, B, pp['dklen'])
+					for (ps, pp), B in zip(passjobs, mixes)])
+			passjobs = []
+			passlanes = 0
+		if salt is not None:
+			passjobs.append((salt, params))
+			passlanes += params['p']
+	return hashes
+
+
+def _scrypt_hash_many(pwh, pw, jobs, progress=None, cancel=None):
+	# jobs is a list of (salt, hashparams); the results come back in the
+	# same order.  Jobs go to the backends that are faster than the lane
+	# engine first; whatever is left is grouped by N and r and run through
+	# the lane engine in lockstep.  progress and cancel are as for
+	# _scrypt_hash(), over all of the jobs.
+	tracker = None
+	if progress or cancel:
+		tracker = _Progress(sum([2 * params['N'] * params['p']
+			for salt, params in jobs]), progress, cancel)
+	chain = _backend_chain(pwh)
+	lanes = 'numpy' in chain and _backend(pwh, 'numpy')
+	if lanes:
+		ahead = chain[:chain.index('numpy')]
+	else:
+		ahead = chain
+	password = pw.encode('utf-8')
+	hashes = [None] * len(jobs)
+	pending = {}
+	for k, (salt, params) in enumerate(jobs):
+		if _needs_mapped_scratch(pwh, params['N'], params['r']):
+			hashes[k] = _derive(pwh, params, password,
+				salt.encode('utf-8'), tracker)
+			continue
+		for name in ahead:
+			f = _backend(pwh, name)
+			if not f:
+				continue
+			try:
+				hashes[k] = _key_material(pwh, f, password,
+					salt.encode('utf-8'), params, None, tracker)
+				break
+			except _Unsupported:
+				pass
+		else:
+			pending.setdefault((params['N'], params['r']), []).append(k)
+	for (N, r), ks in pending.items():
+		if not lanes:
+			raise ValueError('no scrypt backend available for these parameters')
+		for k, h in zip(ks, _scrypt_hash_lanes(
+			pwh, pw, [jobs[k] for k in ks], N, r, tracker)):
+			hashes[k] = h
+	_close(pwh)
+	_save_cost_model(pwh)
+	return hashes
+
+
+#
+# The cost model: how long, and how much memory, a derivation will take on
+# this machine.  Every derivation that runs in memory is recorded, per
+# backend, as its seconds against its work units (N * r, times the lanes
+# that run one after another); time is fitted as a + b * units over the
+# most recent samples.  Backends with no samples yet are probed with a few
+# small derivations when an estimate is asked for.
+#
+# The model is not part of the config.  It is kept in memory, and in its
+# own file under the config dir, to which a process adds the samples it
+# has taken by reading the file afresh and rewriting it under a lock, so
+# that processes hashing at once keep each other's samples.
+#
+
+# samples kept per backend
+_cost_samples = 12
+
+# a probe stops doubling N after a derivation this long
+_probe_seconds = 0.25
+
+_cost_file = 'scrypt-cost'
+
+# config dir -> the model as this process knows it, replaced, not changed
+_cost_models = {}
+
+# config dir -> [(backend, sample)] not yet in the cost file
+_cost_unsaved = {}
+
+_cost_lock = threading.Lock()
+
+
+def _current_model(pwh, model):
+	# samples from another lib version are no guide
+	libversion = pwh.user_settings.get('lib-version', '')
+	if not model or model.get('lib-version') != libversion:
+		model = {'lib-version': libversion, 'samples': {}}
+	return model
+
+
+def _with_sample(model, name, sample):
+	samples = dict(model['samples'])
+	samples[name] = (samples.get(name, []) + [sample])[-_cost_samples:]
+	return dict(model, samples=samples)
+
+
+def _read_cost_model(pwh):
+	try:
+		with open(os.path.join(pwh.config_dir, _cost_file), 'r') as f:
+			model = json.loads(f.read())
+		model['samples'] = dict(model['samples'])
+		return model
+	except (IOError, OSError, ValueError, KeyError, TypeError):
+		return None
+
+
+def _cost_model(pwh):
+	# read from the cost file the first time
+	with _cost_lock:
+		model = _cost_models.get(pwh.config_dir)
+		if model is None:
+			model = _read_cost_model(pwh)
+		model = _current_model(pwh, model)
+		_cost_models[pwh.config_dir] = model
+		return model
+
+
+def _save_cost_model(pwh):
+	# add the samples taken since the last save to the cost file, once
+	# narvi has a config
+	from ... import admission
+	if not os.path.isfile(pwh.config_file):
+		return
+	with _cost_lock:
+		unsaved = _cost_unsaved.pop(pwh.config_dir, [])
+	if not unsaved:
+		return
+	path = os.path.join(pwh.config_dir, _cost_file)
+	try:
+		with admission.FileLock(path + '.lock'):
+			model = _current_model(pwh, _read_cost_model(pwh))
+			for name, sample in unsaved:
+				model = _with_sample(model, name, sample)
+			tmp = path + '.' + str(os.getpid())
+			with open(tmp, 'w') as f:
+				f.write(json.dumps(model))
+			os.replace(tmp, path)
+	except (IOError, OSError) as e:
+		print('WARNING: unable to save the scrypt cost model:', e)
+		return
+	# with the samples other processes saved, and those taken meanwhile
+	with _cost_lock:
+		for name, sample in _cost_unsaved.get(pwh.config_dir, []):
+			model = _with_sample(model, name, sample)
+		_cost_models[pwh.config_dir] = model
+
+
+def _lane_groups(pwh, name, N, r, p):
+	# lanes that run one after another, and how many run at once; the
+	# native lib and the Python engine run up to _lane_workers() together
+	if name in ('scrypthash', 'python'):
+		workers = _lane_workers(pwh, N, r, p)
+		return (p + workers - 1) // workers, workers
+	return p, 1
+
+
+def _record_cost(pwh, name, params, seconds):
+	N, r, p = params['N'], params['r'], params['p']
+	groups, workers = _lane_groups(pwh, name, N, r, p)
+	sample = [N * r * groups, round(seconds, 4)]
+	_cost_model(pwh)
+	with _cost_lock:
+		model = _with_sample(
+			_current_model(pwh, _cost_models[pwh.config_dir]), name, sample)
+		_cost_models[pwh.config_dir] = model
+		_cost_unsaved.setdefault(pwh.config_dir, []).append((name, sample))
+	# returns the model with this sample in it
+	return model
+
+
+def _fit(samples):
+	# least squares seconds = a + b * units; through the origin if the
+	# samples are all one size or the slope comes out implausible
+	n = len(samples)
+	mu = sum([u for u, t in samples]) / n
+	mt = sum([t for u, t in samples]) / n
+	var = sum([(u - mu) ** 2 for u, t in samples])
+	if var:
+		b = sum([(u - mu) * (t - mt) for u, t in samples]) / var
+		if b > 0:
+			return max(0.0, mt - b * mu), b
+	return 0.0, mt / mu
+
+
+def _cost_backend(pwh, N, r, p, mapped):
+	# the backend that _derive() would end up using
+	from . import npscrypt
+	for name in _backend_chain(pwh):
+		if not _backend(pwh, name, False):
+			continue
+		if name == 'hashlib' and (mapped or
+			_hashlib_maxmem(N, r, p) > 0x7fffffff):
+			continue
+		if name == 'numpy' and p < npscrypt.min_lanes:
+			continue
+		return name
+	return None
+
+
+def _probe(pwh, name):
+	from . import npscrypt
+	print('INFO: measuring scrypt backend \'' + name + '\'')
+	f = _backend(pwh, name)
+	p = 1
+	if name == 'numpy':
+		p = npscrypt.min_lanes
+	password = os.urandom(16)
+	N = 1 << 10
+	for runs in range(5):
+		params = {'N': N, 'r': 8, 'p': p, 'dklen': 64}
+		start = time.time()
+		_key_material(pwh, f, password, b'narvi probe', params)
+		elapsed = time.time() - start
+		model = _record_cost(pwh, name, params, elapsed)
+		if runs and elapsed >= _probe_seconds:
+			break
+		N *= 2
+	_save_cost_model(pwh)
+	return model
+
+
+def _cost(pwh, params, probe=False):
+	# Estimate a derivation: 'seconds' (None if there is nothing to go on
+	# and probe is false), 'memory' it needs in bytes, 'available' memory
+	# in bytes (None if unknown), 'file-backed' if V would go to a mapped
+	# file, 'threads' if derivations on separate threads run in parallel,
+	# the 'backend' it would run on, and 'batch', the fewest derivations of
+	# these parameters that pay to run together through _scrypt_hash_many()
+	# (0 if they do not).
+	from . import npscrypt
+	from . import scratch
+	N, r, p = params['N'], params['r'], params['p']
+	mapped = _needs_mapped_scratch(pwh, N, r)
+	name = _cost_backend(pwh, N, r, p, mapped)
+	cost = {
+		'seconds':     None,
+		'memory':      scratch.scrypt_size(N, r, p),
+		'available':   scratch.available_memory(),
+		'file-backed': mapped,
+		'threads':     name != 'python',
+		'backend':     name,
+		'batch':       0
+		}
+	if name is None:
+		return cost
+	# the lane engine runs what is slower than it in lockstep
+	if (name in ('numpy', 'python') and not mapped and
+		'numpy' in _backend_chain(pwh) and _backend(pwh, 'numpy', False)):
+		cost['batch'] = (npscrypt.min_lanes + p - 1) // p
+	groups, workers = _lane_groups(pwh, name, N, r, p)
+	if name == 'numpy':
+		cost['memory'] = scratch.scrypt_size(N * p, r, p)
+	elif not mapped:
+		cost['memory'] = scratch.scrypt_size(N * workers, r, p)
+	samples = _cost_model(pwh)['samples'].get(name)
+	if not samples and probe:
+		samples = _probe(pwh, name)['samples'].get(name)
+	if samples:
+		a, b = _fit(samples)
+		cost['seconds'] = a + b * N * r * groups
+	return cost
+
+
+def _close(pwh):
+	# the end of a session: unmap the pooled scratch buffers
+	if _scratch_pool:
+		_scratch_pool.clear()
+
+
+# smallest N that calibration tries
+_calibrate_min_N = 1 << 10
+
+
+def _calibrate(pwh, seconds, memory=None, report=None):
+	# Pick scrypt parameters for this machine and its backends: r=8, the
+	# largest N that hashes within seconds and fits in memory bytes
+	# (default: the lane engine's budget, within 'scratch-mmap-fraction' of
+	# physical memory), then, if memory is what stopped N growing, as many
+	# lanes (p) as still fit in the time and in memory.  Memory is as
+	# _cost() has it, which counts a V for each lane run at once.  report,
+	# if given, is called with (hashparams, seconds) for each trial.
+	# Returns (hash scheme id, hash scheme, seconds measured).
+	from . import scratch
+	r = 8
+	if memory is None:
+		memory = _lane_scratch_budget
+		total = scratch.physical_memory()
+		if total and _scratch_fraction(pwh) > 0:
+			memory = min(memory, int(total * _scratch_fraction(pwh)))
+	password = os.urandom(16)
+	salt = b'narvi calibrate'
+	def fits(N, p):
+		params = {'N': N, 'r': r, 'p': p, 'dklen': 512}
+		return _cost(pwh, params)['memory'] <= memory
+	def measure(N, p):
+		params = {'N': N, 'r': r, 'p': p, 'dklen': 512}
+		start = time.time()
+		_derive(pwh, params, password, salt)
+		elapsed = time.time() - start
+		if report:
+			report(params, elapsed)
+		return elapsed
+	N = _calibrate_min_N
+	t = measure(N, 1)
+	while fits(N * 2, 1) and t * 2 <= seconds:
+		t2 = measure(N * 2, 1)
+		if t2 > seconds:
+			break
+		N, t = N * 2, t2
+	p = 1
+	if not fits(N * 2, 1) and t * 2 <= seconds:
+		# lanes cost no more memory as p falls, so the loop below keeps
+		# p within memory
+		p = int(seconds // t)
+		while p > 1 and not fits(N, p):
+			p -= 1
+		t2 = measure(N, p)
+		while p > 1 and t2 > seconds:
+			p = max(1, int(p * seconds / t2))
+			t2 = measure(N, p)
+		t = t2
+	log2N = N.bit_length() - 1
+	sid = 'scrypt-' + str(log2N) + '-' + str(r) + '-' + str(p) + '-512'
+	scheme = {
+		'description': 'scrypt hash with N=2^' + str(log2N) + ', r=' +
+			str(r) + ', p=' + str(p) + ', 512-byte hash; calibrated for ' +
+			str(seconds) + ' s (measured ' + ('%.2f' % t) + ' s) on ' +
+			time.strftime('%Y-%m-%d'),
+		'hashfunctionid': 'scrypt',
+		'hashparams': {
+			'N':     N,
+			'r':     r,
+			'p':     p,
+			'dklen': 512
+			}
+		}
+	return sid, scheme, t
+
+
 provides = {
   'hashfunctions': {
     'scrypt': {
-      'f': _scrypt_hash
+      'f': _scrypt_hash,
+      'batch': _scrypt_hash_many,
+      'calibrate': _calibrate,
+      'cost': _cost,
+      'close': _close
     }
   },
   'hashschemes': {
@@ -108,6 +914,46 @@ provides = {
         'p':     1,
         'dklen': 512
       }
+    },
+    'scrypt-14-8-4-512': {
+      'description': 'scrypt hash with N=2^14, r=8, p=4, 512-byte hash',
+      'hashfunctionid': 'scrypt',
+      'hashparams': {
+        'N':     (1 << 14),
+        'r':     8,
+        'p':     4,
+        'dklen': 512
+      }
+    },
+    'scrypt-16-8-4-512': {
+      'description': 'scrypt hash with N=2^16, r=8, p=4, 512-byte hash',
+      'hashfunctionid': 'scrypt',
+      'hashparams': {
+        'N':     (1 << 16),
+        'r':     8,
+        'p':     4,
+        'dklen': 512
+      }
+    },
+    'scrypt-18-8-4-512': {
+      'description': 'scrypt hash with N=2^18, r=8, p=4, 512-byte hash',
+      'hashfunctionid': 'scrypt',
+      'hashparams': {
+        'N':     (1 << 18),
+        'r':     8,
+        'p':     4,
+        'dklen': 512
+      }
+    },
+    'scrypt-20-8-4-512': {
+      'description': 'scrypt hash with N=2^20, r=8, p=4, 512-byte hash',
+      'hashfunctionid': 'scrypt',
+      'hashparams': {
+        'N':     (1 << 20),
+        'r':     8,
+        'p':     4,
+        'dklen': 512
+      }
     }
   }
 }
@@ -0,0 +1,284 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+#
+# Checkpoints for long derivations in the pure Python engine.
+#
+# Where the Python engine is all there is, one large derivation runs for a
+# long time, and an interruption would throw all of that work away.  A
+# Checkpoint keeps ROMix's progress in a file under the config dir: the
+# rows of V written so far and, in one of two alternating state slots, the
+# lane and iteration reached, X, and the lanes already mixed.  A later
+# derivation with the same password, salt and parameters resumes from the
+# newest slot that checks out, and the file is wiped and removed once the
+# derivation completes.
+#
+# Everything in the file is derived from the master password, and V's
+# first row is just one PBKDF2 iteration away from it, so the file is
+# encrypted (SHAKE-256 keystream) and authenticated (keyed BLAKE2b) with
+# keys stretched from the password by PBKDF2, under a per-file nonce and
+# bound to the salt and the hash parameters.  That stretch is much cheaper
+# than the hash scheme itself, so a checkpoint on disk is a cheaper way to
+# test password guesses while it exists; checkpoints are off unless asked
+# for, and short-lived.
+#
+# File layout: header, slot 0, slot 1, then V (N rows of 128r bytes).
+#
+
+
+import os
+import time
+import hmac
+import struct
+import hashlib
+
+
+_magic = b'narvick1'
+_header = struct.Struct('>8s16sQQQ')
+# sequence number, lane, iterations of the lane done (of 2N)
+_slothead = struct.Struct('>QQQ')
+# keystream selector: kind, then two indexes
+_stream = struct.Struct('>cQQ')
+_maclen = 32
+
+# PBKDF2-HMAC-SHA256 iterations for the checkpoint keys
+_kdf_iterations = 200000
+
+# rows of V encrypted and written at a time
+_row_batch = 1024
+
+
+class Checkpoint(object):
+
+	def __init__(self, dirname, password, salt, N, r, p, interval):
+		self.N = N
+		self.r = r
+		self.p = p
+		self.interval = interval
+		self.blen = 128 * r
+		self._password = password
+		self._binding = salt + struct.pack('>QQQ', N, r, p)
+		self.path = os.path.join(dirname, 'checkpoint-' + hashlib.sha256(
+			b'narvi checkpoint\0' + self._binding).hexdigest()[:32])
+		self._slotsize = (_slothead.size + self.blen * (1 + p) + _maclen)
+		self._vbase = _header.size + 2 * self._slotsize
+		self._file = None
+		self._header = None
+		self._enckey = None
+		self._mackey = None
+		self._seq = 0
+		self._lane = 0
+		self._rows = 0
+		self._last = time.time()
+		self._failed = False
+
+	def _keys(self, nonce):
+		self._header = _header.pack(_magic, nonce, self.N, self.r, self.p)
+		key = hashlib.pbkdf2_hmac('sha256', self._password,
+			b'narvi checkpoint\0' + nonce + self._binding,
+			_kdf_iterations, 64)
+		self._enckey = key[:32]
+		self._mackey = key[32:]
+
+	def _xor(self, data, kind, i, j):
+		n = len(data)
+		stream = hashlib.shake_256(
+			self._enckey + _stream.pack(kind, i, j)).digest(n)
+		return (int.from_bytes(data, 'little') ^
+			int.from_bytes(stream, 'little')).to_bytes(n, 'little')
+
+	def _mac(self, head, X, mixed, V, rows):
+		h = hashlib.blake2b(key=self._mackey, digest_size=_maclen)
+		h.update(self._header)
+		h.update(head)
+		h.update(X)
+		h.update(mixed)
+		h.update(V[:rows * self.blen])
+		return h.digest()
+
+	def _slot(self, seq):
+		return _header.size + (seq % 2) * self._slotsize
+
+	def _restore(self, f, data, V):
+		# decrypt one slot, and the rows of V it needs, into V; returns
+		# (seq, lane, step, X, mixed), or None if the slot does not check out
+		blen = self.blen
+		head = data[:_slothead.size]
+		seq, lane, step = _slothead.unpack(head)
+		if lane >= self.p or step > 2 * self.N:
+			return None
+		pos = _slothead.size
+		X = self._xor(data[pos:pos + blen], b'X', seq, 0)
+		pos += blen
+		mixed = self._xor(data[pos:pos + self.p * blen], b'M', seq, 0)
+		pos += self.p * blen
+		rows = min(step, self.N)
+		f.seek(self._vbase)
+		for start in range(0, rows, _row_batch):
+			end = min(start + _row_batch, rows)
+			chunk = f.read((end - start) * blen)
+			if len(chunk) != (end - start) * blen:
+				return None
+			for row in range(start, end):
+				k = (row - start) * blen
+				V[row * blen:(row + 1) * blen] = self._xor(
+					chunk[k:k + blen], b'V', lane, row)
+		if not hmac.compare_digest(data[pos:pos + _maclen],
+			self._mac(head, X, mixed, V, rows)):
+			return None
+		return seq, lane, step, X, mixed[:lane * blen]
+
+	def resume(self, V):
+		# Restore the newest usable state into V; returns (lane, step, X,
+		# mixed) for the engine to carry on from, or None to start afresh.
+		try:
+			f = open(self.path, 'r+b')
+		except (IOError, OSError):
+			return None
+		try:
+			try:
+				magic, nonce, N, r, p = _header.unpack(f.read(_header.size))
+			except struct.error:
+				return None
+			if magic != _magic or (N, r, p) != (self.N, self.r, self.p):
+				return None
+			self._keys(nonce)
+			slots = []
+			for k in (0, 1):
+				f.seek(self._slot(k))
+				data = f.read(self._slotsize)
+				if len(data) == self._slotsize:
+					slots.append(data)
+			slots.sort(key=lambda d: _slothead.unpack_from(d)[0],
+				reverse=True)
+			for data in slots:
+				state = self._restore(f, data, V)
+				if state is not None:
+					break
+			else:
+				return None
+		except (IOError, OSError):
+			f.close()
+			return None
+		except BaseException:
+			f.close()
+			raise
+		if state is None:
+			f.close()
+			return None
+		seq, lane, step, X, mixed = state
+		print('INFO: resuming scrypt from checkpoint')
+		self._file = f
+		self._seq = seq
+		self._lane = lane
+		self._rows = min(step, self.N)
+		return lane, step, X, mixed
+
+	def _create(self):
+		fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC |
+			getattr(os, 'O_BINARY', 0), 0o600)
+		self._file = os.fdopen(fd, 'r+b')
+		self._keys(os.urandom(16))
+		self._file.write(self._header)
+		self._seq = 0
+		self._rows = 0
+
+	def _sync(self):
+		self._file.flush()
+		os.fsync(self._file.fileno())
+
+	def save(self, lane, step, X, mixed, V):
+		# V's new rows first, then the slot that refers to them, so that
+		# the other slot stays usable if this is cut short
+		if self._failed:
+			return
+		blen = self.blen
+		try:
+			if self._file is None:
+				self._create()
+			if lane != self._lane:
+				self._lane = lane
+				self._rows = 0
+			rows = min(step, self.N)
+			for start in range(self._rows, rows, _row_batch):
+				end = min(start + _row_batch, rows)
+				self._file.seek(self._vbase + start * blen)
+				self._file.write(b''.join([
+					self._xor(V[row * blen:(row + 1) * blen], b'V', lane, row)
+					for row in range(start, end)]))
+			if rows > self._rows:
+				self._rows = rows
+				self._sync()
+			self._seq += 1
+			head = _slothead.pack(self._seq, lane, step)
+			mixed = bytes(mixed) + bytes(self.p * blen - len(mixed))
+			self._file.seek(self._slot(self._seq))
+			self._file.write(head +
+				self._xor(X, b'X', self._seq, 0) +
+				self._xor(mixed, b'M', self._seq, 0) +
+				self._mac(head, X, mixed, V, rows))
+			self._sync()
+		except (IOError, OSError) as e:
+			print('INFO: scrypt checkpoint not saved:', e)
+			self._failed = True
+		self._last = time.time()
+
+	def hook(self, lane, mixed, V):
+		# the engine calls this as checkpoint(step, X) between chunks of a
+		# lane's SMix, and with now=True when it is interrupted
+		def checkpoint(step, X, now=False):
+			if now or time.time() - self._last >= self.interval:
+				self.save(lane, step, X, mixed, V)
+		return checkpoint
+
+	def next_lane(self, lane, X, mixed, V):
+		# record a finished lane before the next one overwrites V
+		if self._file is not None:
+			self.save(lane, 0, X, mixed, V)
+
+	def discard(self):
+		# wipe and remove the file, e.g. once the derivation is complete
+		if self._file is None:
+			try:
+				self._file = open(self.path, 'r+b')
+			except (IOError, OSError):
+				return
+		try:
+			self._file.seek(0, os.SEEK_END)
+			size = self._file.tell()
+			zeros = bytes(1 << 20)
+			self._file.seek(0)
+			for pos in range(0, size, len(zeros)):
+				self._file.write(zeros[:min(len(zeros), size - pos)])
+			self._sync()
+		finally:
+			self._file.close()
+			self._file = None
+			self._enckey = self._mackey = None
+			os.remove(self.path)
+
+
+__all__ = ['Checkpoint']
@@ -0,0 +1,188 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+#
+# scrypt on NumPy uint32 arrays, vectorized across independent SMix lanes.
+#
+# Every array is word-major with the lane index last: a 128r-byte block
+# for L lanes is a (32r, L) array, so each Salsa20/8 word operation is one
+# NumPy operation over all L lanes at once, and ROMix's V table is a single
+# contiguous (N, 32r, L) array.  The per-operation overhead of NumPy is
+# large compared to one 32-bit add, so this only pays off when there are
+# many lanes to share it: the p lanes of one derivation, or the lanes of
+# many derivations with the same N and r (see hash_many()).
+#
+
+
+import hashlib
+
+import numpy
+
+
+# below this many lanes, the pure Python engine is faster
+min_lanes = 32
+
+
+def _salsa20_8(B):
+	x = B.copy()
+	(x0, x1, x2, x3, x4, x5, x6, x7,
+	 x8, x9, x10, x11, x12, x13, x14, x15) = x
+	for i in range(4):
+		# columns
+		t = x0 + x12;  x4 ^= t << 7;   x4 ^= t >> 25
+		t = x4 + x0;   x8 ^= t << 9;   x8 ^= t >> 23
+		t = x8 + x4;   x12 ^= t << 13; x12 ^= t >> 19
+		t = x12 + x8;  x0 ^= t << 18;  x0 ^= t >> 14
+		t = x5 + x1;   x9 ^= t << 7;   x9 ^= t >> 25
+		t = x9 + x5;   x13 ^= t << 9;  x13 ^= t >> 23
+		t = x13 + x9;  x1 ^= t << 13;  x1 ^= t >> 19
+		t = x1 + x13;  x5 ^= t << 18;  x5 ^= t >> 14
+		t = x10 + x6;  x14 ^= t << 7;  x14 ^= t >> 25
+		t = x14 + x10; x2 ^= t << 9;   x2 ^= t >> 23
+		t = x2 + x14;  x6 ^= t << 13;  x6 ^= t >> 19
+		t = x6 + x2;   x10 ^= t << 18; x10 ^= t >> 14
+		t = x15 + x11; x3 ^= t << 7;   x3 ^= t >> 25
+		t = x3 + x15;  x7 ^= t << 9;   x7 ^= t >> 23
+		t = x7 + x3;   x11 ^= t << 13; x11 ^= t >> 19
+		t = x11 + x7;  x15 ^= t << 18; x15 ^= t >> 14
+		# rows
+		t = x0 + x3;   x1 ^= t << 7;   x1 ^= t >> 25
+		t = x1 + x0;   x2 ^= t << 9;   x2 ^= t >> 23
+		t = x2 + x1;   x3 ^= t << 13;  x3 ^= t >> 19
+		t = x3 + x2;   x0 ^= t << 18;  x0 ^= t >> 14
+		t = x5 + x4;   x6 ^= t << 7;   x6 ^= t >> 25
+		t = x6 + x5;   x7 ^= t << 9;   x7 ^= t >> 23
+		t = x7 + x6;   x4 ^= t << 13;  x4 ^= t >> 19
+		t = x4 + x7;   x5 ^= t << 18;  x5 ^= t >> 14
+		t = x10 + x9;  x11 ^= t << 7;  x11 ^= t >> 25
+		t = x11 + x10; x8 ^= t << 9;   x8 ^= t >> 23
+		t = x8 + x11;  x9 ^= t << 13;  x9 ^= t >> 19
+		t = x9 + x8;   x10 ^= t << 18; x10 ^= t >> 14
+		t = x15 + x14; x12 ^= t << 7;  x12 ^= t >> 25
+		t = x12 + x15; x13 ^= t << 9;  x13 ^= t >> 23
+		t = x13 + x12; x14 ^= t << 13; x14 ^= t >> 19
+		t = x14 + x13; x15 ^= t << 18; x15 ^= t >> 14
+	B += x
+
+
+def _blockmix_salsa8(Bin, Bout, r):
+	# Y_i = H(X xor B_i), with the even Y's going to the first half of
+	# Bout and the odd ones to the second half
+	X = Bin[(2 * r - 1) * 16:].copy()
+	for i in range(2 * r):
+		X ^= Bin[i * 16:(i + 1) * 16]
+		_salsa20_8(X)
+		o = (i // 2 + (i % 2) * r) * 16
+		Bout[o:o + 16] = X
+
+
+# SMix iterations between progress() calls
+_progress_chunk = 16
+
+
+def _smix(X, N, r, scratch=None, progress=None):
+	# progress, if given, is called with the number of lane iterations (of
+	# 2N per lane) just completed, every _progress_chunk iterations
+	lanes = X.shape[1]
+	if scratch is None:
+		V = numpy.empty((N, 32 * r, lanes), dtype=numpy.uint32)
+	else:
+		V = numpy.frombuffer(scratch, dtype=numpy.uint32,
+			count=N * 32 * r * lanes).reshape(N, 32 * r, lanes)
+	Y = numpy.empty_like(X)
+	for start in range(0, N, _progress_chunk):
+		end = min(start + _progress_chunk, N)
+		for i in range(start, end):
+			V[i] = X
+			_blockmix_salsa8(X, Y, r)
+			X, Y = Y, X
+		if progress is not None:
+			progress((end - start) * lanes)
+	lanesidx = numpy.arange(lanes)
+	for start in range(0, N, _progress_chunk):
+		end = min(start + _progress_chunk, N)
+		for i in range(start, end):
+			j = X[(2 * r - 1) * 16] & (N - 1)
+			X ^= V[j, :, lanesidx].T
+			_blockmix_salsa8(X, Y, r)
+			X, Y = Y, X
+		if progress is not None:
+			progress((end - start) * lanes)
+	return X
+
+
+def _to_lanes(buf, lanes, r):
+	return numpy.frombuffer(buf, dtype='<u4').reshape(
+		lanes, 32 * r).T.astype(numpy.uint32, order='C')
+
+
+def _from_lanes(X):
+	return X.T.astype('<u4').tobytes()
+
+
+def mix(password, salt, N, r, p, scratch=None, progress=None):
+	# scrypt up to, but not including, the final PBKDF2: the p * 128r bytes
+	# of mixed lanes.  scratch, if given, is a writable buffer of at least
+	# 128rNp bytes to use for V instead of allocating it
+	if N < 2 or (N & (N - 1)):
+		raise ValueError('N must be a power of 2 greater than 1')
+	B = hashlib.pbkdf2_hmac('sha256', password, salt, 1, p * 128 * r)
+	return _from_lanes(_smix(_to_lanes(B, p, r), N, r, scratch, progress))
+
+
+def hash(password, salt, N, r, p, dklen, scratch=None):
+	return hashlib.pbkdf2_hmac('sha256', password,
+		mix(password, salt, N, r, p, scratch), 1, dklen)
+
+
+def mix_many(jobs, N, r, progress=None):
+	# jobs is a list of (password, salt, p); all of their lanes run through
+	# one SMix in lockstep, lane k of the arrays belonging to the k'th lane
+	# overall.  Returns the mixed lanes of each job, as mix() does
+	if N < 2 or (N & (N - 1)):
+		raise ValueError('N must be a power of 2 greater than 1')
+	B = b''.join([
+		hashlib.pbkdf2_hmac('sha256', password, salt, 1, p * 128 * r)
+		for password, salt, p in jobs])
+	lanes = len(B) // (128 * r)
+	X = _from_lanes(_smix(_to_lanes(B, lanes, r), N, r, None, progress))
+	mixes = []
+	pos = 0
+	for password, salt, p in jobs:
+		mixes.append(X[pos:pos + p * 128 * r])
+		pos += p * 128 * r
+	return mixes
+
+
+def hash_many(jobs, N, r):
+	# jobs is a list of (password, salt, p, dklen)
+	mixes = mix_many([(password, salt, p)
+		for password, salt, p, dklen in jobs], N, r)
+	return [hashlib.pbkdf2_hmac('sha256', password, B, 1, dklen)
+		for (password, salt, p, dklen), B in zip(jobs, mixes)]
+
+
+__all__ = ['hash', 'hash_many', 'min_lanes', 'mix', 'mix_many']
@@ -0,0 +1,295 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+#
+# Compact pure Python scrypt, using only the standard library.
+#
+# ROMix's V table is a single preallocated buffer of exactly 128rN bytes
+# that is written and read through a memoryview, and a 128r-byte block
+# travels between steps as a bytes object.  Whole-block XORs are done by
+# converting both blocks to Python ints, so only Salsa20/8 itself runs in
+# interpreted code, with its state held in local variables.
+#
+
+
+import hashlib
+import struct
+import operator
+
+
+def _salsa20_8_xor(x, b):
+	# returns Salsa20/8(x xor b) for two 16-word sequences; the state words
+	# may grow past 32 bits between rounds, but every sum that feeds a
+	# rotation or the result is masked
+	(j0, j1, j2, j3, j4, j5, j6, j7,
+	 j8, j9, j10, j11, j12, j13, j14, j15) = map(operator.xor, x, b)
+	x0, x1, x2, x3, x4, x5, x6, x7 = j0, j1, j2, j3, j4, j5, j6, j7
+	x8, x9, x10, x11, x12, x13, x14, x15 = j8, j9, j10, j11, j12, j13, j14, j15
+	for i in (8, 6, 4, 2):
+		# columns
+		t = (x0 + x12) & 0xffffffff
+		x4 ^= (t << 7) | (t >> 25)
+		t = (x4 + x0) & 0xffffffff
+		x8 ^= (t << 9) | (t >> 23)
+		t = (x8 + x4) & 0xffffffff
+		x12 ^= (t << 13) | (t >> 19)
+		t = (x12 + x8) & 0xffffffff
+		x0 ^= (t << 18) | (t >> 14)
+		t = (x5 + x1) & 0xffffffff
+		x9 ^= (t << 7) | (t >> 25)
+		t = (x9 + x5) & 0xffffffff
+		x13 ^= (t << 9) | (t >> 23)
+		t = (x13 + x9) & 0xffffffff
+		x1 ^= (t << 13) | (t >> 19)
+		t = (x1 + x13) & 0xffffffff
+		x5 ^= (t << 18) | (t >> 14)
+		t = (x10 + x6) & 0xffffffff
+		x14 ^= (t << 7) | (t >> 25)
+		t = (x14 + x10) & 0xffffffff
+		x2 ^= (t << 9) | (t >> 23)
+		t = (x2 + x14) & 0xffffffff
+		x6 ^= (t << 13) | (t >> 19)
+		t = (x6 + x2) & 0xffffffff
+		x10 ^= (t << 18) | (t >> 14)
+		t = (x15 + x11) & 0xffffffff
+		x3 ^= (t << 7) | (t >> 25)
+		t = (x3 + x15) & 0xffffffff
+		x7 ^= (t << 9) | (t >> 23)
+		t = (x7 + x3) & 0xffffffff
+		x11 ^= (t << 13) | (t >> 19)
+		t = (x11 + x7) & 0xffffffff
+		x15 ^= (t << 18) | (t >> 14)
+		# rows
+		t = (x0 + x3) & 0xffffffff
+		x1 ^= (t << 7) | (t >> 25)
+		t = (x1 + x0) & 0xffffffff
+		x2 ^= (t << 9) | (t >> 23)
+		t = (x2 + x1) & 0xffffffff
+		x3 ^= (t << 13) | (t >> 19)
+		t = (x3 + x2) & 0xffffffff
+		x0 ^= (t << 18) | (t >> 14)
+		t = (x5 + x4) & 0xffffffff
+		x6 ^= (t << 7) | (t >> 25)
+		t = (x6 + x5) & 0xffffffff
+		x7 ^= (t << 9) | (t >> 23)
+		t = (x7 + x6) & 0xffffffff
+		x4 ^= (t << 13) | (t >> 19)
+		t = (x4 + x7) & 0xffffffff
+		x5 ^= (t << 18) | (t >> 14)
+		t = (x10 + x9) & 0xffffffff
+		x11 ^= (t << 7) | (t >> 25)
+		t = (x11 + x10) & 0xffffffff
+		x8 ^= (t << 9) | (t >> 23)
+		t = (x8 + x11) & 0xffffffff
+		x9 ^= (t << 13) | (t >> 19)
+		t = (x9 + x8) & 0xffffffff
+		x10 ^= (t << 18) | (t >> 14)
+		t = (x15 + x14) & 0xffffffff
+		x12 ^= (t << 7) | (t >> 25)
+		t = (x12 + x15) & 0xffffffff
+		x13 ^= (t << 9) | (t >> 23)
+		t = (x13 + x12) & 0xffffffff
+		x14 ^= (t << 13) | (t >> 19)
+		t = (x14 + x13) & 0xffffffff
+		x15 ^= (t << 18) | (t >> 14)
+	return (
+		(x0 + j0) & 0xffffffff, (x1 + j1) & 0xffffffff,
+		(x2 + j2) & 0xffffffff, (x3 + j3) & 0xffffffff,
+		(x4 + j4) & 0xffffffff, (x5 + j5) & 0xffffffff,
+		(x6 + j6) & 0xffffffff, (x7 + j7) & 0xffffffff,
+		(x8 + j8) & 0xffffffff, (x9 + j9) & 0xffffffff,
+		(x10 + j10) & 0xffffffff, (x11 + j11) & 0xffffffff,
+		(x12 + j12) & 0xffffffff, (x13 + j13) & 0xffffffff,
+		(x14 + j14) & 0xffffffff, (x15 + j15) & 0xffffffff)
+
+
+def _blockmix_salsa8(B, r, words):
+	# Y_i = H(Y_{i-1} xor B_i); the output is the even Y's then the odd
+	w = words.unpack(B)
+	x = w[-16:]
+	y = []
+	for i in range(0, 32 * r, 16):
+		x = _salsa20_8_xor(x, w[i:i + 16])
+		y.append(x)
+	return words.pack(*[v for blk in (y[0::2] + y[1::2]) for v in blk])
+
+
+# SMix iterations between progress() calls
+_progress_chunk = 16
+
+
+def _smix(B, N, r, V, progress=None, step=0, checkpoint=None):
+	# B is one 128r-byte lane, V a writable buffer of at least 128rN bytes;
+	# progress, if given, is called with the number of iterations (of 2N)
+	# just completed, every _progress_chunk iterations.  To resume part
+	# way, step is the number of iterations already done, B is X as it was
+	# then, and V holds the rows written so far.  checkpoint, if given, is
+	# called as checkpoint(step, X) after each chunk, and with now=True if
+	# the lane is interrupted.
+	blen = 128 * r
+	words = struct.Struct('<' + str(32 * r) + 'I')
+	last = blen - 64
+	frombytes = int.from_bytes
+	X = B
+	saved = (step, X)
+	try:
+		for start in range(min(step, N), N, _progress_chunk):
+			end = min(start + _progress_chunk, N)
+			for i in range(start, end):
+				V[i * blen:(i + 1) * blen] = X
+				X = _blockmix_salsa8(X, r, words)
+			saved = (end, X)
+			if progress is not None:
+				progress(end - start)
+			if checkpoint is not None:
+				checkpoint(end, X)
+		for start in range(max(step, N) - N, N, _progress_chunk):
+			end = min(start + _progress_chunk, N)
+			for i in range(start, end):
+				j = frombytes(X[last:last + 4], 'little') & (N - 1)
+				X = (frombytes(X, 'little') ^
+					frombytes(V[j * blen:(j + 1) * blen], 'little')).to_bytes(
+						blen, 'little')
+				X = _blockmix_salsa8(X, r, words)
+			saved = (N + end, X)
+			if progress is not None:
+				progress(end - start)
+			if checkpoint is not None:
+				checkpoint(N + end, X)
+	except BaseException:
+		if checkpoint is not None:
+			checkpoint(*saved, now=True)
+		raise
+	return X
+
+
+def _smix_checkpointed(B, N, r, p, V, progress, checkpoint):
+	# the lanes in turn, resuming from and saving to checkpoint (a
+	# checkpoint.Checkpoint), which is discarded once all are done
+	blen = 128 * r
+	lane, step, X, mixed = 0, 0, B[:blen], b''
+	state = checkpoint.resume(V)
+	if state is not None:
+		lane, step, X, mixed = state
+		if progress is not None:
+			progress(2 * N * lane + step)
+	while lane < p:
+		mixed += _smix(X, N, r, V, progress, step,
+			checkpoint.hook(lane, mixed, V))
+		lane += 1
+		step = 0
+		X = B[lane * blen:(lane + 1) * blen]
+		if lane < p:
+			checkpoint.next_lane(lane, X, mixed, V)
+	checkpoint.discard()
+	return mixed
+
+
+def _smix_lane(args):
+	# one lane in a worker process, with its own V
+	B, N, r = args
+	V = memoryview(bytearray(128 * r * N))
+	try:
+		return _smix(B, N, r, V)
+	finally:
+		V.release()
+
+
+def _smix_lanes(B, N, r, p, workers, progress=None):
+	# the p lanes are independent; with fork(), run them in worker processes.
+	# progress hears about each lane as it completes, and is called with 0
+	# while waiting, so that it can abandon the computation (which kills
+	# the workers)
+	import multiprocessing
+	blen = 128 * r
+	lanes = [B[i * blen:(i + 1) * blen] for i in range(p)]
+	try:
+		context = multiprocessing.get_context('fork')
+	except ValueError:
+		V = memoryview(bytearray(blen * N))
+		try:
+			return b''.join([_smix(lane, N, r, V, progress)
+				for lane in lanes])
+		finally:
+			V.release()
+	pool = context.Pool(min(workers, p))
+	try:
+		results = pool.imap(_smix_lane,
+			[(lane, N, r) for lane in lanes], 1)
+		mixed = []
+		while len(mixed) < p:
+			try:
+				mixed.append(results.next(0.1))
+			except multiprocessing.TimeoutError:
+				if progress is not None:
+					progress(0)
+				continue
+			if progress is not None:
+				progress(2 * N)
+		return b''.join(mixed)
+	finally:
+		pool.terminate()
+		pool.join()
+
+
+def mix(password, salt, N, r, p, scratch=None, workers=1, progress=None,
+	checkpoint=None):
+	# scrypt up to, but not including, the final PBKDF2: the p * 128r bytes
+	# of mixed lanes.  scratch, if given, is a writable buffer of at least
+	# 128rN bytes to use for V instead of allocating it; otherwise, up to
+	# workers lanes are computed at once, each in its own process with its
+	# own V.  progress is as for _smix().  With a checkpoint (see
+	# checkpoint.py), the lanes run one at a time in this process, and the
+	# derivation resumes from and saves its progress to the checkpoint.
+	if N < 2 or (N & (N - 1)):
+		raise ValueError('N must be a power of 2 greater than 1')
+	blen = 128 * r
+	if scratch is None and workers > 1 and p > 1 and checkpoint is None:
+		B = hashlib.pbkdf2_hmac('sha256', password, salt, 1, p * blen)
+		return _smix_lanes(B, N, r, p, workers, progress)
+	if scratch is None:
+		V = memoryview(bytearray(blen * N))
+	else:
+		V = memoryview(scratch)
+		if V.nbytes < blen * N:
+			V.release()
+			raise ValueError('scratch buffer is too small')
+	B = hashlib.pbkdf2_hmac('sha256', password, salt, 1, p * blen)
+	try:
+		if checkpoint is not None:
+			return _smix_checkpointed(B, N, r, p, V, progress, checkpoint)
+		return b''.join([_smix(B[i * blen:(i + 1) * blen], N, r, V, progress)
+			for i in range(p)])
+	finally:
+		V.release()
+
+
+def hash(password, salt, N, r, p, dklen, scratch=None, workers=1):
+	return hashlib.pbkdf2_hmac('sha256', password,
+		mix(password, salt, N, r, p, scratch, workers), 1, dklen)
+
+
+__all__ = ['hash', 'mix']
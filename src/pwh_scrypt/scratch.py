@@ -0,0 +1,261 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+#
+# Scratch memory for the scrypt engines.
+#
+# ROMix's V table is 128rN bytes, which for the larger hash schemes can be
+# more than a small machine has.  A MappedScratch puts V in a memory-mapped
+# temporary file instead, so that the kernel can page it out to disk rather
+# than the process being killed; the derivation gets slower, not fatal.
+#
+# At the other end, a process doing many derivations should not pay for
+# mapping, first-touch faulting and unmapping hundreds of MiB every time.
+# A ScratchPool hands out pre-faulted anonymous mappings by size and takes
+# them back, wiped, for the next derivation.  It keeps those of the size
+# last given back only, so that a process that moves on to another hash
+# scheme does not hold on to the last one's memory, and clear() unmaps
+# them all at the end of a session.
+#
+# ROMix's second loop reads V at random offsets across the whole table,
+# which with 4 KiB pages is mostly TLB misses.  With hugepages, anonymous
+# scratch comes from MAP_HUGETLB memory if the system has huge pages
+# reserved, or else is advised MADV_HUGEPAGE for transparent huge pages;
+# if neither is available it is ordinary memory.
+#
+
+
+import os
+import sys
+import mmap
+import tempfile
+import threading
+
+
+if hasattr(mmap, 'MAP_HUGETLB'):
+	_MAP_HUGETLB = mmap.MAP_HUGETLB
+elif sys.platform.startswith('linux'):
+	_MAP_HUGETLB = 0x40000
+else:
+	_MAP_HUGETLB = 0
+
+
+def scrypt_size(N, r, p):
+	# enough for V, B and XY at 64-byte alignment in any of the engines
+	return 128 * r * (N + p + 2) + 128
+
+
+def _windows_memory_status():
+	try:
+		import ctypes
+		class MEMORYSTATUSEX(ctypes.Structure):
+			_fields_ = [
+				('dwLength',                ctypes.c_ulong),
+				('dwMemoryLoad',            ctypes.c_ulong),
+				('ullTotalPhys',            ctypes.c_ulonglong),
+				('ullAvailPhys',            ctypes.c_ulonglong),
+				('ullTotalPageFile',        ctypes.c_ulonglong),
+				('ullAvailPageFile',        ctypes.c_ulonglong),
+				('ullTotalVirtual',         ctypes.c_ulonglong),
+				('ullAvailVirtual',         ctypes.c_ulonglong),
+				('ullAvailExtendedVirtual', ctypes.c_ulonglong)
+				]
+		status = MEMORYSTATUSEX()
+		status.dwLength = ctypes.sizeof(status)
+		if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+			return status
+	except Exception:
+		pass
+	return None
+
+
+def physical_memory():
+	# total physical memory in bytes, or None if it cannot be determined
+	try:
+		return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+	except (AttributeError, ValueError, OSError):
+		pass
+	status = _windows_memory_status()
+	if status:
+		return status.ullTotalPhys
+	return None
+
+
+def available_memory():
+	# physical memory that can be used without swapping, in bytes, or the
+	# total if that cannot be determined
+	try:
+		with open('/proc/meminfo') as f:
+			for l in f:
+				if l.startswith('MemAvailable:'):
+					return int(l.split()[1]) * 1024
+	except (IOError, ValueError, IndexError):
+		pass
+	status = _windows_memory_status()
+	if status:
+		return status.ullAvailPhys
+	return physical_memory()
+
+
+def exceeds_memory(size, fraction):
+	total = physical_memory()
+	if not total or fraction <= 0:
+		return False
+	return size > total * fraction
+
+
+class _Scratch(object):
+
+	_wipechunk = 1 << 20
+	_zeros = None
+
+	def wipe(self):
+		# one chunk of zeros, shared, rather than a fresh one per wipe
+		if _Scratch._zeros is None:
+			_Scratch._zeros = memoryview(bytes(self._wipechunk))
+		zeros = _Scratch._zeros
+		for pos in range(0, self.size, self._wipechunk):
+			n = min(self._wipechunk, self.size - pos)
+			self.map[pos:pos + n] = zeros[:n]
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, exc_trace):
+		self.close()
+		return False
+
+
+def _hugepage_size():
+	try:
+		with open('/proc/meminfo') as f:
+			for l in f:
+				if l.startswith('Hugepagesize:'):
+					return int(l.split()[1]) * 1024
+	except (IOError, ValueError, IndexError):
+		pass
+	return 2 << 20
+
+
+def _hugetlb_map(size):
+	if not _MAP_HUGETLB or not hasattr(mmap, 'MAP_PRIVATE'):
+		return None
+	pagesize = _hugepage_size()
+	length = (size + pagesize - 1) // pagesize * pagesize
+	try:
+		return mmap.mmap(-1, length,
+			flags=mmap.MAP_PRIVATE | mmap.MAP_ANONYMOUS | _MAP_HUGETLB)
+	except (OSError, ValueError):
+		return None
+
+
+class AnonymousScratch(_Scratch):
+
+	def __init__(self, size, hugepages=False):
+		self.size = size
+		self.hugepages = hugepages
+		self.map = None
+		if hugepages:
+			self.map = _hugetlb_map(size)
+		if self.map is None:
+			self.map = mmap.mmap(-1, size)
+			if hugepages:
+				try:
+					self.map.madvise(mmap.MADV_HUGEPAGE)
+				except (AttributeError, OSError):
+					pass
+		self.buffer = memoryview(self.map)
+		# fault every page in now rather than during the derivation
+		self.wipe()
+
+	def close(self):
+		self.buffer.release()
+		self.map.close()
+
+
+class MappedScratch(_Scratch):
+
+	def __init__(self, size, dirname=None):
+		self.size = size
+		self.file = tempfile.TemporaryFile(prefix='scratch', dir=dirname)
+		try:
+			self.file.truncate(size)
+			self.map = mmap.mmap(self.file.fileno(), size)
+		except Exception:
+			self.file.close()
+			raise
+		# ROMix's second loop reads V at random; readahead only hurts
+		try:
+			self.map.madvise(mmap.MADV_RANDOM)
+		except (AttributeError, OSError):
+			pass
+		self.buffer = memoryview(self.map)
+
+	def close(self):
+		# V is derived from the master password, so it must not be left
+		# behind in the file's disk blocks
+		self.buffer.release()
+		self.wipe()
+		self.map.flush()
+		self.map.close()
+		self.file.close()
+
+
+class ScratchPool(object):
+
+	def __init__(self):
+		self._free = {}
+		self._lock = threading.Lock()
+
+	def acquire(self, size, hugepages=False):
+		with self._lock:
+			try:
+				return self._free[(size, hugepages)].pop()
+			except (KeyError, IndexError):
+				pass
+		return AnonymousScratch(size, hugepages)
+
+	def release(self, scratch):
+		scratch.wipe()
+		key = (scratch.size, scratch.hugepages)
+		with self._lock:
+			stale = [s for k in self._free if k != key for s in self._free[k]]
+			self._free = {key: self._free.get(key, []) + [scratch]}
+		for s in stale:
+			s.close()
+
+	def clear(self):
+		with self._lock:
+			free = self._free
+			self._free = {}
+		for size in free:
+			for scratch in free[size]:
+				scratch.close()
+
+
+__all__ = [
+	'AnonymousScratch', 'MappedScratch', 'ScratchPool',
+	'available_memory', 'exceeds_memory', 'physical_memory', 'scrypt_size']
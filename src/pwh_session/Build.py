@@ -24,27 +24,7 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
-@build_step('pyscrypt', [], ['zipcontents'])
-def build_pyscrypt(build):
-	pyscryptsrcfile = 'pyscrypt-1.6.1.tar.gz'
-	pyscryptmoddir  = 'pyscrypt-1.6.1/pyscrypt/'
-
-	zipdir = 'pwhash/plugins/pwh_scrypt/pyscrypt/'
-
-	objdir = os.path.join(build.objroot, 'pyscrypt')
-	os.mkdir(objdir)
-
-	import tarfile
-
-	tgzfile = os.path.join(build.srcdir, pyscryptsrcfile)
-	tar = tarfile.open(tgzfile, 'r')
-	for m in tar.getmembers():
-		if not m.name.startswith(pyscryptmoddir):
-			continue
-		objfilename = os.path.join(objdir, m.name[len(pyscryptmoddir):])
-		zipfilename = zipdir + m.name[len(pyscryptmoddir):]
-		f = tar.extractfile(m)
-		shutil.copyfileobj(f, open(objfilename, 'wb'))
-		build.zipcontents[zipfilename] = objfilename
-
+@build_step('pwh_session', [], ['zipcontents'])
+def build_pwh_session(build):
+	build.zipcontents['pwhash/plugins/pwh_session.py'] = os.path.join(build.srcdir, 'pwh_session.py')
 
@@ -0,0 +1,238 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+#
+# Session-keyed hashing: pay for scrypt once per session, not per salt.
+#
+# A session scheme runs its expensive root hash function (scrypt) once on
+# the master password, with a random salt of the scheme's profile as the
+# salt.  The result is an intermediate key, from which each salt's key
+# material is derived with HKDF-SHA256 (RFC 5869) in microseconds.  The
+# intermediate key is kept in this process's memory only, until the
+# session ends (PWHash.close()), so every salt after the first in a
+# session is almost free.
+#
+# The intermediate key is as good as the master password for every salt
+# under the profile.  And a guess at the master password costs one scrypt
+# however many account passwords an attacker holds, rather than one per
+# salt.  The profile's salt, made the first time the profile is used,
+# keeps that guessing specific to this installation: it is stored in a
+# file under the config dir rather than in the config, as hashing must not
+# write the config, and is added to under a lock, so that processes
+# making it at once agree on one.  Losing the file loses the passwords of
+# every salt under a session scheme.
+#
+
+
+import os
+import hmac
+import errno
+import json
+import hashlib
+import binascii
+import threading
+
+
+_intermediate_len = 32
+
+_salt_file = 'session-salts'
+
+# (root function, profile, profile salt, root params) -> (check, key)
+_sessions = {}
+
+# (config dir, profile) -> profile salt
+_salts = {}
+
+_lock = threading.Lock()
+
+
+def _hkdf(ikm, salt, info, length):
+	prk = hmac.new(salt, ikm, hashlib.sha256).digest()
+	okm = bytearray(length)
+	t = b''
+	for i in range((length + 31) // 32):
+		t = hmac.new(prk, t + info + bytes([i + 1]), hashlib.sha256).digest()
+		n = min(32, length - 32 * i)
+		okm[32 * i:32 * i + n] = t[:n]
+	return okm
+
+
+def _check(key, password):
+	# whether a cached intermediate key came from this master password
+	return hmac.new(key, b'narvi session\0' + password,
+		hashlib.sha256).digest()
+
+
+def _read_salts(path):
+	# Only a missing file means no salts yet: a file that cannot be read
+	# is left alone, as writing over it would lose the other profiles'
+	# salts, and with them their passwords.
+	from .. import PWHashError
+	try:
+		with open(path, 'r') as f:
+			salts = json.loads(f.read())
+	except (IOError, OSError) as e:
+		if e.errno == errno.ENOENT:
+			return {}
+		raise PWHashError('Cannot read session salts from ' + path + ': ' +
+			str(e))
+	except ValueError as e:
+		raise PWHashError('Session salts file ' + path + ' is corrupt: ' +
+			str(e))
+	if not isinstance(salts, dict) or not all(
+		isinstance(v, str) for v in salts.values()):
+		raise PWHashError('Session salts file ' + path + ' is corrupt.')
+	return salts
+
+
+def _profile_salt(pwh, profile):
+	# the profile's salt, made and saved if this is its first use
+	from .. import admission
+	with _lock:
+		salt = _salts.get((pwh.config_dir, profile))
+	if salt:
+		return salt
+	if not os.path.isdir(pwh.config_dir):
+		os.makedirs(pwh.config_dir, exist_ok=True)
+	path = os.path.join(pwh.config_dir, _salt_file)
+	with admission.FileLock(path + '.lock'):
+		salts = _read_salts(path)
+		if profile not in salts:
+			salts[profile] = binascii.hexlify(os.urandom(32)).decode()
+			tmp = path + '.' + str(os.getpid())
+			with open(tmp, 'w') as f:
+				f.write(json.dumps(salts, sort_keys=True, indent=4))
+				f.write('\n')
+			os.replace(tmp, path)
+	with _lock:
+		_salts[(pwh.config_dir, profile)] = salts[profile]
+	return salts[profile]
+
+
+def _intermediate(pwh, params, profilesalt, pw, progress, cancel):
+	try:
+		f = pwh.hashfunctions[params['rootfunctionid']]['f']
+	except KeyError:
+		from .. import PWHashError
+		raise PWHashError('Hash function \'' + params['rootfunctionid'] +
+			'\' not available.')
+	rootparams = dict(params['rootparams'], dklen=_intermediate_len)
+	from .. import keymaterial
+	km = keymaterial.as_key_material(
+		f(pwh, rootparams, pw, profilesalt, progress, cancel))
+	try:
+		return bytearray(km[:_intermediate_len])
+	finally:
+		km.wipe()
+
+
+def _session_hash(pwh, params, pw, salt, progress=None, cancel=None):
+	# The cached key is read under the lock, so that forget() cannot wipe
+	# it part way through.
+	profilesalt = _profile_salt(pwh, params['profile'])
+	ident = (params['rootfunctionid'], params['profile'], profilesalt,
+		json.dumps(params['rootparams'], sort_keys=True))
+	password = pw.encode('utf-8')
+	info = b'narvi account key'
+	with _lock:
+		cached = _sessions.get(ident)
+		if cached and hmac.compare_digest(cached[0],
+			_check(cached[1], password)):
+			return _hkdf(cached[1], salt.encode('utf-8'), info,
+				params['dklen'])
+	key = _intermediate(pwh, params, profilesalt, pw, progress, cancel)
+	okm = _hkdf(key, salt.encode('utf-8'), info, params['dklen'])
+	with _lock:
+		_sessions[ident] = (_check(key, password), key)
+	return okm
+
+
+def _session_cost(pwh, params, probe=False):
+	# what the root costs, for the first salt of a session
+	try:
+		cost = pwh.hashfunctions[params['rootfunctionid']]['cost']
+	except KeyError:
+		return None
+	return cost(pwh, dict(params['rootparams'], dklen=_intermediate_len),
+		probe)
+
+
+def forget():
+	# wipe and drop every intermediate key held for this session
+	with _lock:
+		sessions = list(_sessions.values())
+		_sessions.clear()
+	for check, key in sessions:
+		key[:] = bytes(len(key))
+
+
+def _session_close(pwh):
+	forget()
+
+
+provides = {
+  'hashfunctions': {
+    'session': {
+      'f': _session_hash,
+      'cost': _session_cost,
+      'close': _session_close
+    }
+  },
+  'hashschemes': {
+    'session-scrypt-18-8-1-512': {
+      'description': 'scrypt with N=2^18, r=8, p=1 once per session on the master password, then HKDF-SHA256 per salt; 512-byte hash',
+      'hashfunctionid': 'session',
+      'hashparams': {
+        'rootfunctionid': 'scrypt',
+        'rootparams': {
+          'N': (1 << 18),
+          'r': 8,
+          'p': 1
+        },
+        'profile': 'narvi',
+        'dklen': 512
+      }
+    },
+    'session-scrypt-20-8-1-512': {
+      'description': 'scrypt with N=2^20, r=8, p=1 once per session on the master password, then HKDF-SHA256 per salt; 512-byte hash',
+      'hashfunctionid': 'session',
+      'hashparams': {
+        'rootfunctionid': 'scrypt',
+        'rootparams': {
+          'N': (1 << 20),
+          'r': 8,
+          'p': 1
+        },
+        'profile': 'narvi',
+        'dklen': 512
+      }
+    }
+  }
+}
+
+
+__all__ = ['forget', 'provides']
+
@@ -26,76 +26,104 @@
 
 import re
 import base64
+import struct
 
 
-def _complexity_score(pword, tests):
-	score = 0
-	for t in tests:
-		if re.search(t['regex'], pword):
-			score += t['value']
-	return score
+#
+# Each word function has a compile function that does the work that depends
+# only on the word scheme (resolving the encoder, compiling the complexity
+# regexes, working out alphabet limits) and returns a function of the key
+# material alone.  PWHash compiles a word scheme once and keeps the result;
+# the word functions themselves compile on every call.
+#
 
 
-def _is_sufficiently_complex(pword, params):
+# Key material is encoded a whole number of groups at a time, 32 characters
+# per piece, which seldom reads past the first block that lazy key material
+# computes and seldom leaves a password short.
+_base64_chunk = 24
+_base32_chunk = 20
+
+
+def _compile_complexity(params):
+	# a test of whether a password is complex enough
 	try:
 		c = params['complexity']
 	except KeyError:
-		return True
-	if _complexity_score(pword, c['tests']) < c['minimumscore']:
-		return False
-	else:
-		return True
+		return lambda pword: True
+	tests = [(re.compile(t['regex']).search, t['value']) for t in c['tests']]
+	minimumscore = c['minimumscore']
+	def _is_sufficiently_complex(pword):
+		score = 0
+		for search, value in tests:
+			if search(pword):
+				score += value
+		return score >= minimumscore
+	return _is_sufficiently_complex
 
 
-def _basic_encoder(pwh, params, keymaterial):
-	e = pwh.wordfunctions[params['encoder']]['f']
-	ekm = e(pwh, params, keymaterial, True)
+def _compile_basic_encoder(pwh, params):
+	# The encoder yields encoded key material a piece at a time, reading
+	# only as much key material as it needs, so lazily computed key material
+	# is only computed as far as the window below has to slide.
+	encoder = pwh.wordfunctions[params['encoder']]
+	if 'compile' in encoder:
+		e = encoder['compile'](pwh, params)
+	else:
+		f = encoder['f']
+		e = lambda keymaterial: f(pwh, params, keymaterial, True)
 	pwlen = params['pwlen']
-	pos = 0
-	while pos + pwlen <= len(ekm):
-		password = ekm[pos:(pos + pwlen)]
-		if _is_sufficiently_complex(password, params):
-			return password
-		pos += 1
-	return None
+	is_sufficiently_complex = _compile_complexity(params)
+	def _basic_encoder(keymaterial):
+		ekm = ''
+		pos = 0
+		for piece in e(keymaterial):
+			ekm += piece
+			while pos + pwlen <= len(ekm):
+				password = ekm[pos:(pos + pwlen)]
+				if is_sufficiently_complex(password):
+					return password
+				pos += 1
+		return None
+	return _basic_encoder
 
 
-def _base64_encode(pwh, params, keymaterial, isencoder=False):
-	if not isencoder: raise ValueError
-	ekm = base64.b64encode(keymaterial, params['altchars'].encode())
-	# ignore any final padding
-	return ekm[:-4].decode()
+def _compile_base64(pwh, params):
+	altchars = params['altchars'].encode()
+	def _base64_encode(keymaterial):
+		# ignore the final group, which may be padded
+		end = 3 * ((len(keymaterial) + 2) // 3 - 1)
+		for pos in range(0, end, _base64_chunk):
+			yield base64.b64encode(
+				keymaterial[pos:min(pos + _base64_chunk, end)], altchars).decode()
+	return _base64_encode
 
 
-def _base32_encode(pwh, params, keymaterial, isencoder=False):
-	if not isencoder: raise ValueError
-	ekm = base64.b32encode(keymaterial)
-	# ignore any final padding
-	return ekm[:-8].decode()
+def _compile_base32(pwh, params):
+	def _base32_encode(keymaterial):
+		# ignore the final group, which may be padded
+		end = 5 * ((len(keymaterial) + 4) // 5 - 1)
+		for pos in range(0, end, _base32_chunk):
+			yield base64.b32encode(
+				keymaterial[pos:min(pos + _base32_chunk, end)]).decode()
+	return _base32_encode
 
 
-def _mindex1_encode(pwh, params, keymaterial, isencoder=False):
-	if not isencoder: raise ValueError
-	import struct
+def _compile_mindex1(pwh, params):
 	alphabet = params['alphabet']
 	divisor = len(alphabet)
 	if divisor > 256:
 		raise ValueError()
 	limit = 256 - (256 % divisor)
-	s = struct.Struct('=B')
-	ekm = ''
-	pos = 0
-	for c in keymaterial:
-		b = s.unpack(c)[0]
-		pos += 1
-		if b < limit:
-			ekm += alphabet[b % divisor]
-	return ekm
+	def _mindex1_encode(keymaterial):
+		for pos in range(len(keymaterial)):
+			b = keymaterial[pos]
+			if b < limit:
+				yield alphabet[b % divisor]
+	return _mindex1_encode
 
 
-def _mindex4_encode(pwh, params, keymaterial, isencoder=False):
-	if not isencoder: raise ValueError
-	import struct
+def _compile_mindex4(pwh, params):
 	alphabet = params['alphabet']
 	radix = len(alphabet)
 	if radix > 256:
@@ -103,21 +131,47 @@ def _mindex4_encode(pwh, params, keymaterial, isencoder=False):
 	divisors = [radix ** x for x in range(3, 0, -1)]
 	vmax = radix ** 4
 	limit = (256 ** 4) - ((256 ** 4) % vmax)
-	s = struct.Struct('<I')
-	ekm = ''
-	pos = 0
-	while (pos + 4) < len(keymaterial):
-		v = s.unpack_from(keymaterial, pos)[0]
-		if v < limit:
-			pos += 4
-			v = v % vmax
-			for d in divisors:
-				ekm += alphabet[v // d]
-				v = v % d
-			ekm += alphabet[v]
-		else:
-			pos += 1
-	return ekm
+	unpack = struct.Struct('<I').unpack
+	def _mindex4_encode(keymaterial):
+		pos = 0
+		while (pos + 4) < len(keymaterial):
+			v = unpack(keymaterial[pos:pos + 4])[0]
+			if v < limit:
+				pos += 4
+				v = v % vmax
+				ekm = ''
+				for d in divisors:
+					ekm += alphabet[v // d]
+					v = v % d
+				ekm += alphabet[v]
+				yield ekm
+			else:
+				pos += 1
+	return _mindex4_encode
+
+
+def _basic_encoder(pwh, params, keymaterial):
+	return _compile_basic_encoder(pwh, params)(keymaterial)
+
+
+def _base64_encode(pwh, params, keymaterial, isencoder=False):
+	if not isencoder: raise ValueError
+	return _compile_base64(pwh, params)(keymaterial)
+
+
+def _base32_encode(pwh, params, keymaterial, isencoder=False):
+	if not isencoder: raise ValueError
+	return _compile_base32(pwh, params)(keymaterial)
+
+
+def _mindex1_encode(pwh, params, keymaterial, isencoder=False):
+	if not isencoder: raise ValueError
+	return _compile_mindex1(pwh, params)(keymaterial)
+
+
+def _mindex4_encode(pwh, params, keymaterial, isencoder=False):
+	if not isencoder: raise ValueError
+	return _compile_mindex4(pwh, params)(keymaterial)
 
 
 def _distro(abet, buf):
@@ -137,19 +191,24 @@ def _distro(abet, buf):
 provides = {
   'wordfunctions': {
     'encoder': {
-      'f': _basic_encoder
+      'f': _basic_encoder,
+      'compile': _compile_basic_encoder
     },
     'base64': {
-      'f': _base64_encode
+      'f': _base64_encode,
+      'compile': _compile_base64
     },
     'base32': {
-      'f': _base32_encode
+      'f': _base32_encode,
+      'compile': _compile_base32
     },
     'mindex1': {
-      'f': _mindex1_encode
+      'f': _mindex1_encode,
+      'compile': _compile_mindex1
     },
     'mindex4': {
-      'f': _mindex4_encode
+      'f': _mindex4_encode,
+      'compile': _compile_mindex4
     }
   },
   'wordschemes': {
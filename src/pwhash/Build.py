@@ -33,6 +33,46 @@ def build_pwhash(build):
 	open(plugininitfile, 'wb').close()
 
 	build.zipcontents['pwhash/__init__.py'] = os.path.join(build.srcdir, '__init__.py')
+	build.zipcontents['pwhash/admission.py'] = os.path.join(build.srcdir, 'admission.py')
+	build.zipcontents['pwhash/aio.py'] = os.path.join(build.srcdir, 'aio.py')
+	build.zipcontents['pwhash/keymaterial.py'] = os.path.join(build.srcdir, 'keymaterial.py')
+	build.zipcontents['pwhash/scheduler.py'] = os.path.join(build.srcdir, 'scheduler.py')
+	build.zipcontents['pwhash/snapshot.py'] = os.path.join(build.srcdir, 'snapshot.py')
+	build.zipcontents['pwhash/worker.py'] = os.path.join(build.srcdir, 'worker.py')
 	build.zipcontents['pwhash/plugins/__init__.py'] = plugininitfile
 
 
+#
+# once everything is in zipcontents, write pwhash/plugins/manifest.json:
+# what each plugin provides, read out of the plugins by plugin-manifest.py
+# from a zip of the pwhash package laid out as in narvi.zip, so that PWHash
+# can list the schemes without importing a plugin until one of its
+# functions is called
+#
+@build_step('pwhash-manifest', ['zipcontents'], ['narvizip'])
+def build_pwhash_manifest(build):
+	import subprocess
+	objdir = os.path.join(build.objroot, 'pwhash')
+	stagezip = os.path.join(objdir, 'manifest-stage.zip')
+	manifestfile = os.path.join(objdir, 'manifest.json')
+	print('\tCreating', manifestfile[len(build.sandboxroot)+1:], '...')
+	stage = zipfile.ZipFile(stagezip, 'w')
+	pnames = []
+	for k in sorted(build.zipcontents.keys()):
+		if not (k.startswith('pwhash/') and k.endswith('.py')):
+			continue
+		stage.write(build.zipcontents[k], k)
+		parts = k.split('/')
+		if parts[:2] != ['pwhash', 'plugins']:
+			continue
+		if len(parts) == 3 and not parts[2].startswith('_'):
+			pnames.append(parts[2][:-3])
+		elif len(parts) == 4 and parts[3] == '__init__.py':
+			pnames.append(parts[2])
+	stage.close()
+	subprocess.check_call([sys.executable,
+		os.path.join(build.srcdir, 'plugin-manifest.py'),
+		stagezip, manifestfile] + pnames)
+	build.zipcontents['pwhash/plugins/manifest.json'] = manifestfile
+
+
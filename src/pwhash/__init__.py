@@ -33,12 +33,30 @@ import zipfile
 import hashlib
 import shutil
 import io
+import threading
+import copy
 
 from . import plugins
 
 
 class PWHashError(Exception): pass
 
+class PWHashCancelled(PWHashError): pass
+
+class _Pipeline(object):
+
+	# A hash scheme and a word scheme resolved once: hashf(pwh, hashp, ...)
+	# derives the key, and word(keymaterial) makes the password of it.
+
+	__slots__ = ('hashschemeid', 'hashf', 'hashp', 'word')
+
+	def __init__(self, hashschemeid, hashf, hashp, word):
+		self.hashschemeid = hashschemeid
+		self.hashf = hashf
+		self.hashp = hashp
+		self.word = word
+
+
 class PWHash(object):
 
 	def __init__(self, configdirname='.pwhash'):
@@ -48,6 +66,14 @@ class PWHash(object):
 		self.config_file = os.path.join(self.config_dir, 'config')
 		self.lib_path = os.path.join(self.config_dir, 'lib')
 		self.libchecked = False
+		self.last_admission_wait = 0.0
+		# guards the config below, which this class replaces rather than
+		# changes in place, so that snapshots can copy it safely
+		self._config_lock = threading.RLock()
+		self._lib_lock = threading.Lock()
+		self._version = 0
+		self._snapshot = None
+		self._imported_plugins = set()
 		#
 		self.hashschemes = {}
 		self.wordschemes = {}
@@ -104,30 +130,71 @@ class PWHash(object):
 		f.write('\n')
 		f.close()
 
+	def _changed(self):
+		# call with the config lock held
+		self._version += 1
+
+	def snapshot(self):
+		# The config and plugins as of now, read-only; see snapshot.py.
+		# Besides the version, the settings and schemes are compared, as a
+		# caller may have changed them in place.
+		from . import snapshot
+		with self._config_lock:
+			s = self._snapshot
+			if (s is None or s.version != self._version or
+				s.user_settings != self.user_settings or
+				s.hashschemes != self.hashschemes or
+				s.wordschemes != self.wordschemes):
+				self._changed()
+				self._snapshot = snapshot.Snapshot(self, self._version)
+			return self._snapshot
+
+	def update_setting(self, key, f):
+		# Set a setting to f(a copy of its current value, or None), without
+		# losing a change made by another thread in between; returns the
+		# new value.
+		with self._config_lock:
+			value = f(copy.deepcopy(self.user_settings.get(key)))
+			settings = dict(self.user_settings)
+			settings[key] = value
+			self.user_settings = settings
+			self._changed()
+			return value
+
 	def merge_config(self):
-		self.hashschemes = {}
-		self.wordschemes = {}
-		self.hashschemes.update(self.plugin_hashschemes)
-		self.wordschemes.update(self.plugin_wordschemes)
-		self.hashschemes.update(self.user_hashschemes)
-		self.wordschemes.update(self.user_wordschemes)
+		with self._config_lock:
+			hashschemes = {}
+			wordschemes = {}
+			hashschemes.update(self.plugin_hashschemes)
+			wordschemes.update(self.plugin_wordschemes)
+			hashschemes.update(self.user_hashschemes)
+			wordschemes.update(self.user_wordschemes)
+			self.hashschemes = hashschemes
+			self.wordschemes = wordschemes
+			self._changed()
 
 	def load_config(self):
-		config = self._read_config()
-		self.user_salts = config['salts']
-		self.user_settings = config['settings']
-		self.user_hashschemes = config['hashschemes']
-		self.user_wordschemes = config['wordschemes']
-		self.merge_config()
+		with self._config_lock:
+			config = self._read_config()
+			self.user_salts = config['salts']
+			self.user_settings = config['settings']
+			self.user_hashschemes = config['hashschemes']
+			self.user_wordschemes = config['wordschemes']
+			self.merge_config()
 
 	def save_config(self, cfgfile=None):
-		config = {
-			'settings': self.user_settings,
-			'salts': self.user_salts,
-			'hashschemes': self.user_hashschemes,
-			'wordschemes': self.user_wordschemes
-			}
-		self._write_config(config, cfgfile)
+		# copied and written under the lock, so that saves from several
+		# threads neither interleave nor land out of order; writing the
+		# config does not change it, so the snapshot (and the pipelines
+		# compiled in it) stays
+		with self._config_lock:
+			config = copy.deepcopy({
+				'settings': self.user_settings,
+				'salts': self.user_salts,
+				'hashschemes': self.user_hashschemes,
+				'wordschemes': self.user_wordschemes
+				})
+			self._write_config(config, cfgfile)
 
 	def _modlist_from_dir(self, path):
 		for dirpath, dirnames, filenames in os.walk(path):
@@ -154,67 +221,144 @@ class PWHash(object):
 				m.append(os.path.basename(dirname))
 		return m
 
-	def load_plugin(self, pname):
+	def _plugin_provides(self, pname):
 		try:
 			plugmod = __import__(
 				'plugins', globals(), locals(),
 				[pname], 1)
 			plugin = getattr(plugmod, pname)
-			p = plugin.provides
+			return plugin.provides
 		except Exception as e:
 			print(e)
 			raise PWHashError(
 				'Unable to load plugin \'' + pname + '\'.')
-		if 'hashschemes' in p:
-			self.plugin_hashschemes.update(p['hashschemes'])
-		if 'hashfunctions' in p:
-			self.hashfunctions.update(p['hashfunctions'])
-		if 'wordschemes' in p:
-			self.plugin_wordschemes.update(p['wordschemes'])
-		if 'wordfunctions' in p:
-			self.wordfunctions.update(p['wordfunctions'])
 
-	def load_plugins(self):
-		self.plugin_hashschemes = {}
-		self.hashfunctions      = {}
-		self.plugin_wordschemes = {}
-		self.wordfunctions      = {}
-		#
-		modpath = plugins.__path__[0]
+	# attribute -> what a plugin's provides dict calls it
+	_provided = [
+		('plugin_hashschemes', 'hashschemes'),
+		('hashfunctions',      'hashfunctions'),
+		('plugin_wordschemes', 'wordschemes'),
+		('wordfunctions',      'wordfunctions')
+		]
+
+	def _install_plugins(self, loaded, provideds):
+		# loaded: attribute -> dict to add to; swapped in all at once, so
+		# other threads never see plugins half loaded
+		for p in provideds:
+			for attr, name in self._provided:
+				if name in p:
+					loaded[attr].update(p[name])
+		with self._config_lock:
+			for attr, name in self._provided:
+				setattr(self, attr, loaded[attr])
+			self._changed()
+
+	def load_plugin(self, pname):
+		p = self._plugin_provides(pname)
+		with self._config_lock:
+			self._install_plugins(dict([(attr, dict(getattr(self, attr)))
+				for attr, name in self._provided]), [p])
+
+	def _lazy_function(self, pname, kind, fid, entry):
+		# stands in for a plugin's function until the plugin is imported,
+		# which the first call does, putting the plugin's own functions in
+		# place for later snapshots
+		def call(*args, **kwargs):
+			f = self._plugin_provides(pname)[kind][fid][entry]
+			with self._config_lock:
+				if pname not in self._imported_plugins:
+					self._imported_plugins.add(pname)
+					self.load_plugin(pname)
+			return f(*args, **kwargs)
+		call.lazy = True
+		return call
+
+	def _lazy_provides(self, pname, p):
+		# a provides dict made from the plugin's manifest entry
+		provides = {
+			'hashschemes': p['hashschemes'],
+			'wordschemes': p['wordschemes']
+			}
+		for kind in ['hashfunctions', 'wordfunctions']:
+			provides[kind] = dict([(fid, dict([(entry,
+				self._lazy_function(pname, kind, fid, entry))
+				for entry in entries])) for fid, entries in p[kind].items()])
+		return provides
+
+	def _load_manifest(self):
+		# what each plugin provides, as the build found it, or None if
+		# there is no manifest (not running from narvi.zip)
 		try:
-			if isinstance(__loader__, zipimport.zipimporter):
-				zippath = __loader__.archive
-		except NameError:
-			zippath = None
-		#
-		if zippath:
-			modlist = self._modlist_from_zip(
-				zippath, modpath[len(zippath)+1:])
+			data = self._load_zipdata(os.path.join('plugins', 'manifest.json'))
+		except IOError:
+			return None
+		if data is None:
+			return None
+		return json.loads(data.decode('utf-8'))
+
+	def load_plugins(self):
+		# With a manifest, no plugin is imported until one of its functions
+		# is called; without, every plugin is imported now.
+		manifest = self._load_manifest()
+		if manifest is not None:
+			provideds = [self._lazy_provides(p, manifest[p])
+				for p in sorted(manifest)]
 		else:
-			modlist = self._modlist_from_dir(modpath)
-		#
-		for p in modlist:
-			self.load_plugin(p)
-		#
-		self.merge_config()
+			modpath = plugins.__path__[0]
+			try:
+				if isinstance(__loader__, zipimport.zipimporter):
+					zippath = __loader__.archive
+			except NameError:
+				zippath = None
+			#
+			if zippath:
+				modlist = self._modlist_from_zip(
+					zippath, modpath[len(zippath)+1:])
+			else:
+				modlist = self._modlist_from_dir(modpath)
+			#
+			provideds = [self._plugin_provides(p) for p in modlist]
+		with self._config_lock:
+			self._imported_plugins = set()
+			self._install_plugins(dict([(attr, {})
+				for attr, name in self._provided]), provideds)
+			self.merge_config()
 
-	def _load_libzip(self):
+	def _load_zipdata(self, relpath):
+		# a file under this package in the zip it was imported from, or
+		# None if it was not imported from a zip
 		modpath = __path__[0]
+		zippath = None
 		try:
 			if isinstance(__loader__, zipimport.zipimporter):
 				zippath = __loader__.archive
 		except NameError:
+			pass
+		if not zippath:
 			return None
 		#
-		libzipname = os.path.join(modpath[len(zippath)+1:], 'lib.zip')
+		name = os.path.join(modpath[len(zippath)+1:], relpath)
 		if os.sep != '/':
-			libzipname = libzipname.replace(os.sep, '/')
-		return __loader__.get_data(libzipname)
+			name = name.replace(os.sep, '/')
+		return __loader__.get_data(name)
+
+	def _load_libzip(self):
+		return self._load_zipdata('lib.zip')
 
 	def install_libs(self):
+		# once; threads that arrive while the libs are being installed
+		# wait for them
 		if self.libchecked:
 			return
-		self.libchecked = True
+		with self._lib_lock:
+			if self.libchecked:
+				return
+			try:
+				self._install_libs()
+			finally:
+				self.libchecked = True
+
+	def _install_libs(self):
 		zipdata = self._load_libzip()
 		if not zipdata:
 			return
@@ -229,39 +373,393 @@ class PWHash(object):
 		os.mkdir(self.lib_path)
 		z = zipfile.ZipFile(io.BytesIO(zipdata))
 		z.extractall(self.lib_path)
-		self.user_settings['lib-version'] = md5
+		self.update_setting('lib-version', lambda old: md5)
 		self.save_config()
 
-	def generate_password(self, sd, masterpassword):
+	def calibrate_hashscheme(self, seconds, memory=None, report=None,
+		hashfunctionid='scrypt'):
+		# Benchmark the hash function on this machine and add a user hash
+		# scheme that takes about seconds and at most memory bytes; report,
+		# if given, hears about each trial.  Returns the new scheme's id
+		# and the time it was measured at.  The config is not saved.
 		self.install_libs()
-		salt   = sd['value']
-		hashsid = sd['hashschemeid']
-		wordsid = sd['wordschemeid']
-		# get components
 		try:
-			hashs   = self.hashschemes[hashsid]
+			calibrate = self.hashfunctions[hashfunctionid]['calibrate']
+		except KeyError:
+			raise PWHashError('Hash function \'' + hashfunctionid +
+				'\' cannot be calibrated.')
+		sid, scheme, measured = calibrate(self.snapshot(), seconds, memory,
+			report)
+		with self._config_lock:
+			hashschemes = dict(self.user_hashschemes)
+			hashschemes[sid] = scheme
+			self.user_hashschemes = hashschemes
+			self.merge_config()
+		return sid, measured
+
+	def hash_cost(self, hashschemeid, probe=False):
+		# The hash function's estimate of what the scheme costs on this
+		# machine: a dict with 'seconds' (or None), 'memory' and 'available'
+		# (bytes, or None), 'file-backed', 'threads' (whether derivations
+		# on separate threads run in parallel) and 'batch' (how many
+		# derivations pay to run together, or 0), or None if it has no cost
+		# model.  With probe, the model may measure this machine first.
+		self.install_libs()
+		return self._cost(self.snapshot(), hashschemeid, probe)
+
+	def _cost(self, snap, hashsid, probe=False):
+		try:
+			hashs = snap.hashschemes[hashsid]
+			costf = snap.hashfunctions[hashs['hashfunctionid']]['cost']
+		except KeyError:
+			return None
+		return costf(snap, hashs['hashparams'], probe)
+
+	def _check_cost(self, snap, hashsid, deadline, memlimit):
+		# Before a derivation: refuse one that cannot fit in the memory
+		# limit, and warn about (or, with 'kdf-memory-check' set to
+		# 'refuse', refuse) one that needs more memory than is available.
+		policy = snap.user_settings.get('kdf-memory-check', 'warn')
+		if policy == 'off':
+			return
+		cost = self._cost(snap, hashsid)
+		if not cost:
+			return
+		mib = lambda n: str((n + (1 << 20) - 1) >> 20) + ' MiB'
+		if memlimit and cost['memory'] > memlimit:
+			raise PWHashError('Hash scheme \'' + hashsid + '\' needs about ' +
+				mib(cost['memory']) + ', more than the memory limit of ' +
+				mib(memlimit) + '.')
+		if (cost['available'] and not cost['file-backed'] and
+			cost['memory'] > cost['available']):
+			problem = ('Hash scheme \'' + hashsid + '\' needs about ' +
+				mib(cost['memory']) + ', but only ' +
+				mib(cost['available']) + ' is available.')
+			if policy == 'refuse':
+				raise PWHashError(problem)
+			print('WARNING:', problem)
+		if deadline and cost['seconds'] and cost['seconds'] > deadline:
+			print('WARNING: Hash scheme \'' + hashsid + '\' is expected to '
+				'take ' + ('%.1f' % cost['seconds']) + ' s, past the '
+				'deadline of ' + str(deadline) + ' s.')
+
+	def _memory_size(self, snap, hashsid):
+		# scratch memory the derivation needs, by the hash function's cost
+		# model or, failing that, scrypt's 128 * r * N * p
+		cost = self._cost(snap, hashsid)
+		if cost:
+			return cost['memory']
+		return 128 * self._work(snap, hashsid)
+
+	def _admit(self, snap, hashsid, cancel, count=1):
+		# With 'kdf-memory-budget' (MiB) set, wait for the scratch memory of
+		# count derivations to fit, alongside every other derivation on
+		# this host, under the budget; returns the admission ticket, or None.
+		budget = snap.user_settings.get('kdf-memory-budget', 0)
+		if not budget:
+			return None
+		from . import admission
+		size = self._memory_size(snap, hashsid) * count
+		if not os.path.isdir(self.config_dir):
+			os.mkdir(self.config_dir)
+		ticket = admission.Admission(self.config_dir,
+			int(budget) << 20).admit(size, cancel)
+		self.last_admission_wait = ticket.waited
+		if ticket.waited >= 0.1:
+			print('INFO: waited ' + ('%.1f' % ticket.waited) +
+				' s for hash memory')
+		return ticket
+
+	def _hash_limits(self, snap, deadline, memlimit):
+		if deadline is None:
+			deadline = snap.user_settings.get('kdf-deadline', 0) or None
+		if memlimit is None:
+			memlimit = snap.user_settings.get('kdf-memory-limit', 0) or None
+			if memlimit:
+				memlimit = int(memlimit) * (1 << 20)
+		return deadline, memlimit
+
+	def _hash_components(self, snap, hashsid):
+		try:
+			hashs   = snap.hashschemes[hashsid]
 			hashfid = hashs['hashfunctionid']
 			hashp   = hashs['hashparams']
 		except KeyError:
 			raise PWHashError('Hash scheme \'' + hashsid + '\' is not defined.')
 		try:
-			hashf = self.hashfunctions[hashfid]['f']
+			hashf = snap.hashfunctions[hashfid]['f']
 		except KeyError:
 			raise PWHashError('Hash function \'' + hashfid + '\' not available.')
+		return hashf, hashp
+
+	def _word_function(self, snap, wordsid):
+		# the word scheme as a function of the key material alone, compiled
+		# by the word function if it offers that
 		try:
-			words   = self.wordschemes[wordsid]
+			words   = snap.wordschemes[wordsid]
 			wordfid = words['wordfunctionid']
 			wordp   = words['wordparams']
 		except KeyError:
 			raise PWHashError('Word scheme \'' + wordsid + '\' not defined.')
 		try:
-			wordf = self.wordfunctions[wordfid]['f']
+			wordfs = snap.wordfunctions[wordfid]
+			wordf  = wordfs['f']
 		except KeyError:
 			raise PWHashError('Word function \'' + wordfid + '\' not available.')
+		if 'compile' in wordfs:
+			return wordfs['compile'](snap, wordp)
+		return lambda keymaterial: wordf(snap, wordp, keymaterial)
+
+	def _pipeline(self, snap, hashsid, wordsid):
+		# Kept in the snapshot, so that merge_config(), or any other change
+		# to the config, which makes a new snapshot, drops them.
+		try:
+			return snap.pipelines[(hashsid, wordsid)]
+		except KeyError:
+			pass
+		hashf, hashp = self._hash_components(snap, hashsid)
+		pipeline = _Pipeline(hashsid, hashf, hashp,
+			self._word_function(snap, wordsid))
+		snap.pipelines[(hashsid, wordsid)] = pipeline
+		return pipeline
+
+	def _derive_key(self, snap, salt, pipeline, masterpassword, progress,
+		cancel, deadline, memlimit, isolate=False):
+		# the derived key, computed lazily as the word function reads it
+		# unless it comes from a worker process
+		from . import keymaterial, worker
+		hashsid = pipeline.hashschemeid
+		hashf, hashp = pipeline.hashf, pipeline.hashp
+		self._check_cost(snap, hashsid, deadline, memlimit)
+		ticket = self._admit(snap, hashsid, cancel)
+		try:
+			if deadline or memlimit or isolate:
+				return keymaterial.KeyMaterial(worker.run(
+					worker.job(snap, hashsid, masterpassword, salt),
+					deadline, memlimit, progress, cancel))
+			return keymaterial.as_key_material(
+				hashf(snap, hashp, masterpassword, salt, progress, cancel))
+		finally:
+			if ticket:
+				ticket.release()
+
+	def _derive_keys(self, snap, salts, pipeline, masterpassword, cancel,
+		batch):
+		# the derived keys for many salts at once, by the hash function's
+		# 'batch', in the order of salts
+		from . import keymaterial
+		hashsid = pipeline.hashschemeid
+		self._check_cost(snap, hashsid, None, None)
+		ticket = self._admit(snap, hashsid, cancel, len(salts))
+		try:
+			return [keymaterial.as_key_material(h) for h in batch(snap,
+				masterpassword, [(salt, pipeline.hashp) for salt in salts],
+				None, cancel)]
+		finally:
+			if ticket:
+				ticket.release()
+
+	def generate_password(self, sd, masterpassword, progress=None, cancel=None,
+		deadline=None, memlimit=None):
+		# progress, if given, is called as progress(done, total) while the
+		# key is derived; cancel, if given, is a threading.Event that makes
+		# the derivation give up, raising PWHashCancelled, soon after it is
+		# set.  With a deadline (seconds) or memlimit (bytes), here or as the
+		# 'kdf-deadline' or 'kdf-memory-limit' (MiB) settings, the key is
+		# derived in a worker process that is killed, raising PWHashError,
+		# if it overruns.  Safe to call from several threads at once.
+		self.install_libs()
+		snap = self.snapshot()
+		# get components
+		pipeline = self._pipeline(snap, sd['hashschemeid'], sd['wordschemeid'])
 		# generate derived key
-		derivedkey = hashf(self, hashp, masterpassword, salt)
-		# convert to word
-		password = wordf(self, wordp, derivedkey)
-		return password
+		deadline, memlimit = self._hash_limits(snap, deadline, memlimit)
+		derivedkey = self._derive_key(snap, sd['value'], pipeline,
+			masterpassword, progress, cancel, deadline, memlimit)
+		# convert to word, then wipe the key material
+		try:
+			return pipeline.word(derivedkey)
+		finally:
+			derivedkey.wipe()
+
+	def _words(self, snap, sds, derivedkey):
+		# [(sd, password)] for salt definitions sharing the derived key,
+		# which is wiped afterwards
+		try:
+			passwords = []
+			for sd in sds:
+				pipeline = self._pipeline(snap, sd['hashschemeid'],
+					sd['wordschemeid'])
+				passwords.append((sd, pipeline.word(derivedkey)))
+			return passwords
+		finally:
+			derivedkey.wipe()
+
+	def _batch(self, snap, hashsid, count, deadline, memlimit):
+		# the hash function's 'batch', if count derivations of the scheme go
+		# faster through it together than one by one, or None; never with a
+		# deadline or memory limit, which take a worker process each
+		if deadline or memlimit:
+			return None
+		cost = self._cost(snap, hashsid)
+		if not cost or not cost.get('batch') or count < cost['batch']:
+			return None
+		hashfid = snap.hashschemes[hashsid]['hashfunctionid']
+		return snap.hashfunctions[hashfid].get('batch')
+
+	def _isolate(self, snap, hashsid):
+		# whether to derive in a worker process, because derivations on
+		# separate threads would not run in parallel
+		from . import worker
+		cost = self._cost(snap, hashsid)
+		return bool(cost and not cost.get('threads', True) and
+			worker.available())
+
+	def _work(self, snap, hashsid):
+		# scrypt's N * r * p, by which the scheduler ranks derivations; 0
+		# for hash functions without those parameters
+		hashp = snap.hashschemes[hashsid]['hashparams']
+		try:
+			return hashp['N'] * hashp['r'] * hashp['p']
+		except (KeyError, TypeError):
+			return 0
+
+	def _available_memory(self, snap, hashsids):
+		# the least memory available by the hash functions' cost models, or
+		# None if none of them knows
+		available = None
+		for hashsid in hashsids:
+			cost = self._cost(snap, hashsid)
+			if cost and cost['available']:
+				available = min(available or cost['available'],
+					cost['available'])
+		return available
+
+	def generate_many(self, sds, masterpassword, workers=None,
+		progress=None, cancel=None, report=None):
+		# Generate the passwords for many salts with one master password,
+		# yielding (sd, password) for each salt definition in sds as its
+		# password is ready, in no particular order.  Each distinct salt
+		# value and hash scheme is derived once, on a pool of workers
+		# threads (default: one per CPU), cheapest first, as the memory
+		# available allows (see scheduler.py).  The salts of a hash scheme
+		# whose hash function runs many derivations faster together (its
+		# 'batch', such as scrypt's lane engine) are derived in one go;
+		# other hash schemes whose derivations do not run in parallel on
+		# threads (the pure Python engine) get a worker process each where
+		# available.  progress, if given, is called as progress(done,
+		# total) in derivations; cancel is as for generate_password();
+		# report, if given, is called as report(salt, hashschemeid, queued,
+		# ran), in seconds, as each derivation finishes.  The batch ends
+		# with close().
+		import queue
+		from . import scheduler
+		self.install_libs()
+		snap = self.snapshot()
+		jobs = {}
+		for sd in sds:
+			self._pipeline(snap, sd['hashschemeid'], sd['wordschemeid'])
+			jobs.setdefault((sd['value'], sd['hashschemeid']), []).append(sd)
+		if not jobs:
+			return
+		hashsids = set([hashsid for salt, hashsid in jobs])
+		if workers is None:
+			workers = os.cpu_count() or 1
+		isolate = dict([(hashsid, self._isolate(snap, hashsid))
+			for hashsid in hashsids])
+		deadline, memlimit = self._hash_limits(snap, None, None)
+		batch = dict([(hashsid, self._batch(snap, hashsid,
+			len([key for key in jobs if key[1] == hashsid]), deadline,
+			memlimit)) for hashsid in hashsids])
+		stop = threading.Event()
+		def derive(keys):
+			# the derived keys for keys, all of one hash scheme
+			hashsid = keys[0][1]
+			pipeline = self._pipeline(snap, hashsid,
+				jobs[keys[0]][0]['wordschemeid'])
+			if batch[hashsid]:
+				return self._derive_keys(snap, [salt for salt, h in keys],
+					pipeline, masterpassword, stop, batch[hashsid])
+			return [self._derive_key(snap, keys[0][0], pipeline,
+				masterpassword, None, stop, deadline, memlimit,
+				isolate[hashsid])]
+		finished = queue.Queue()
+		pool = scheduler.Scheduler(workers,
+			self._available_memory(snap, hashsids), finished=finished)
+		# submitted cheapest first, as the first worker may start on the
+		# first job before the rest are queued
+		work = dict([(hashsid, self._work(snap, hashsid))
+			for hashsid in hashsids])
+		# a batched scheme's salts in as many batches as there are workers,
+		# each still large enough to pay
+		groups = []
+		for hashsid in hashsids:
+			if batch[hashsid]:
+				keys = sorted([key for key in jobs if key[1] == hashsid])
+				n = max(1, min(workers,
+					len(keys) // self._cost(snap, hashsid)['batch']))
+				groups += [tuple(keys[i::n]) for i in range(n)]
+		groups += [(key,) for key in jobs if not batch[key[1]]]
+		groups.sort(key=lambda keys: work[keys[0][1]] * len(keys))
+		pending = [pool.submit(derive, (keys,), work[keys[0][1]] * len(keys),
+			self._memory_size(snap, keys[0][1]) * len(keys), keys)
+			for keys in groups]
+		finishedjobs = 0
+		done = 0
+		ready = []
+		try:
+			while finishedjobs < len(pending):
+				if cancel and cancel.is_set():
+					raise PWHashCancelled('key derivation cancelled')
+				try:
+					job = finished.get(True, 0.1)
+				except queue.Empty:
+					continue
+				finishedjobs += 1
+				ready = list(zip(job.tag, job.result()))
+				while ready:
+					key, derivedkey = ready.pop(0)
+					done += 1
+					if report:
+						report(key[0], key[1], job.queued(), job.ran())
+					if progress:
+						progress(done, len(jobs))
+					for result in self._words(snap, jobs[key], derivedkey):
+						yield result
+		finally:
+			stop.set()
+			for key, derivedkey in ready:
+				derivedkey.wipe()
+			pool.shutdown(True, True)
+			while not finished.empty():
+				job = finished.get()
+				if job.error is None and job.value is not None:
+					for derivedkey in job.value:
+						derivedkey.wipe()
+			self.close()
+
+	def close(self):
+		# The end of a session, or of generate_many(): hash functions with a
+		# 'close' drop what they keep between derivations, such as scratch
+		# memory.  Those of plugins not yet imported have nothing to drop.
+		snap = self.snapshot()
+		for fs in snap.hashfunctions.values():
+			close = fs.get('close')
+			if close and not getattr(close, 'lazy', False):
+				close(snap)
+
+	def generate_password_async(self, sd, masterpassword, executor=None,
+		progress=None, deadline=None, memlimit=None, semaphore=None):
+		# A coroutine for generate_password(), for asyncio; see aio.py.
+		from . import aio
+		return aio.generate_password(self, sd, masterpassword, executor,
+			progress, deadline, memlimit, semaphore)
+
+	def generate_many_async(self, sds, masterpassword, executor=None,
+		progress=None, semaphore=None):
+		# An async generator for generate_many(), for asyncio; see aio.py.
+		from . import aio
+		return aio.generate_many(self, sds, masterpassword, executor,
+			progress, semaphore)
 
 
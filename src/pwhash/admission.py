@@ -0,0 +1,214 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+#
+# Admission control for concurrent derivations.
+#
+# Each derivation declares the scratch memory it needs and waits until the
+# derivations in flight on this host, in any process, leave room for it
+# under a budget.  The ledger of running and waiting derivations is a small
+# JSON file under the config dir, read and rewritten under an exclusive
+# lock on a companion lock file; entries of processes that have gone away
+# are dropped.  Waiters are admitted first come, first served, and a
+# derivation is always let through when nothing else is running, however
+# large it is.
+#
+
+
+import os
+import json
+import time
+import itertools
+
+
+# seconds between looks at the ledger while waiting
+_poll = 0.1
+
+_ids = itertools.count()
+
+
+def _alive(pid):
+	if pid == os.getpid():
+		return True
+	if os.name == 'nt':
+		# os.kill() would terminate the process
+		import ctypes
+		kernel32 = ctypes.windll.kernel32
+		handle = kernel32.OpenProcess(0x1000, False, pid)
+		if not handle:
+			return False
+		code = ctypes.c_ulong()
+		ok = kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+		kernel32.CloseHandle(handle)
+		return not ok or code.value == 259
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except OSError:
+		pass
+	return True
+
+
+class FileLock(object):
+
+	def __init__(self, path):
+		self.path = path
+
+	def __enter__(self):
+		self.file = open(self.path, 'a+b')
+		try:
+			import fcntl
+			fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+			self._unlock = lambda: fcntl.flock(
+				self.file.fileno(), fcntl.LOCK_UN)
+		except ImportError:
+			import msvcrt
+			self.file.seek(0)
+			while True:
+				try:
+					msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+					break
+				except OSError:
+					pass
+			def unlock():
+				self.file.seek(0)
+				msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+			self._unlock = unlock
+		return self
+
+	def __exit__(self, exc_type, exc_value, exc_trace):
+		try:
+			self._unlock()
+		finally:
+			self.file.close()
+		return False
+
+
+class Ticket(object):
+	# a derivation let through; release() when it is done
+
+	def __init__(self, admission, entry, waited):
+		self.admission = admission
+		self.entry = entry
+		self.waited = waited
+
+	def release(self):
+		if self.entry:
+			self.admission._remove(self.entry)
+			self.entry = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, exc_trace):
+		self.release()
+		return False
+
+
+class Admission(object):
+
+	def __init__(self, dirname, budget):
+		self.path = os.path.join(dirname, 'admission')
+		self.lockpath = self.path + '.lock'
+		self.budget = budget
+
+	def _read(self):
+		try:
+			with open(self.path, 'r') as f:
+				ledger = json.loads(f.read())
+			ledger = {
+				'running': list(ledger['running']),
+				'waiting': list(ledger['waiting'])
+				}
+		except (IOError, OSError, ValueError, KeyError, TypeError):
+			ledger = {'running': [], 'waiting': []}
+		for k in ('running', 'waiting'):
+			ledger[k] = [e for e in ledger[k] if _alive(e['pid'])]
+		return ledger
+
+	def _write(self, ledger):
+		tmp = self.path + '.' + str(os.getpid())
+		with open(tmp, 'w') as f:
+			f.write(json.dumps(ledger))
+		os.replace(tmp, self.path)
+
+	def _next(self, ledger):
+		# the waiting entry to admit next
+		return ledger['waiting'][0]
+
+	def _fits(self, ledger, entry):
+		running = ledger['running']
+		inflight = sum([e['bytes'] for e in running])
+		return not running or inflight + entry['bytes'] <= self.budget
+
+	def _try_admit(self, entry):
+		with FileLock(self.lockpath):
+			ledger = self._read()
+			if entry['id'] not in [e['id'] for e in ledger['waiting']]:
+				ledger['waiting'].append(entry)
+			admitted = (self._next(ledger)['id'] == entry['id'] and
+				self._fits(ledger, entry))
+			if admitted:
+				ledger['waiting'] = [e for e in ledger['waiting']
+					if e['id'] != entry['id']]
+				ledger['running'].append(entry)
+			self._write(ledger)
+		return admitted
+
+	def _remove(self, entry):
+		with FileLock(self.lockpath):
+			ledger = self._read()
+			for k in ('running', 'waiting'):
+				ledger[k] = [e for e in ledger[k] if e['id'] != entry['id']]
+			self._write(ledger)
+
+	def admit(self, size, cancel=None):
+		# Wait until size bytes of scratch fit under the budget; returns a
+		# Ticket, whose waited is the seconds spent in the queue.  cancel,
+		# if given, is a threading.Event that gives up the wait, raising
+		# PWHashCancelled.
+		pid = os.getpid()
+		entry = {
+			'id': str(pid) + '-' + str(next(_ids)),
+			'pid': pid,
+			'bytes': size,
+			'since': time.time()
+			}
+		try:
+			while not self._try_admit(entry):
+				if cancel and cancel.is_set():
+					from . import PWHashCancelled
+					raise PWHashCancelled('key derivation cancelled')
+				time.sleep(_poll)
+		except BaseException:
+			self._remove(entry)
+			raise
+		return Ticket(self, entry, time.time() - entry['since'])
+
+
+__all__ = ['Admission', 'FileLock', 'Ticket']
+
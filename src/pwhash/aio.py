@@ -0,0 +1,230 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+#
+# asyncio front end to PWHash.  The key derivation runs in an executor (the
+# event loop's default executor unless another is given), so the event
+# loop stays responsive, and the coroutines here only wait on it.
+#
+# Cancelling the waiting task, directly or by a timeout (asyncio.wait_for(),
+# asyncio.timeout()), sets the derivation's cancel event, so the executor's
+# thread gives up soon after.  The task does not wait for that.
+#
+# Derivations started at once share a MemorySemaphore, one per event loop
+# unless another is given.  Each takes the scratch memory its hash scheme
+# needs out of the semaphore's budget and gives it back when its thread is
+# done with it, so hundreds of derivations can be in flight without more
+# than the budget's worth of them holding memory.  The default budget is
+# the 'kdf-memory-budget' setting (MiB) or, without it, the memory
+# available when the semaphore is created.
+#
+
+
+import asyncio
+import collections
+import threading
+import weakref
+
+from . import PWHashCancelled
+
+
+class MemorySemaphore(object):
+
+	# Admits holders, first come first served, while the bytes they hold
+	# fit in budget (None: no limit); one is always admitted when nothing
+	# is held, however large.
+
+	def __init__(self, budget=None):
+		self.budget = budget
+		self.used = 0
+		self.holders = 0
+		self._waiters = collections.deque()
+
+	def _fits(self, size):
+		return (not self.holders or self.budget is None or
+			self.used + size <= self.budget)
+
+	def _take(self, size):
+		self.used += size
+		self.holders += 1
+
+	def _wake(self):
+		while self._waiters and self._fits(self._waiters[0][0]):
+			size, future = self._waiters.popleft()
+			if not future.done():
+				self._take(size)
+				future.set_result(None)
+
+	async def acquire(self, size):
+		if not self._waiters and self._fits(size):
+			self._take(size)
+			return
+		waiter = (size, asyncio.get_running_loop().create_future())
+		self._waiters.append(waiter)
+		try:
+			await waiter[1]
+		except asyncio.CancelledError:
+			if waiter[1].done() and not waiter[1].cancelled():
+				# admitted just as it was cancelled
+				self.release(size)
+			else:
+				self._waiters.remove(waiter)
+				self._wake()
+			raise
+
+	def release(self, size):
+		self.used -= size
+		self.holders -= 1
+		self._wake()
+
+
+# event loop -> its default MemorySemaphore
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def _default_semaphore(snap, available):
+	loop = asyncio.get_running_loop()
+	if loop not in _semaphores:
+		budget = snap.user_settings.get('kdf-memory-budget', 0)
+		_semaphores[loop] = MemorySemaphore(
+			int(budget) << 20 if budget else available)
+	return _semaphores[loop]
+
+
+def _prepare(pwh, sds):
+	# on the executor, as these may read files and load the scrypt lib:
+	# the snapshot, the memory, isolation, and work for each hash scheme,
+	# and the memory available
+	pwh.install_libs()
+	snap = pwh.snapshot()
+	for sd in sds:
+		pwh._pipeline(snap, sd['hashschemeid'], sd['wordschemeid'])
+	hashsids = set([sd['hashschemeid'] for sd in sds])
+	plan = dict([(hashsid, (pwh._memory_size(snap, hashsid),
+		pwh._isolate(snap, hashsid), pwh._work(snap, hashsid)))
+		for hashsid in hashsids])
+	return snap, plan, pwh._available_memory(snap, hashsids)
+
+
+def _passwords(pwh, snap, salt, hashsid, sds, masterpassword, progress,
+	cancel, deadline, memlimit, isolate):
+	if cancel.is_set():
+		raise PWHashCancelled('key derivation cancelled')
+	pipeline = pwh._pipeline(snap, hashsid, sds[0]['wordschemeid'])
+	return pwh._words(snap, sds, pwh._derive_key(snap, salt, pipeline,
+		masterpassword, progress, cancel, deadline, memlimit, isolate))
+
+
+def _retrieve(future):
+	# so that the failure of an abandoned derivation is not logged
+	if not future.cancelled():
+		future.exception()
+
+
+async def _run(semaphore, size, executor, cancel, f, *args):
+	# f(*args) on the executor, holding size bytes of semaphore until f
+	# returns, even if the waiting task is cancelled before then
+	await semaphore.acquire(size)
+	try:
+		future = asyncio.get_running_loop().run_in_executor(executor, f, *args)
+	except BaseException:
+		semaphore.release(size)
+		raise
+	def _done(future):
+		semaphore.release(size)
+		_retrieve(future)
+	future.add_done_callback(_done)
+	try:
+		return await asyncio.shield(future)
+	except asyncio.CancelledError:
+		cancel.set()
+		raise
+
+
+async def generate_password(pwh, sd, masterpassword, executor=None,
+	progress=None, deadline=None, memlimit=None, semaphore=None):
+	# As PWHash.generate_password(); progress, if given, is called on the
+	# executor's thread.
+	loop = asyncio.get_running_loop()
+	snap, plan, available = await loop.run_in_executor(executor,
+		_prepare, pwh, [sd])
+	if semaphore is None:
+		semaphore = _default_semaphore(snap, available)
+	size, isolate, work = plan[sd['hashschemeid']]
+	deadline, memlimit = pwh._hash_limits(snap, deadline, memlimit)
+	cancel = threading.Event()
+	passwords = await _run(semaphore, size, executor, cancel, _passwords,
+		pwh, snap, sd['value'], sd['hashschemeid'], [sd], masterpassword,
+		progress, cancel, deadline, memlimit, isolate)
+	return passwords[0][1]
+
+
+async def generate_many(pwh, sds, masterpassword, executor=None,
+	progress=None, semaphore=None):
+	# As PWHash.generate_many(): yields (sd, password) as each is ready,
+	# deriving each distinct salt value and hash scheme once.  progress,
+	# if given, is called as progress(done, total) on the event loop as
+	# derivations finish.  Closing the generator, or cancelling the task
+	# iterating it, cancels the derivations still to come.
+	loop = asyncio.get_running_loop()
+	sds = list(sds)
+	if not sds:
+		return
+	snap, plan, available = await loop.run_in_executor(executor,
+		_prepare, pwh, sds)
+	if semaphore is None:
+		semaphore = _default_semaphore(snap, available)
+	jobs = {}
+	for sd in sds:
+		jobs.setdefault((sd['value'], sd['hashschemeid']), []).append(sd)
+	deadline, memlimit = pwh._hash_limits(snap, None, None)
+	cancel = threading.Event()
+	tasks = []
+	# started cheapest first, so they queue on the semaphore in that order
+	for salt, hashsid in sorted(jobs, key=lambda key: plan[key[1]][2]):
+		jobsds = jobs[(salt, hashsid)]
+		size, isolate, work = plan[hashsid]
+		tasks.append(loop.create_task(_run(semaphore, size, executor,
+			cancel, _passwords, pwh, snap, salt, hashsid, jobsds,
+			masterpassword, None, cancel, deadline, memlimit, isolate)))
+	done = 0
+	try:
+		for task in asyncio.as_completed(tasks):
+			passwords = await task
+			done += 1
+			if progress:
+				progress(done, len(tasks))
+			for result in passwords:
+				yield result
+	finally:
+		cancel.set()
+		for task in tasks:
+			task.cancel()
+			task.add_done_callback(_retrieve)
+
+
+__all__ = ['MemorySemaphore', 'generate_password', 'generate_many']
+
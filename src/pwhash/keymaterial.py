@@ -0,0 +1,140 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+#
+# Key material is what a hash function hands to a word function: a
+# read-only byte string of a fixed length.  Word functions typically use a
+# short prefix of it, so it may be computed lazily, a block at a time, as
+# it is read.
+#
+# It lives in a single bytearray that is never resized: slices are
+# memoryviews of it rather than copies, and wipe() zeroes it once the
+# password has been made, so the key material is not left behind on the
+# heap.
+#
+
+
+import hmac
+import struct
+import hashlib
+
+
+class KeyMaterial(object):
+	# all of the key material, up front; subclasses compute it on demand by
+	# overriding _more() to fill in self._data from self._filled on
+
+	def __init__(self, data, length=None):
+		# a bytearray is adopted as is, not copied, and wiped with the key
+		# material
+		if isinstance(data, bytearray):
+			self._data = data
+		else:
+			self._data = bytearray(data)
+		if length is None:
+			length = len(self._data)
+		self._length = length
+		self._filled = len(self._data)
+		self._wiped = False
+
+	def __len__(self):
+		return self._length
+
+	def __getitem__(self, key):
+		# slices are memoryviews of the key material, valid until wipe()
+		if isinstance(key, slice):
+			start, stop, step = key.indices(self._length)
+			self._ensure(stop)
+			return memoryview(self._data)[start:stop:step]
+		if key < 0:
+			key += self._length
+		if not 0 <= key < self._length:
+			raise IndexError('key material index out of range')
+		self._ensure(key + 1)
+		return self._data[key]
+
+	def __iter__(self):
+		for i in range(self._length):
+			yield self[i]
+
+	def __bytes__(self):
+		return bytes(self[:])
+
+	def available(self):
+		# how many bytes have been computed so far
+		return min(self._filled, self._length)
+
+	def wipe(self):
+		# zero the key material; it cannot be read afterwards
+		self._data[:] = bytes(len(self._data))
+		self._wiped = True
+
+	def _ensure(self, end):
+		if self._wiped:
+			raise ValueError('key material has been wiped')
+		while self._filled < end:
+			self._more()
+
+	def _more(self):
+		raise IndexError('key material exhausted')
+
+
+class PBKDF2KeyMaterial(KeyMaterial):
+	# PBKDF2-HMAC-SHA256(password, salt, 1, length), which is a run of
+	# independent 32-byte blocks T_i = HMAC(password, salt || INT(i)); each is
+	# computed when a read first reaches it
+
+	def __init__(self, password, salt, length):
+		KeyMaterial.__init__(self, bytearray(length))
+		self._filled = 0
+		self._prf = hmac.new(password, None, hashlib.sha256)
+		self._prf.update(salt)
+		if isinstance(salt, bytearray):
+			# e.g. scrypt's mixed lanes, as secret as the key material
+			salt[:] = bytes(len(salt))
+		self._block = struct.Struct('>I')
+
+	def _more(self):
+		if self._filled >= self._length:
+			raise IndexError('key material exhausted')
+		prf = self._prf.copy()
+		prf.update(self._block.pack(self._filled // 32 + 1))
+		n = min(32, self._length - self._filled)
+		self._data[self._filled:self._filled + n] = prf.digest()[:n]
+		self._filled += n
+
+	def wipe(self):
+		KeyMaterial.wipe(self)
+		self._prf = None
+
+
+def as_key_material(keymaterial):
+	# hash functions may still return plain bytes
+	if isinstance(keymaterial, KeyMaterial):
+		return keymaterial
+	return KeyMaterial(keymaterial)
+
+
+__all__ = ['KeyMaterial', 'PBKDF2KeyMaterial', 'as_key_material']
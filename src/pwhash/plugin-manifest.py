@@ -0,0 +1,67 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+#
+# reads the plugins out of a zip of the pwhash package for the
+# pwhash-manifest build step:
+#
+#   plugin-manifest.py ZIP MANIFEST PLUGIN...
+#
+# and writes MANIFEST, which holds, for each PLUGIN, the hash and word
+# schemes it provides and, for each hash and word function it provides,
+# the names of that function's entries ('f', 'cost', ...)
+#
+
+
+import sys
+import json
+import importlib
+
+
+def _entries(functions):
+	return dict([(fid, sorted(f)) for fid, f in functions.items()])
+
+
+def main(zippath, manifestfile, pnames):
+	sys.path.insert(0, zippath)
+	manifest = {}
+	for pname in pnames:
+		p = importlib.import_module('pwhash.plugins.' + pname).provides
+		manifest[pname] = {
+			'hashschemes':   p.get('hashschemes', {}),
+			'hashfunctions': _entries(p.get('hashfunctions', {})),
+			'wordschemes':   p.get('wordschemes', {}),
+			'wordfunctions': _entries(p.get('wordfunctions', {}))
+			}
+	f = open(manifestfile, 'w')
+	f.write(json.dumps(manifest, sort_keys=True, indent=1))
+	f.write('\n')
+	f.close()
+
+
+if __name__ == '__main__':
+	main(sys.argv[1], sys.argv[2], sys.argv[3:])
+
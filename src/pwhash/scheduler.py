@@ -0,0 +1,171 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+#
+# Shortest-job-first scheduling of derivations on a pool of threads.
+#
+# Each job comes with its work (for scrypt, N * r * p) and the scratch
+# memory it needs.  A free worker takes the queued job with the least work,
+# discounted by how long the job has waited: the work counts half as much
+# for every halflife seconds in the queue, so that a heavy job is not kept
+# waiting behind a stream of cheap ones for more than a few halflives.
+# With a memory budget, jobs that fit beside those running keep the other
+# workers busy while a heavy one holds most of the memory.  But once the
+# job with the best (aged) priority does not fit, no other job is started
+# until it does, so that a stream of small jobs cannot keep taking the
+# memory it waits for, and its wait stays bounded as the aging intends.  A
+# job is always started when nothing is running, however large it is.
+#
+
+
+import threading
+import time
+
+
+class Job(object):
+
+	def __init__(self, f, args, work, memory, tag):
+		self.f = f
+		self.args = args
+		self.work = work
+		self.memory = memory
+		self.tag = tag
+		self.submitted = time.time()
+		self.started = None
+		self.finished = None
+		self.value = None
+		self.error = None
+		self.cancelled = False
+		self._done = threading.Event()
+
+	def done(self):
+		return self._done.is_set()
+
+	def result(self):
+		self._done.wait()
+		if self.error is not None:
+			raise self.error
+		return self.value
+
+	def queued(self):
+		# seconds from submission until a worker started it
+		return (self.started or time.time()) - self.submitted
+
+	def ran(self):
+		return (self.finished or time.time()) - (self.started or time.time())
+
+
+class Scheduler(object):
+
+	def __init__(self, workers, budget=None, halflife=10.0, finished=None):
+		# finished, if given, is a queue.Queue that each job is put on
+		# when it is done
+		self.workers = max(1, workers)
+		self.budget = budget
+		self.halflife = halflife
+		self.finished = finished
+		self._cond = threading.Condition()
+		self._queue = []
+		self._running = []
+		self._threads = []
+		self._closed = False
+
+	def _priority(self, job, now):
+		return job.work * 0.5 ** ((now - job.submitted) / self.halflife)
+
+	def _fits(self, job):
+		used = sum([j.memory for j in self._running])
+		return (not self._running or self.budget is None or
+			used + job.memory <= self.budget)
+
+	def _next(self):
+		# the queued job to start now, or None, also when the job with the
+		# best priority has to wait for memory
+		now = time.time()
+		best = None
+		for job in self._queue:
+			if best is None or (self._priority(job, now), job.submitted) < (
+				self._priority(best, now), best.submitted):
+				best = job
+		if best is None or not self._fits(best):
+			return None
+		return best
+
+	def _worker(self):
+		while True:
+			with self._cond:
+				job = self._next()
+				while job is None:
+					if self._closed and not self._queue:
+						return
+					self._cond.wait()
+					job = self._next()
+				self._queue.remove(job)
+				self._running.append(job)
+				job.started = time.time()
+			try:
+				job.value = job.f(*job.args)
+			except BaseException as e:
+				job.error = e
+			job.finished = time.time()
+			with self._cond:
+				self._running.remove(job)
+				self._cond.notify_all()
+			job._done.set()
+			if self.finished is not None:
+				self.finished.put(job)
+
+	def submit(self, f, args, work=0, memory=0, tag=None):
+		job = Job(f, args, work, memory, tag)
+		with self._cond:
+			if self._closed:
+				raise RuntimeError('scheduler is shut down')
+			self._queue.append(job)
+			if len(self._threads) < self.workers:
+				t = threading.Thread(target=self._worker)
+				t.daemon = True
+				t.start()
+				self._threads.append(t)
+			self._cond.notify()
+		return job
+
+	def shutdown(self, wait=True, cancel=False):
+		# no more jobs; with cancel, jobs still queued are dropped
+		with self._cond:
+			self._closed = True
+			if cancel:
+				for job in self._queue:
+					job.cancelled = True
+					job._done.set()
+				self._queue = []
+			self._cond.notify_all()
+		if wait:
+			for t in self._threads:
+				t.join()
+
+
+__all__ = ['Job', 'Scheduler']
+
@@ -0,0 +1,89 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+#
+# A snapshot is a frozen copy of a PWHash's schemes, functions, and settings,
+# taken when a derivation starts.  The derivation, and the plugin functions
+# it calls, read only the snapshot, so another thread may load, merge, or
+# save the config, or load plugins, while it runs.  The PWHash changes its
+# config copy-on-write and counts the changes in a version; it takes a new
+# snapshot only when the config has changed, so derivations running at once
+# share one snapshot and read it without taking a lock.
+#
+# Plugins are handed the snapshot in place of the PWHash.  What they write
+# (update_setting(), save_config()) goes to the PWHash, and shows up in the
+# snapshots taken after it.
+#
+
+
+import copy
+import types
+
+
+def _frozen(d):
+	return types.MappingProxyType(copy.deepcopy(d))
+
+
+def _frozen_functions(d):
+	# the functions themselves are shared, not copied
+	return types.MappingProxyType(dict([(k, types.MappingProxyType(dict(v)))
+		for k, v in d.items()]))
+
+
+class Snapshot(object):
+
+	__slots__ = ('_pwh', 'version', 'config_dir', 'config_file', 'lib_path',
+		'hashschemes', 'wordschemes', 'hashfunctions', 'wordfunctions',
+		'user_settings', 'pipelines')
+
+	def __init__(self, pwh, version):
+		# call with pwh's config lock held
+		init = lambda name, value: object.__setattr__(self, name, value)
+		init('_pwh', pwh)
+		init('version', version)
+		init('config_dir', pwh.config_dir)
+		init('config_file', pwh.config_file)
+		init('lib_path', pwh.lib_path)
+		init('hashschemes', _frozen(pwh.hashschemes))
+		init('wordschemes', _frozen(pwh.wordschemes))
+		init('hashfunctions', _frozen_functions(pwh.hashfunctions))
+		init('wordfunctions', _frozen_functions(pwh.wordfunctions))
+		init('user_settings', _frozen(pwh.user_settings))
+		# PWHash's compiled schemes, which depend on nothing else
+		init('pipelines', {})
+
+	def __setattr__(self, name, value):
+		raise AttributeError('snapshot is read-only')
+
+	def update_setting(self, key, f):
+		return self._pwh.update_setting(key, f)
+
+	def save_config(self, cfgfile=None):
+		self._pwh.save_config(cfgfile)
+
+
+__all__ = ['Snapshot']
+
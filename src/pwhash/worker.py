@@ -0,0 +1,256 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+#
+# Runs a hash function in a disposable child process, so that a
+# derivation can be held to a deadline and a memory limit: the child is
+# killed if it overruns, and PWHashError is raised in the parent.
+#
+# The child is a fresh interpreter (subprocess, which forks and execs in
+# one step), not a bare fork(): derivations start from threads, and a
+# forked child would inherit any lock another thread held at the time,
+# such as a PWHash's config lock or a plugin's, and could hang on it.  So
+# the child is handed the derivation as data (see job()), and makes its
+# own PWHash, with the snapshot's settings, to run it.
+#
+# The child talks back over a pipe in frames of a type byte and a length:
+#
+#   P  progress: done and total, as two 64-bit integers
+#   K  the key material
+#   E  an error message
+#   C  cancelled
+#
+
+
+import os
+import sys
+import time
+import pickle
+import select
+import struct
+import importlib
+import subprocess
+
+
+_header = struct.Struct('>cQ')
+_progress = struct.Struct('>QQ')
+
+# seconds to wait for a child to exit once it has been told to
+_reap_timeout = 5.0
+
+# what the child runs: read the job from stdin, then run it
+_bootstrap = '''import sys, pickle, importlib
+job = pickle.load(sys.stdin.buffer)
+sys.path[:] = job['path']
+sys.exit(importlib.import_module(job['module'])._spawned(job))
+'''
+
+
+def available():
+	return os.name == 'posix'
+
+
+def job(snap, hashsid, password, salt):
+	# the derivation of hash scheme hashsid in snap, as the child needs it
+	return {
+		'config_dir': snap.config_dir,
+		'settings': dict(snap.user_settings),
+		'hashscheme': dict(snap.hashschemes[hashsid]),
+		'password': password,
+		'salt': salt
+		}
+
+
+def _write_all(fd, data):
+	view = memoryview(data)
+	while view:
+		n = os.write(fd, view)
+		view = view[n:]
+
+
+def _frame(fd, kind, payload):
+	_write_all(fd, _header.pack(kind, len(payload)))
+	_write_all(fd, payload)
+
+
+def _child(fd, job):
+	from . import PWHash, PWHashCancelled, keymaterial
+	try:
+		pwh = PWHash(job['config_dir'])
+		with pwh._config_lock:
+			pwh.user_settings = job['settings']
+			pwh._changed()
+		snap = pwh.snapshot()
+		scheme = job['hashscheme']
+		f = snap.hashfunctions[scheme['hashfunctionid']]['f']
+		if job['memlimit']:
+			import resource
+			resource.setrlimit(resource.RLIMIT_AS,
+				(job['memlimit'], job['memlimit']))
+		def progress(done, total):
+			_frame(fd, b'P', _progress.pack(done, total))
+		km = keymaterial.as_key_material(f(snap, scheme['hashparams'],
+			job['password'], job['salt'], progress, None))
+		try:
+			_frame(fd, b'K', km[:])
+		finally:
+			km.wipe()
+		return 0
+	except PWHashCancelled:
+		_frame(fd, b'C', b'')
+	except MemoryError:
+		_frame(fd, b'E', b'memory limit exceeded')
+	except Exception as e:
+		_frame(fd, b'E', (type(e).__name__ + ': ' + str(e)).encode('utf-8'))
+	return 1
+
+
+def _spawned(job):
+	# the child's side of run()
+	return _child(job['fd'], job)
+
+
+class _Reader(object):
+	# reads whole frames from the pipe, never waiting past the deadline or
+	# for longer than a tenth of a second at a time (to notice cancel)
+
+	def __init__(self, fd, deadline, cancel):
+		self.fd = fd
+		self.deadline = deadline
+		self.cancel = cancel
+
+	def _wait(self):
+		from . import PWHashCancelled
+		while True:
+			if self.cancel and self.cancel.is_set():
+				raise PWHashCancelled('key derivation cancelled')
+			timeout = 0.1
+			if self.deadline is not None:
+				remaining = self.deadline - time.time()
+				if remaining <= 0:
+					raise _Overrun()
+				timeout = min(timeout, remaining)
+			r, w, x = select.select([self.fd], [], [], timeout)
+			if r:
+				return
+
+	def read_into(self, view):
+		while view:
+			self._wait()
+			n = os.readv(self.fd, [view])
+			if not n:
+				raise EOFError()
+			view = view[n:]
+
+	def frame(self):
+		header = bytearray(_header.size)
+		self.read_into(memoryview(header))
+		kind, length = _header.unpack(header)
+		payload = bytearray(length)
+		self.read_into(memoryview(payload))
+		return kind, payload
+
+
+class _Overrun(Exception): pass
+
+
+def _reap(proc):
+	# never wait on the child for good: one that does not exit when told
+	# to is killed, and one that outlives even that is left to subprocess
+	try:
+		proc.wait(_reap_timeout)
+		return
+	except subprocess.TimeoutExpired:
+		pass
+	proc.kill()
+	try:
+		proc.wait(_reap_timeout)
+	except subprocess.TimeoutExpired:
+		pass
+
+
+def run(job, deadline=None, memlimit=None, progress=None, cancel=None):
+	# Run job (see job()) in a child process, and return its key material
+	# as a bytearray.  deadline is in seconds and memlimit in bytes of
+	# address space; either may be None.  progress and cancel work as they
+	# do in the parent.
+	from . import PWHashError, PWHashCancelled
+	if not available():
+		raise PWHashError('Deadline and memory limits need a POSIX system.')
+	sys.stdout.flush()
+	sys.stderr.flush()
+	rfd, wfd = os.pipe()
+	try:
+		proc = subprocess.Popen([sys.executable, '-c', _bootstrap],
+			stdin=subprocess.PIPE, pass_fds=(wfd,))
+	except OSError as e:
+		os.close(rfd)
+		os.close(wfd)
+		raise PWHashError('Cannot start hash worker process: ' + str(e))
+	os.close(wfd)
+	if deadline is not None:
+		limit = time.time() + deadline
+	else:
+		limit = None
+	reader = _Reader(rfd, limit, cancel)
+	exited = False
+	try:
+		try:
+			proc.stdin.write(pickle.dumps(dict(job, fd=wfd,
+				memlimit=memlimit, path=list(sys.path),
+				module=__name__)))
+			proc.stdin.close()
+		except OSError:
+			pass
+		while True:
+			try:
+				kind, payload = reader.frame()
+			except EOFError:
+				_reap(proc)
+				exited = True
+				raise PWHashError(
+					'Hash worker process died (memory limit exceeded?).')
+			if kind == b'P':
+				if progress:
+					progress(*_progress.unpack(payload))
+			elif kind == b'K':
+				return payload
+			elif kind == b'C':
+				raise PWHashCancelled('key derivation cancelled')
+			else:
+				raise PWHashError('Hash worker process failed: ' +
+					payload.decode('utf-8', 'replace'))
+	except _Overrun:
+		raise PWHashError('Hash function exceeded its deadline of ' +
+			str(deadline) + ' seconds; worker process killed.')
+	finally:
+		os.close(rfd)
+		if not exited:
+			proc.kill()
+			_reap(proc)
+
+
+__all__ = ['available', 'job', 'run']
@@ -29,3 +29,117 @@ def build_scrypthash(build):
 	build.zipcontents['pwhash/plugins/pwh_scrypt/scrypthash.py'] = os.path.join(build.srcdir, 'scrypthash.py')
 
 
+#
+# on Linux x86-64 hosts with gcc, build the scrypthash lib from
+# scrypt-1.1.6.tgz: instrument, train a PGO profile with pgo-train.py,
+# then rebuild -O3 with the profile and LTO.  Training and timing go
+# through the SMix lanes, as pwh_scrypt derives.  If it beats the prebuilt
+# lib (both timed by pgo-train.py), or the prebuilt lib lacks entry points
+# that it has, the result goes into libcontents ahead of prebuildlibs
+# (which skips names already present); if not, or on any failure, the
+# prebuilt lib is used as before.
+#
+@build_step('scrypthash-native', [], ['prebuildlibs'])
+def build_scrypthash_native(build):
+	import platform
+	import subprocess
+	import tarfile
+	import time
+
+	libname = 'scrypthash-linux-x86-64.so'
+	if platform.system() != 'Linux' or \
+		platform.machine().lower() not in ['x86_64', 'amd64'] or \
+		sys.maxsize <= 2**32:
+		print('\tNot a Linux x86-64 host, using prebuilt', libname)
+		return
+	cc = shutil.which('gcc')
+	if cc is None:
+		print('\tgcc not found, using prebuilt', libname)
+		return
+
+	objdir = os.path.join(build.objroot, 'scrypthash-native')
+	scryptdir = os.path.join(objdir, 'scrypt-1.1.6')
+	scryptlibroot = os.path.join(scryptdir, 'lib')
+	os.mkdir(objdir)
+	tar = tarfile.open(os.path.join(build.srcdir, 'scrypt-1.1.6.tgz'))
+	tar.extractall(objdir)
+	tar.close()
+	shutil.copy(os.path.join(build.srcdir, 'config-Linux.h'),
+		os.path.join(objdir, 'config.h'))
+	for f in [
+		os.path.join(scryptdir, 'scrypt_platform.h'),
+		os.path.join(scryptlibroot, 'util', 'sysendian.h'),
+		os.path.join(scryptlibroot, 'crypto', 'sha256.h'),
+		os.path.join(scryptlibroot, 'crypto', 'sha256.c'),
+		os.path.join(scryptlibroot, 'crypto', 'crypto_scrypt.h'),
+		os.path.join(scryptlibroot, 'crypto', 'crypto_scrypt-sse.c'),
+		os.path.join(build.srcdir, 'crypto_scrypt-scratch.c')]:
+		shutil.copy(f, objdir)
+
+	sources = ['crypto_scrypt-scratch.c', 'sha256.c']
+	cflags = ['-m64', '-fPIC', '-O3',
+		'-DCONFIG_H_FILE="config.h"',
+		'-DSCRYPT_IMPL_SSE']
+	trainer = os.path.join(build.srcdir, 'pgo-train.py')
+	libfile = os.path.join(objdir, libname)
+
+	def run(cmd):
+		try:
+			return subprocess.check_output(cmd, cwd=objdir,
+				stderr=subprocess.STDOUT).decode()
+		except (OSError, subprocess.CalledProcessError) as e:
+			output = getattr(e, 'output', None)
+			if output:
+				sys.stderr.write(output.decode())
+			raise
+
+	def compile_and_link(extraflags):
+		objs = []
+		for src in sources:
+			obj = os.path.splitext(src)[0] + '.o'
+			run([cc] + cflags + extraflags + ['-c', '-o', obj, src])
+			objs.append(obj)
+		run([cc, '-shared'] + cflags + extraflags + ['-o', libfile] + objs)
+
+	try:
+		print('\tBuilding instrumented', libname, '...')
+		compile_and_link(['-fprofile-generate'])
+		print('\tTraining PGO profile ...')
+		start = time.time()
+		run([sys.executable, trainer, 'train', libfile])
+		print('\t\t%.1fs' % (time.time() - start))
+		print('\tBuilding', libname, 'with PGO and LTO ...')
+		os.remove(libfile)
+		compile_and_link(['-fprofile-use', '-fprofile-correction', '-flto'])
+		localtime = float(run([sys.executable, trainer, 'time', libfile]))
+	except (OSError, subprocess.CalledProcessError):
+		print('\tNative build failed, using prebuilt', libname)
+		return
+
+	prebuilt = os.path.join(build.sandboxroot, 'prebuiltlibs', libname)
+	print('\tscrypt N=2^14 r=8 p=1 (SMix lanes if any), best of 3:')
+	print('\t\t%-10s %.4fs' % ('native', localtime))
+	if os.path.exists(prebuilt):
+		try:
+			prebuilttime = float(
+				run([sys.executable, trainer, 'time', prebuilt]))
+			missing = [e for e in
+				run([sys.executable, trainer, 'entries', libfile]).split()
+				if e not in
+				run([sys.executable, trainer, 'entries', prebuilt]).split()]
+		except (OSError, subprocess.CalledProcessError):
+			print('\t\t%-10s (failed)' % 'prebuilt')
+		else:
+			print('\t\t%-10s %.4fs' % ('prebuilt', prebuilttime))
+			if missing:
+				print('\tPrebuilt lib lacks', ', '.join(missing) +
+					', using native build')
+			elif localtime >= prebuilttime:
+				print('\tNative build is %.1f%% slower, using prebuilt %s' %
+					(100.0 * (localtime - prebuilttime) / prebuilttime,
+					libname))
+				return
+			else:
+				print('\tNative build is %.1f%% faster, using it' %
+					(100.0 * (prebuilttime - localtime) / prebuilttime))
+	build.libcontents[libname] = libfile
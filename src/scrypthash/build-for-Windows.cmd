@@ -41,10 +41,11 @@ copy %SCRYPTLIBROOT%\crypto\sha256.h %OBJDIR%\ || exit /b
 copy %SCRYPTLIBROOT%\crypto\sha256.c %OBJDIR%\ || exit /b
 copy %SCRYPTLIBROOT%\crypto\crypto_scrypt.h %OBJDIR%\ || exit /b
 copy %SCRYPTLIBROOT%\crypto\crypto_scrypt-ref.c %OBJDIR%\ || exit /b
+copy crypto_scrypt-scratch.c %OBJDIR%\ || exit /b
 
 cd %OBJDIR% || exit /b
 cl.exe /O2 /D_USRDLL /D_WINDLL /DCONFIG_H_FILE=\"config.h\" /Dinline=__inline /c sha256.c
-cl.exe /O2 /D_USRDLL /D_WINDLL /DCONFIG_H_FILE=\"config.h\" /Dinline=__inline /c crypto_scrypt-ref.c
-link.exe /DLL /OUT:%OUTFILE% /EXPORT:crypto_scrypt sha256.obj crypto_scrypt-ref.obj
+cl.exe /O2 /D_USRDLL /D_WINDLL /DCONFIG_H_FILE=\"config.h\" /DSCRYPT_IMPL_REF /Dinline=__inline /c crypto_scrypt-scratch.c
+link.exe /DLL /OUT:%OUTFILE% /EXPORT:crypto_scrypt /EXPORT:crypto_scrypt_scratch /EXPORT:crypto_scrypt_scratch_size /EXPORT:crypto_scrypt_smix /EXPORT:crypto_scrypt_smix_size /EXPORT:crypto_scrypt_smix_start /EXPORT:crypto_scrypt_smix_steps /EXPORT:crypto_scrypt_smix_finish sha256.obj crypto_scrypt-scratch.obj
 cd ..
 
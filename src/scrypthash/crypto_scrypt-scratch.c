@@ -0,0 +1,398 @@
+/*
+ * Copyright (c) 2014, Brian Boylston
+ * All rights reserved.
+ *
+ * Redistribution and use in source and binary forms, with or without
+ * modification, are permitted provided that the following conditions are met:
+ *
+ * * Redistributions of source code must retain the above copyright notice, this
+ *   list of conditions and the following disclaimer.
+ *
+ * * Redistributions in binary form must reproduce the above copyright notice,
+ *   this list of conditions and the following disclaimer in the documentation
+ *   and/or other materials provided with the distribution.
+ *
+ * THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+ * AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+ * IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+ * DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+ * FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+ * DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+ * SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+ * CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+ * OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+ * OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+ */
+
+/*
+ * crypto_scrypt_scratch() is crypto_scrypt() with the scratch memory (V, B
+ * and XY) supplied by the caller, so that a long-running process can keep
+ * one buffer faulted in and reuse it across derivations instead of paying
+ * for malloc/mmap, first-touch page faults, and munmap on every call.
+ *
+ * This file wraps one of the scrypt-1.1.6 implementations; compile it in
+ * place of that implementation, with one of SCRYPT_IMPL_SSE,
+ * SCRYPT_IMPL_NOSSE, or SCRYPT_IMPL_REF defined to pick the one to wrap.
+ * crypto_scrypt() itself is still exported.
+ */
+#if defined(SCRYPT_IMPL_SSE)
+#include "crypto_scrypt-sse.c"
+#elif defined(SCRYPT_IMPL_NOSSE)
+#include "crypto_scrypt-nosse.c"
+#elif defined(SCRYPT_IMPL_REF)
+#include "crypto_scrypt-ref.c"
+#else
+#error "define one of SCRYPT_IMPL_SSE, SCRYPT_IMPL_NOSSE, SCRYPT_IMPL_REF"
+#endif
+
+/**
+ * crypto_scrypt_scratch_size(N, r, p):
+ * Return the number of bytes of scratch memory that crypto_scrypt_scratch()
+ * needs for the given parameters, or 0 if that does not fit in a size_t.
+ */
+size_t
+crypto_scrypt_scratch_size(uint64_t N, uint32_t r, uint32_t p)
+{
+	uint64_t r128 = (uint64_t)(r) * 128;
+
+	if ((r == 0) || (p == 0) || (N > UINT64_MAX / r128) ||
+	    ((uint64_t)(p) > UINT64_MAX / r128))
+		return (0);
+	if (r128 * N > SIZE_MAX - r128 * p - 2 * r128 - 64 - 63)
+		return (0);
+
+	/* V, B, XY, and slack for aligning to 64 bytes. */
+	return ((size_t)(r128 * N + r128 * p + 2 * r128 + 64 + 63));
+}
+
+/**
+ * crypto_scrypt_scratch(passwd, passwdlen, salt, saltlen, N, r, p, buf,
+ *     buflen, scratch, scratchlen):
+ * As crypto_scrypt(), but using the scratchlen bytes at scratch, which must
+ * be at least crypto_scrypt_scratch_size(N, r, p), instead of allocating.
+ * The scratch memory is left holding intermediate values; the caller is
+ * responsible for wiping it.
+ *
+ * Return 0 on success; or -1 on error.
+ */
+int
+crypto_scrypt_scratch(const uint8_t * passwd, size_t passwdlen,
+    const uint8_t * salt, size_t saltlen, uint64_t N, uint32_t r, uint32_t p,
+    uint8_t * buf, size_t buflen, void * scratch, size_t scratchlen)
+{
+	size_t need;
+	uint8_t * V;
+	uint8_t * B;
+	uint8_t * XY;
+	uint32_t i;
+
+	/* Sanity-check parameters. */
+#if SIZE_MAX > UINT32_MAX
+	if (buflen > (((uint64_t)(1) << 32) - 1) * 32) {
+		errno = EFBIG;
+		return (-1);
+	}
+#endif
+	if ((uint64_t)(r) * (uint64_t)(p) >= (1 << 30)) {
+		errno = EFBIG;
+		return (-1);
+	}
+	if (((N & (N - 1)) != 0) || (N < 2)) {
+		errno = EINVAL;
+		return (-1);
+	}
+	need = crypto_scrypt_scratch_size(N, r, p);
+	if ((need == 0) || (scratchlen < need)) {
+		errno = ENOMEM;
+		return (-1);
+	}
+
+	/* Carve V, B and XY out of the scratch memory, 64-byte aligned. */
+	V = (uint8_t *)(((uintptr_t)(scratch) + 63) & ~ (uintptr_t)(63));
+	B = V + (size_t)(128) * r * N;
+	XY = B + (size_t)(128) * r * p;
+
+	/* 1: (B_0 ... B_{p-1}) <-- PBKDF2(P, S, 1, p * MFLen) */
+	PBKDF2_SHA256(passwd, passwdlen, salt, saltlen, 1, B, p * 128 * r);
+
+	/* 2: for i = 0 to p - 1 do */
+	for (i = 0; i < p; i++) {
+		/* 3: B_i <-- MF(B_i, N) */
+		smix(&B[i * 128 * r], r, N, (void *)(V), (void *)(XY));
+	}
+
+	/* 5: DK <-- PBKDF2(P, B, 1, dkLen) */
+	PBKDF2_SHA256(passwd, passwdlen, B, p * 128 * r, 1, buf, buflen);
+
+	/* Success! */
+	return (0);
+}
+
+/**
+ * crypto_scrypt_smix_size(N, r):
+ * Return the number of bytes of scratch memory that crypto_scrypt_smix()
+ * needs for the given parameters, or 0 if that does not fit in a size_t.
+ */
+size_t
+crypto_scrypt_smix_size(uint64_t N, uint32_t r)
+{
+	uint64_t r128 = (uint64_t)(r) * 128;
+
+	if ((r == 0) || (N > UINT64_MAX / r128))
+		return (0);
+	if (r128 * N > SIZE_MAX - 2 * r128 - 64 - 63)
+		return (0);
+
+	/* V, XY, and slack for aligning to 64 bytes. */
+	return ((size_t)(r128 * N + 2 * r128 + 64 + 63));
+}
+
+/**
+ * crypto_scrypt_smix(B, r, N, scratch, scratchlen):
+ * Compute B = SMix_r(B, N) in place for one 128 * r byte lane B, using the
+ * scratchlen bytes at scratch, which must be at least
+ * crypto_scrypt_smix_size(N, r).  The p lanes of a derivation are
+ * independent, so a caller that does the PBKDF2 steps itself can run them
+ * concurrently, each with its own scratch memory.  The scratch memory is
+ * left holding intermediate values; the caller is responsible for wiping
+ * it.
+ *
+ * Return 0 on success; or -1 on error.
+ */
+int
+crypto_scrypt_smix(uint8_t * B, uint32_t r, uint64_t N, void * scratch,
+    size_t scratchlen)
+{
+	size_t need;
+	uint8_t * V;
+	uint8_t * XY;
+
+	/* Sanity-check parameters. */
+	if (r >= (1 << 30)) {
+		errno = EFBIG;
+		return (-1);
+	}
+	if (((N & (N - 1)) != 0) || (N < 2)) {
+		errno = EINVAL;
+		return (-1);
+	}
+	need = crypto_scrypt_smix_size(N, r);
+	if ((need == 0) || (scratchlen < need)) {
+		errno = ENOMEM;
+		return (-1);
+	}
+
+	/* Carve V and XY out of the scratch memory, 64-byte aligned. */
+	V = (uint8_t *)(((uintptr_t)(scratch) + 63) & ~ (uintptr_t)(63));
+	XY = V + (size_t)(128) * r * N;
+
+	/* 3: B <-- MF(B, N) */
+	smix(B, r, N, (void *)(V), (void *)(XY));
+
+	/* Success! */
+	return (0);
+}
+
+/*
+ * crypto_scrypt_smix_start(), crypto_scrypt_smix_steps(), and
+ * crypto_scrypt_smix_finish() compute the same thing as
+ * crypto_scrypt_smix(), but a few of SMix's 2N iterations at a time, so
+ * that the caller can report progress or give up between calls.  The state
+ * between calls lives in the scratch memory, laid out as for
+ * crypto_scrypt_smix(); X is kept in the wrapped implementation's own
+ * layout, which for the SSE code is a permutation of the words of B.
+ */
+static int
+smix_carve(uint32_t r, uint64_t N, void * scratch, size_t scratchlen,
+    uint8_t ** V, uint8_t ** XY)
+{
+	size_t need;
+
+	if (r >= (1 << 30)) {
+		errno = EFBIG;
+		return (-1);
+	}
+	if (((N & (N - 1)) != 0) || (N < 2)) {
+		errno = EINVAL;
+		return (-1);
+	}
+	need = crypto_scrypt_smix_size(N, r);
+	if ((need == 0) || (scratchlen < need)) {
+		errno = ENOMEM;
+		return (-1);
+	}
+	*V = (uint8_t *)(((uintptr_t)(scratch) + 63) & ~ (uintptr_t)(63));
+	*XY = *V + (size_t)(128) * r * N;
+	return (0);
+}
+
+/**
+ * crypto_scrypt_smix_start(B, r, N, scratch, scratchlen):
+ * Load the 128 * r byte lane B as the initial X for
+ * crypto_scrypt_smix_steps().
+ *
+ * Return 0 on success; or -1 on error.
+ */
+int
+crypto_scrypt_smix_start(const uint8_t * B, uint32_t r, uint64_t N,
+    void * scratch, size_t scratchlen)
+{
+	uint8_t * V;
+	uint8_t * XY;
+	size_t k;
+#if defined(SCRYPT_IMPL_SSE)
+	size_t i;
+#endif
+
+	if (smix_carve(r, N, scratch, scratchlen, &V, &XY))
+		return (-1);
+
+	/* 1: X <-- B */
+#if defined(SCRYPT_IMPL_SSE)
+	for (k = 0; k < 2 * r; k++) {
+		for (i = 0; i < 16; i++) {
+			((uint32_t *)(XY))[k * 16 + i] =
+			    le32dec(&B[(k * 16 + (i * 5 % 16)) * 4]);
+		}
+	}
+#elif defined(SCRYPT_IMPL_NOSSE)
+	for (k = 0; k < 32 * r; k++)
+		((uint32_t *)(XY))[k] = le32dec(&B[4 * k]);
+#else
+	for (k = 0; k < 128 * r; k++)
+		XY[k] = B[k];
+#endif
+
+	return (0);
+}
+
+/**
+ * crypto_scrypt_smix_steps(r, N, scratch, scratchlen, start, count):
+ * Run SMix iterations start to start + count - 1 of 2N on the X left by
+ * crypto_scrypt_smix_start() or a previous call; iterations 0 to N - 1 fill
+ * V, and N to 2N - 1 mix it back in.  The iterations must be run in order,
+ * and start and count must be even.
+ *
+ * Return 0 on success; or -1 on error.
+ */
+int
+crypto_scrypt_smix_steps(uint32_t r, uint64_t N, void * scratch,
+    size_t scratchlen, uint64_t start, uint64_t count)
+{
+	uint8_t * V;
+	uint8_t * XY;
+	void * X;
+	void * Y;
+	uint64_t i, j, end;
+#if !defined(SCRYPT_IMPL_REF)
+	void * Z;
+#endif
+
+	if (smix_carve(r, N, scratch, scratchlen, &V, &XY))
+		return (-1);
+	if ((start & 1) || (count & 1) || (start > 2 * N) ||
+	    (count > 2 * N - start)) {
+		errno = EINVAL;
+		return (-1);
+	}
+	end = start + count;
+	X = XY;
+	Y = XY + (size_t)(128) * r;
+#if !defined(SCRYPT_IMPL_REF)
+	Z = XY + (size_t)(256) * r;
+#endif
+
+#if defined(SCRYPT_IMPL_REF)
+	/* 2: for i = 0 to N - 1 do */
+	for (i = start; (i < N) && (i < end); i++) {
+		/* 3: V_i <-- X */
+		blkcpy(&V[i * (128 * r)], X, 128 * r);
+
+		/* 4: X <-- H(X) */
+		blockmix_salsa8(X, Y, r);
+	}
+
+	/* 6: for i = 0 to N - 1 do */
+	for (i = (start > N) ? start : N; i < end; i++) {
+		/* 7: j <-- Integerify(X) mod N */
+		j = integerify(X, r) & (N - 1);
+
+		/* 8: X <-- H(X \xor V_j) */
+		blkxor(X, &V[j * (128 * r)], 128 * r);
+		blockmix_salsa8(X, Y, r);
+	}
+#else
+	/* 2: for i = 0 to N - 1 do */
+	for (i = start; (i < N) && (i < end); i += 2) {
+		/* 3: V_i <-- X */
+		blkcpy(&V[i * (128 * r)], X, 128 * r);
+
+		/* 4: X <-- H(X) */
+		blockmix_salsa8(X, Y, Z, r);
+
+		/* 3: V_i <-- X */
+		blkcpy(&V[(i + 1) * (128 * r)], Y, 128 * r);
+
+		/* 4: X <-- H(X) */
+		blockmix_salsa8(Y, X, Z, r);
+	}
+
+	/* 6: for i = 0 to N - 1 do */
+	for (i = (start > N) ? start : N; i < end; i += 2) {
+		/* 7: j <-- Integerify(X) mod N */
+		j = integerify(X, r) & (N - 1);
+
+		/* 8: X <-- H(X \xor V_j) */
+		blkxor(X, &V[j * (128 * r)], 128 * r);
+		blockmix_salsa8(X, Y, Z, r);
+
+		/* 7: j <-- Integerify(X) mod N */
+		j = integerify(Y, r) & (N - 1);
+
+		/* 8: X <-- H(X \xor V_j) */
+		blkxor(Y, &V[j * (128 * r)], 128 * r);
+		blockmix_salsa8(Y, X, Z, r);
+	}
+#endif
+
+	return (0);
+}
+
+/**
+ * crypto_scrypt_smix_finish(B, r, N, scratch, scratchlen):
+ * Store X, after all 2N iterations, into the 128 * r byte lane B.
+ *
+ * Return 0 on success; or -1 on error.
+ */
+int
+crypto_scrypt_smix_finish(uint8_t * B, uint32_t r, uint64_t N,
+    void * scratch, size_t scratchlen)
+{
+	uint8_t * V;
+	uint8_t * XY;
+	size_t k;
+#if defined(SCRYPT_IMPL_SSE)
+	size_t i;
+#endif
+
+	if (smix_carve(r, N, scratch, scratchlen, &V, &XY))
+		return (-1);
+
+	/* 10: B' <-- X */
+#if defined(SCRYPT_IMPL_SSE)
+	for (k = 0; k < 2 * r; k++) {
+		for (i = 0; i < 16; i++) {
+			le32enc(&B[(k * 16 + (i * 5 % 16)) * 4],
+			    ((uint32_t *)(XY))[k * 16 + i]);
+		}
+	}
+#elif defined(SCRYPT_IMPL_NOSSE)
+	for (k = 0; k < 32 * r; k++)
+		le32enc(&B[4 * k], ((uint32_t *)(XY))[k]);
+#else
+	for (k = 0; k < 128 * r; k++)
+		B[k] = XY[k];
+#endif
+
+	return (0);
+}
@@ -0,0 +1,218 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+#
+# drives a freshly built scrypthash lib for the scrypthash-native build
+# step:
+#
+#   pgo-train.py train LIB     run representative derivations (PGO training)
+#   pgo-train.py time LIB      print best-of-3 seconds for N=2^14, r=8, p=1
+#   pgo-train.py entries LIB   print the optional entry points LIB exports
+#
+# either way, LIB is first checked against an RFC 7914 test vector, through
+# each way of hashing it has, and the exit status is non-zero if it gets
+# the wrong answer
+#
+# Derivations go the way pwh_scrypt runs them: PBKDF2 here, and the lanes
+# through the lib's SMix, stepwise (crypto_scrypt_smix_start, _steps and
+# _finish; with progress, or with lanes on several threads) and in one
+# call.  Libs without SMix fall back to crypto_scrypt.
+#
+
+
+import sys
+import time
+import hashlib
+import binascii
+import functools
+from ctypes import (cdll, create_string_buffer, addressof, c_char,
+                    c_char_p, c_void_p, c_size_t, c_int, c_uint64, c_uint32)
+
+
+_rfc7914_vector = (b'password', b'NaCl', 1024, 8, 16, 64,
+	'fdbabe1c9d3472007856e7190d01e9fe7c6ad7cbc8237830e77376634b373162'
+	'2eaf30d92e22a3886ff109279d9830dac727afb94a83ee6d8360cbdfa2cc0640')
+
+# what pwh_scrypt uses when the lib has it, beyond crypto_scrypt
+_optional_entries = ['crypto_scrypt_scratch', 'crypto_scrypt_smix',
+	'crypto_scrypt_smix_steps']
+
+# the shipped schemes are r=8, p=1, dklen=512 for N=2^14 and up; the inner
+# loops do not depend on N, so smaller N train the same paths for less time
+_training = [(1 << n, 8, 1, 512) for n in range(10, 17)] + [
+	(16, 1, 1, 64), (16, 1, 32, 64)]
+
+
+def _load(libfile):
+	lib = cdll.LoadLibrary(libfile)
+	lib.crypto_scrypt.argtypes = [
+		c_char_p, c_size_t, c_char_p, c_size_t,
+		c_uint64, c_uint32, c_uint32, c_char_p, c_size_t]
+	lib.crypto_scrypt.restype = c_int
+	try:
+		lib.crypto_scrypt_scratch.argtypes = [
+			c_char_p, c_size_t, c_char_p, c_size_t,
+			c_uint64, c_uint32, c_uint32, c_char_p, c_size_t,
+			c_void_p, c_size_t]
+		lib.crypto_scrypt_scratch.restype = c_int
+		lib.crypto_scrypt_scratch_size.argtypes = [
+			c_uint64, c_uint32, c_uint32]
+		lib.crypto_scrypt_scratch_size.restype = c_size_t
+	except AttributeError:
+		pass
+	try:
+		lib.crypto_scrypt_smix.argtypes = [
+			c_void_p, c_uint32, c_uint64, c_void_p, c_size_t]
+		lib.crypto_scrypt_smix.restype = c_int
+		lib.crypto_scrypt_smix_size.argtypes = [c_uint64, c_uint32]
+		lib.crypto_scrypt_smix_size.restype = c_size_t
+		for f in [lib.crypto_scrypt_smix_start, lib.crypto_scrypt_smix_finish]:
+			f.argtypes = [c_void_p, c_uint32, c_uint64, c_void_p, c_size_t]
+			f.restype = c_int
+		lib.crypto_scrypt_smix_steps.argtypes = [
+			c_uint32, c_uint64, c_void_p, c_size_t, c_uint64, c_uint64]
+		lib.crypto_scrypt_smix_steps.restype = c_int
+	except AttributeError:
+		pass
+	return lib
+
+
+def _has_smix(lib, stepwise):
+	return hasattr(lib, 'crypto_scrypt_smix_steps' if stepwise else
+		'crypto_scrypt_smix')
+
+
+def _hash(lib, password, salt, N, r, p, buflen):
+	buf = create_string_buffer(buflen)
+	if lib.crypto_scrypt(password, len(password), salt, len(salt),
+		N, r, p, buf, buflen):
+		raise RuntimeError('crypto_scrypt failed')
+	return buf.raw
+
+
+def _hash_scratch(lib, password, salt, N, r, p, buflen):
+	size = lib.crypto_scrypt_scratch_size(N, r, p)
+	scratch = create_string_buffer(size)
+	buf = create_string_buffer(buflen)
+	if lib.crypto_scrypt_scratch(password, len(password), salt, len(salt),
+		N, r, p, buf, buflen, scratch, size):
+		raise RuntimeError('crypto_scrypt_scratch failed')
+	return buf.raw
+
+
+def _smix_chunk(N, r):
+	# as scrypthash._smix_chunk()
+	return max(2, min(2 * N // 256, (1 << 16) // r) & ~1)
+
+
+def _smix(lib, lane, N, r, scratch, size, stepwise):
+	if not stepwise:
+		return lib.crypto_scrypt_smix(lane, r, N, scratch, size)
+	result = lib.crypto_scrypt_smix_start(lane, r, N, scratch, size)
+	chunk = _smix_chunk(N, r)
+	done = 0
+	while not result and done < 2 * N:
+		count = min(chunk, 2 * N - done)
+		result = lib.crypto_scrypt_smix_steps(r, N, scratch, size,
+			done, count)
+		done += count
+	if not result:
+		result = lib.crypto_scrypt_smix_finish(lane, r, N, scratch, size)
+	return result
+
+
+def _hash_smix(lib, password, salt, N, r, p, buflen, stepwise):
+	# PBKDF2, each lane's SMix in turn, PBKDF2
+	B = bytearray(hashlib.pbkdf2_hmac('sha256', password, salt, 1,
+		p * 128 * r))
+	size = lib.crypto_scrypt_smix_size(N, r)
+	scratch = create_string_buffer(size)
+	for i in range(p):
+		lane = (c_char * (128 * r)).from_buffer(B, i * 128 * r)
+		if _smix(lib, addressof(lane), N, r, scratch, size, stepwise):
+			raise RuntimeError('crypto_scrypt_smix failed')
+		del lane
+	return hashlib.pbkdf2_hmac('sha256', password, bytes(B), 1, buflen)
+
+
+def _hashes(lib):
+	# each way the lib can hash, as (name, function)
+	hashes = [('crypto_scrypt', _hash)]
+	if hasattr(lib, 'crypto_scrypt_scratch_size'):
+		hashes.append(('crypto_scrypt_scratch', _hash_scratch))
+	for stepwise in [False, True]:
+		if _has_smix(lib, stepwise):
+			hashes.append(('smix' + (' stepwise' if stepwise else ''),
+				functools.partial(_hash_smix, stepwise=stepwise)))
+	return hashes
+
+
+def _check(lib):
+	password, salt, N, r, p, buflen, expected = _rfc7914_vector
+	for name, f in _hashes(lib):
+		got = binascii.hexlify(f(lib, password, salt, N, r, p, buflen))
+		if got.decode('ascii') != expected:
+			return False
+	return True
+
+
+def _timed(lib):
+	# the way derivations run: the stepwise SMix if the lib has it
+	if _has_smix(lib, True):
+		return functools.partial(_hash_smix, lib, stepwise=True)
+	return functools.partial(_hash, lib)
+
+
+def main(argv):
+	mode, libfile = argv[1:3]
+	lib = _load(libfile)
+	if not _check(lib):
+		sys.stderr.write(libfile + ': wrong result for RFC 7914 vector\n')
+		return 1
+	if mode == 'train':
+		for N, r, p, buflen in _training:
+			for name, f in _hashes(lib):
+				f(lib, b'training', b'salt', N, r, p, buflen)
+	elif mode == 'time':
+		f = _timed(lib)
+		best = None
+		for i in range(3):
+			start = time.time()
+			f(b'timing', b'salt', 1 << 14, 8, 1, 512)
+			elapsed = time.time() - start
+			if best is None or elapsed < best:
+				best = elapsed
+		print('%.4f' % best)
+	elif mode == 'entries':
+		print(' '.join([e for e in _optional_entries if hasattr(lib, e)]))
+	else:
+		sys.stderr.write('unknown mode: ' + mode + '\n')
+		return 2
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
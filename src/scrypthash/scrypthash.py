@@ -37,15 +37,24 @@
 import os
 import sys
 import platform
+import threading
 
 from ctypes import (cdll,
                     POINTER, pointer,
-                    c_char_p,
+                    c_char_p, c_char, c_void_p, addressof,
                     c_size_t, c_double, c_int, c_uint64, c_uint32,
                     create_string_buffer)
 
 _scrypthashlib = None
 _crypto_scrypt = None
+_crypto_scrypt_scratch = None
+_crypto_scrypt_scratch_size = None
+_crypto_scrypt_smix = None
+_crypto_scrypt_smix_size = None
+_crypto_scrypt_smix_start = None
+_crypto_scrypt_smix_steps = None
+_crypto_scrypt_smix_finish = None
+_init_lock = threading.Lock()
 
 
 def _normalized_isa():
@@ -78,16 +87,85 @@ def _construct_libname():
 	return '-'.join(components) + ext
 
 
-def init(libpath=''):
-	global _scrypthashlib
+#
+# optional SIMD builds of the library, fastest first;  each is named like
+# the generic lib with '-<variant>' before the extension and is only
+# tried if the CPU has every feature it lists
+#
+_lib_variants = [
+	('avx2', ['sse2', 'avx2']),
+	('sse2', ['sse2']),
+	]
+
+
+def _cpu_features():
+	opsys = platform.system().lower()
+	features = set()
+	try:
+		if opsys == 'linux':
+			with open('/proc/cpuinfo') as f:
+				for line in f:
+					if line.startswith('flags'):
+						features.update(line.split(':', 1)[1].split())
+						break
+		elif opsys == 'darwin':
+			import subprocess
+			with open(os.devnull, 'w') as devnull:
+				for key in ['machdep.cpu.features',
+						'machdep.cpu.leaf7_features']:
+					out = subprocess.check_output(['sysctl', '-n', key],
+						stderr=devnull)
+					features.update(out.decode('ascii').lower().split())
+		elif opsys == 'windows':
+			from ctypes import windll
+			present = windll.kernel32.IsProcessorFeaturePresent
+			# PF_XMMI64_INSTRUCTIONS_AVAILABLE, PF_AVX2_INSTRUCTIONS_AVAILABLE
+			for name, pf in [('sse2', 10), ('avx2', 40)]:
+				if present(pf):
+					features.add(name)
+	except Exception:
+		pass
+	return features
+
+
+def _construct_libnames():
+	generic = _construct_libname()
+	if _normalized_isa() != 'x86':
+		return [generic]
+	features = _cpu_features()
+	base, ext = os.path.splitext(generic)
+	names = [base + '-' + variant + ext
+		for variant, needs in _lib_variants
+		if features.issuperset(needs)]
+	names.append(generic)
+	return names
+
+
+def _load(libpath):
+	# the generic lib is last and must load; variants are best effort
+	libnames = _construct_libnames()
+	for libname in libnames[:-1]:
+		libfile = os.path.join(libpath, libname)
+		if not os.path.exists(libfile):
+			continue
+		try:
+			return cdll.LoadLibrary(libfile)
+		except OSError:
+			pass
+	return cdll.LoadLibrary(os.path.join(libpath, libnames[-1]))
+
+
+def _bind(lib):
 	global _crypto_scrypt
-	if _scrypthashlib:
-		return
+	global _crypto_scrypt_scratch
+	global _crypto_scrypt_scratch_size
+	global _crypto_scrypt_smix
+	global _crypto_scrypt_smix_size
+	global _crypto_scrypt_smix_start
+	global _crypto_scrypt_smix_steps
+	global _crypto_scrypt_smix_finish
 	#
-	libname = _construct_libname()
-	_scrypthashlib = cdll.LoadLibrary(os.path.join(libpath, libname))
-	#
-	_crypto_scrypt = _scrypthashlib.crypto_scrypt
+	_crypto_scrypt = lib.crypto_scrypt
 	_crypto_scrypt.argtypes = [
 		c_char_p,  # const uint8_t *passwd
 		c_size_t,  # size_t         passwdlen
@@ -100,6 +178,92 @@ def init(libpath=''):
 		c_size_t,  # size_t         buflen
 		]
 	_crypto_scrypt.restype = c_int
+	#
+	# only in libs built with crypto_scrypt-scratch.c
+	try:
+		_crypto_scrypt_scratch = lib.crypto_scrypt_scratch
+		_crypto_scrypt_scratch_size = lib.crypto_scrypt_scratch_size
+	except AttributeError:
+		return lib
+	_crypto_scrypt_scratch.argtypes = [
+		c_char_p,  # const uint8_t *passwd
+		c_size_t,  # size_t         passwdlen
+		c_char_p,  # const uint8_t *salt
+		c_size_t,  # size_t         saltlen
+		c_uint64,  # uint64_t       N
+		c_uint32,  # uint32_t       r
+		c_uint32,  # uint32_t       p
+		c_char_p,  # uint8_t       *buf
+		c_size_t,  # size_t         buflen
+		c_void_p,  # void          *scratch
+		c_size_t,  # size_t         scratchlen
+		]
+	_crypto_scrypt_scratch.restype = c_int
+	_crypto_scrypt_scratch_size.argtypes = [
+		c_uint64,  # uint64_t       N
+		c_uint32,  # uint32_t       r
+		c_uint32,  # uint32_t       p
+		]
+	_crypto_scrypt_scratch_size.restype = c_size_t
+	#
+	# only in libs built with a crypto_scrypt-scratch.c that has smix
+	try:
+		_crypto_scrypt_smix = lib.crypto_scrypt_smix
+		_crypto_scrypt_smix_size = lib.crypto_scrypt_smix_size
+	except AttributeError:
+		return lib
+	_crypto_scrypt_smix.argtypes = [
+		c_void_p,  # uint8_t       *B
+		c_uint32,  # uint32_t       r
+		c_uint64,  # uint64_t       N
+		c_void_p,  # void          *scratch
+		c_size_t,  # size_t         scratchlen
+		]
+	_crypto_scrypt_smix.restype = c_int
+	_crypto_scrypt_smix_size.argtypes = [
+		c_uint64,  # uint64_t       N
+		c_uint32,  # uint32_t       r
+		]
+	_crypto_scrypt_smix_size.restype = c_size_t
+	#
+	# only in libs built with a crypto_scrypt-scratch.c that has stepwise smix
+	try:
+		_crypto_scrypt_smix_start = lib.crypto_scrypt_smix_start
+		_crypto_scrypt_smix_steps = lib.crypto_scrypt_smix_steps
+		_crypto_scrypt_smix_finish = lib.crypto_scrypt_smix_finish
+	except AttributeError:
+		return lib
+	for f in [_crypto_scrypt_smix_start, _crypto_scrypt_smix_finish]:
+		f.argtypes = [
+			c_void_p,  # uint8_t       *B
+			c_uint32,  # uint32_t       r
+			c_uint64,  # uint64_t       N
+			c_void_p,  # void          *scratch
+			c_size_t,  # size_t         scratchlen
+			]
+		f.restype = c_int
+	_crypto_scrypt_smix_steps.argtypes = [
+		c_uint32,  # uint32_t       r
+		c_uint64,  # uint64_t       N
+		c_void_p,  # void          *scratch
+		c_size_t,  # size_t         scratchlen
+		c_uint64,  # uint64_t       start
+		c_uint64,  # uint64_t       count
+		]
+	_crypto_scrypt_smix_steps.restype = c_int
+	return lib
+
+
+def init(libpath=''):
+	# Load and bind the lib once per process.  Threads that call this while
+	# another is loading wait for it, and _scrypthashlib is set last, so a
+	# thread that sees it set sees every binding.
+	global _scrypthashlib
+	if _scrypthashlib:
+		return
+	with _init_lock:
+		if not _scrypthashlib:
+			_scrypthashlib = _bind(_load(libpath))
 
 
 IS_PY2 = sys.version_info < (3, 0, 0, 'final', 0)
@@ -121,10 +285,26 @@ def _ensure_bytes(data):
     return data
             
 
-def hash(password, salt, N=1 << 14, r=8, p=1, buflen=64):
+def _output(buflen, out):
+    # the ctypes buffer for the hash to be written to, and the view of out
+    # that it shares memory with, if out is given
+    if out is None:
+        return create_string_buffer(buflen), None
+    view = memoryview(out)
+    if view.readonly or view.nbytes != buflen:
+        view.release()
+        raise error('out must be a writable buffer of buflen bytes')
+    return (c_char * buflen).from_buffer(view), view
+
+
+def hash(password, salt, N=1 << 14, r=8, p=1, buflen=64, out=None):
     """
     Compute scrypt(password, salt, N, r, p, buflen).
 
+    If `out` is given, a writable buffer of buflen bytes such as a
+    bytearray, the hash is written into it, and `out` is returned, instead
+    of a new bytes object that cannot be wiped.
+
     The parameters r, p, and buflen must satisfy r * p < 2^30 and
     buflen <= (2^32 - 1) * 32. The parameter N must be a power of 2
     greater than 1. N, r and p must all be positive.
@@ -145,7 +325,70 @@ def hash(password, salt, N=1 << 14, r=8, p=1, buflen=64):
 
     init()
 
-    outbuf = create_string_buffer(buflen)
+    password = _ensure_bytes(password)
+    salt = _ensure_bytes(salt)
+
+    if r * p >= (1 << 30) or N <= 1 or (N & (N - 1)) != 0 or p < 1 or r < 1:
+        raise error('hash parameters are wrong (r*p should be < 2**30, and N should be a power of two > 1)')
+
+    outbuf, outview = _output(buflen, out)
+    try:
+        result = _crypto_scrypt(password, len(password),
+                                salt, len(salt),
+                                N, r, p,
+                                outbuf, buflen)
+        if outview is None:
+            hashbytes = outbuf.raw
+    finally:
+        del outbuf
+        if outview is not None:
+            outview.release()
+
+    if result:
+        raise error('could not compute hash')
+
+    if out is not None:
+        return out
+    return hashbytes
+
+
+def has_scratch():
+    """
+    Return True if the loaded library can use caller-owned scratch memory
+    (see hash_scratch()).
+    """
+    init()
+    return _crypto_scrypt_scratch is not None
+
+
+def scratch_size(N, r, p):
+    """
+    Return the number of bytes of scratch memory that hash_scratch() needs
+    for the parameters N, r, and p.
+    """
+    init()
+    size = _crypto_scrypt_scratch_size(N, r, p)
+    if not size:
+        raise error('hash parameters are too large')
+    return size
+
+
+def hash_scratch(password, salt, N=1 << 14, r=8, p=1, buflen=64,
+                 scratch=None, out=None):
+    """
+    Compute scrypt(password, salt, N, r, p, buflen) as hash() does, but
+    using `scratch`, a writable buffer of at least scratch_size(N, r, p)
+    bytes, instead of allocating and freeing scratch memory in the call.
+    `out` is as for hash().
+
+    The scratch buffer is left holding intermediate values derived from
+    the password; the caller is responsible for wiping it.
+    """
+
+    init()
+
+    if _crypto_scrypt_scratch is None:
+        raise error('library does not support caller-owned scratch memory')
 
     password = _ensure_bytes(password)
     salt = _ensure_bytes(salt)
@@ -153,16 +396,131 @@ def hash(password, salt, N=1 << 14, r=8, p=1, buflen=64):
     if r * p >= (1 << 30) or N <= 1 or (N & (N - 1)) != 0 or p < 1 or r < 1:
         raise error('hash parameters are wrong (r*p should be < 2**30, and N should be a power of two > 1)')
 
-    result = _crypto_scrypt(password, len(password),
-                            salt, len(salt),
-                            N, r, p,
-                            outbuf, buflen)
+    outbuf, outview = _output(buflen, out)
+    view = memoryview(scratch)
+    try:
+        cbuf = (c_char * view.nbytes).from_buffer(view)
+        try:
+            result = _crypto_scrypt_scratch(password, len(password),
+                                            salt, len(salt),
+                                            N, r, p,
+                                            outbuf, buflen,
+                                            addressof(cbuf), view.nbytes)
+            if outview is None:
+                hashbytes = outbuf.raw
+        finally:
+            del cbuf
+    finally:
+        view.release()
+        del outbuf
+        if outview is not None:
+            outview.release()
 
     if result:
         raise error('could not compute hash')
 
-    return outbuf.raw
+    if out is not None:
+        return out
+    return hashbytes
+
+
+def has_smix():
+    """
+    Return True if the loaded library exports the single-lane SMix (see
+    smix()).
+    """
+    init()
+    return _crypto_scrypt_smix is not None
+
+
+def smix_size(N, r):
+    """
+    Return the number of bytes of scratch memory that smix() needs for the
+    parameters N and r.
+    """
+    init()
+    size = _crypto_scrypt_smix_size(N, r)
+    if not size:
+        raise error('hash parameters are too large')
+    return size
+
+
+def _smix_chunk(N, r):
+    # iterations per crypto_scrypt_smix_steps() call: a small fraction of a
+    # second even for the largest N, and always even
+    return max(2, min(2 * N // 256, (1 << 16) // r) & ~1)
+
+
+def _smix_stepwise(block, N, r, scratch, scratchlen, progress):
+    result = _crypto_scrypt_smix_start(block, r, N, scratch, scratchlen)
+    chunk = _smix_chunk(N, r)
+    done = 0
+    while not result and done < 2 * N:
+        count = min(chunk, 2 * N - done)
+        result = _crypto_scrypt_smix_steps(r, N, scratch, scratchlen,
+                                           done, count)
+        if not result:
+            done += count
+            progress(count)
+    if not result:
+        result = _crypto_scrypt_smix_finish(block, r, N, scratch, scratchlen)
+    return result
+
+
+def smix(block, N, r, scratch, progress=None):
+    """
+    Replace `block`, a writable buffer holding one 128 * r byte lane of
+    PBKDF2 output, with SMix_r(block, N), using `scratch`, a writable buffer
+    of at least smix_size(N, r) bytes.
+
+    The GIL is released for the duration of the call, so the p lanes of a
+    derivation can be run on separate threads, each with its own scratch
+    buffer.  The scratch buffer is left holding intermediate values derived
+    from the password; the caller is responsible for wiping it.
+
+    If `progress` is given, it is called with the number of SMix iterations
+    (of 2N) just completed, every small fraction of a second if the library
+    has the stepwise smix functions, otherwise once at the end.  Anything
+    it raises abandons the computation.
+    """
+
+    init()
+
+    if _crypto_scrypt_smix is None:
+        raise error('library does not export smix')
+
+    if r >= (1 << 30) or N <= 1 or (N & (N - 1)) != 0 or r < 1:
+        raise error('hash parameters are wrong (r should be < 2**30, and N should be a power of two > 1)')
+
+    bview = memoryview(block)
+    sview = memoryview(scratch)
+    try:
+        if bview.nbytes != 128 * r:
+            raise error('block must be 128 * r bytes')
+        cblock = (c_char * bview.nbytes).from_buffer(bview)
+        cscratch = (c_char * sview.nbytes).from_buffer(sview)
+        try:
+            if progress is None or _crypto_scrypt_smix_steps is None:
+                result = _crypto_scrypt_smix(addressof(cblock), r, N,
+                                             addressof(cscratch),
+                                             sview.nbytes)
+                if not result and progress is not None:
+                    progress(2 * N)
+            else:
+                result = _smix_stepwise(addressof(cblock), N, r,
+                                        addressof(cscratch), sview.nbytes,
+                                        progress)
+        finally:
+            del cblock
+            del cscratch
+    finally:
+        sview.release()
+        bview.release()
+
+    if result:
+        raise error('could not compute smix')
 
 
-__all__ = ['error', 'hash', 'init']
+__all__ = ['error', 'has_scratch', 'has_smix', 'hash', 'hash_scratch',
+           'init', 'scratch_size', 'smix', 'smix_size']
 
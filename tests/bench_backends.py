@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Times each scrypt backend, in narvi.zip as built from src/, at r=8 and
+# N=2^14 and 2^16 (or the powers of two given as arguments), best of a few
+# runs, against the pure Python engine.  Each runs as few lanes (p) as it
+# takes, which for the NumPy engine is npscrypt.min_lanes, so the times
+# are compared per lane:
+#
+#     python3 tests/bench_backends.py [log2N ...]
+#
+
+
+import os
+import sys
+import time
+import tempfile
+import shutil
+
+import narvibuild
+
+
+
+def _lanes(name):
+	# the NumPy engine works on many lanes at once, and refuses fewer
+	if name == 'numpy':
+		from pwhash.plugins.pwh_scrypt import npscrypt
+		return npscrypt.min_lanes
+	return 1
+
+
+def _time(f, snap, N, p, runs):
+	best = None
+	for i in range(runs):
+		start = time.time()
+		f(snap, b'password', b'salt', N, 8, p, 64)
+		t = time.time() - start
+		best = t if best is None else min(best, t)
+	return best
+
+
+def main(logNs):
+	tmproot = tempfile.mkdtemp(prefix='narvi-bench-')
+	try:
+		os.environ['HOME'] = os.path.join(tmproot, 'home')
+		os.mkdir(os.environ['HOME'])
+		sys.path.insert(0, narvibuild.build_narvizip(
+			os.path.join(tmproot, 'obj')))
+		import pwhash
+		from pwhash.plugins import pwh_scrypt
+		pwh = pwhash.PWHash('.narvi')
+		pwh.save_config()
+		pwh = pwhash.PWHash('.narvi')
+		pwh.install_libs()
+		snap = pwh.snapshot()
+		#
+		for logN in logNs:
+			N = 1 << logN
+			times = {}
+			for name, load in pwh_scrypt._backends:
+				f = pwh_scrypt._backend(snap, name)
+				if not f:
+					continue
+				p = _lanes(name)
+				try:
+					# the slow engines once, the others best of three
+					times[name] = (p, _time(f, snap, N, p,
+						1 if name in ['numpy', 'python'] else 3))
+				except (pwh_scrypt._Unsupported, MemoryError) as e:
+					print('N=2^%d  %-10s  unsupported: %s' % (logN, name, e))
+			base = times.get('python')
+			for name, (p, t) in times.items():
+				line = 'N=2^%d  %-10s  p=%-3d %9.3f s  %8.3f s/lane' % (
+					logN, name, p, t, t / p)
+				if base and name != 'python':
+					line += '  %6.1fx the python engine' % (
+						base[1] / base[0] / (t / p))
+				print(line)
+		pwh.close()
+	finally:
+		shutil.rmtree(tmproot, True)
+
+
+if __name__ == '__main__':
+	main([int(a) for a in sys.argv[1:]] or [14, 16])
+
@@ -0,0 +1,70 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The tests run against narvi.zip as built from src/ (see narvibuild.py),
+# with HOME pointed at a scratch directory, so that the config, the
+# installed libs and the state files of the plugins stay out of the way.
+
+
+import os
+import sys
+import shutil
+import tempfile
+
+import pytest
+
+import narvibuild
+
+
+
+_tmproot = None
+
+
+def pytest_configure(config):
+	global _tmproot
+	_tmproot = tempfile.mkdtemp(prefix='narvi-test-')
+	os.environ['HOME'] = os.path.join(_tmproot, 'home')
+	os.mkdir(os.environ['HOME'])
+	sys.path.insert(0, narvibuild.build_narvizip(
+		os.path.join(_tmproot, 'obj')))
+
+
+def pytest_unconfigure(config):
+	if _tmproot:
+		shutil.rmtree(_tmproot, True)
+
+
+@pytest.fixture
+def pwh(tmp_path, monkeypatch):
+	# a PWHash with a config of its own, saved so that the libs install
+	import pwhash
+	monkeypatch.setenv('HOME', str(tmp_path))
+	p = pwhash.PWHash('.narvi')
+	p.save_config()
+	p = pwhash.PWHash('.narvi')
+	p.install_libs()
+	yield p
+	p.close()
+
@@ -0,0 +1,107 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Builds narvi.zip from src/*/Build.py the way the top-level Build.py does,
+# but into a caller-supplied obj root and visiting only the steps that
+# narvizip depends on, so that the tests and benchmarks run against the same
+# zip (plugins, manifest and native lib) that ships.
+
+
+import os
+import shutil
+import zipfile
+import stat
+import sys
+import contextlib
+
+
+
+sandboxroot = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+class _Build:
+	def __init__(self, objroot, version):
+		self.sandboxroot = sandboxroot
+		self.srcroot     = os.path.join(sandboxroot, 'src')
+		self.objroot     = objroot
+		self.version     = version
+		self.libcontents = {}
+		self.zipcontents = {}
+		self._steps      = {}
+
+	def build_step(self, name, dependson, neededby):
+		def decorator(f):
+			srcdir = self.srcdir
+			def builder():
+				self.srcdir = srcdir
+				f(self)
+			self._step(name).dependson.extend(dependson)
+			self._step(name).build = builder
+			for n in neededby:
+				self._step(n).dependson.append(name)
+			return f
+		return decorator
+
+	def _step(self, name):
+		try:
+			return self._steps[name]
+		except KeyError:
+			s = self._steps[name] = type('Step', (), {})()
+			s.dependson = []
+			s.build = None
+			return s
+
+	def visit(self, name, done):
+		if name in done:
+			return
+		done.add(name)
+		s = self._steps[name]
+		for d in s.dependson:
+			self.visit(d, done)
+		if s.build:
+			s.build()
+
+
+def build_narvizip(objroot, version='0.test', quiet=True):
+	'''Builds narvi.zip under objroot and returns its path.'''
+	build = _Build(objroot, version)
+	if not os.path.exists(objroot):
+		os.makedirs(objroot)
+	out = open(os.devnull, 'w') if quiet else sys.stdout
+	with contextlib.redirect_stdout(out):
+		for d in sorted(os.listdir(build.srcroot)):
+			build.srcdir = os.path.join(build.srcroot, d)
+			buildscript = os.path.join(build.srcdir, 'Build.py')
+			if not os.path.exists(buildscript):
+				continue
+			g = {'os': os, 'shutil': shutil, 'zipfile': zipfile,
+				'stat': stat, 'sys': sys,
+				'TheBuild': build, 'build_step': build.build_step}
+			exec(compile(open(buildscript, 'rb').read(), buildscript, 'exec'), g)
+		build.visit('narvizip', set())
+	if quiet:
+		out.close()
+	return build.narvizipfile
+
@@ -0,0 +1,151 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Known answers for every scrypt backend, through each way a derivation
+# reaches it: the whole hash, the mixed lanes handed to PBKDF2KeyMaterial,
+# and caller-supplied scratch memory.  The native lib is run both through
+# its SMix lanes, on one thread and on several, and through its one-call
+# hash.  The pure Python and NumPy engines skip the vectors that would take
+# them minutes.
+
+
+import hashlib
+import binascii
+
+import pytest
+
+from pwhash.plugins import pwh_scrypt
+
+
+
+def _vector(password, salt, N, r, p, hexhash):
+	return (password, salt, N, r, p, binascii.unhexlify(hexhash))
+
+
+_vectors = [
+	# RFC 7914, section 12
+	_vector(b'', b'', 16, 1, 1,
+		'77d6576238657b203b19ca42c18a0497f16b4844e3074ae8dfdffa3fede2144'
+		'2fcd0069ded0948f8326a753a0fc81f17e8d3e0fb2e0d3628cf35e20c38d18906'),
+	_vector(b'password', b'NaCl', 1024, 8, 16,
+		'fdbabe1c9d3472007856e7190d01e9fe7c6ad7cbc8237830e77376634b373162'
+		'2eaf30d92e22a3886ff109279d9830dac727afb94a83ee6d8360cbdfa2cc0640'),
+	_vector(b'pleaseletmein', b'SodiumChloride', 16384, 8, 1,
+		'7023bdcb3afd7348461c06cd81fd38ebfda8fbba904f8e3ea9b543f6545da1f2'
+		'd5432955613f0fcf62d49705242a9af9e61e85dc0d651e40dfcf017b45575887')
+	] + [(v['password'], v['salt'], v['N'], v['r'], v['p'], v['hash'])
+		for v in pwh_scrypt._selftest_vectors]
+
+# wide enough for the NumPy engine, small enough for the pure one; checked
+# against OpenSSL
+_lanes = (b'narvi', b'lanes', 128, 2, 32)
+_vectors.append(_lanes + (hashlib.scrypt(_lanes[0], salt=_lanes[1],
+	n=_lanes[2], r=_lanes[3], p=_lanes[4], dklen=64),))
+
+# the engines that skip vectors of N * r * p past _slow_work
+_slow = ['numpy', 'python']
+_slow_work = 1 << 14
+
+# (backend, 'scrypt-threads')
+_engines = [
+	('scrypthash', 1),
+	('scrypthash', 4),
+	('scrypthash-hash', 1),
+	('hashlib', 1),
+	('numpy', 1),
+	('python', 1),
+	('python', 4)
+	]
+
+
+def _vector_id(v):
+	return '%s-%d-%d-%d' % (v[0].decode() or 'empty', v[2], v[3], v[4])
+
+
+@pytest.fixture(params=_engines, ids=lambda e: '%s-%dt' % e)
+def engine(request, pwh, monkeypatch):
+	# (snapshot, backend name, hash function), loaded afresh rather than
+	# from the backend cache, and without the self-test
+	name, threads = request.param
+	pwh.update_setting('scrypt-threads', lambda old: threads)
+	snap = pwh.snapshot()
+	backend = name
+	if name == 'scrypthash-hash':
+		# the lib's one-call hash, which libs without SMix lanes use
+		from pwhash.plugins.pwh_scrypt import scrypthash
+		monkeypatch.setattr(scrypthash, 'has_smix', lambda: False)
+		backend = 'scrypthash'
+	try:
+		f = dict(pwh_scrypt._backends)[backend](snap)
+	except Exception as e:
+		pytest.skip('scrypt backend ' + name + ' unavailable: ' + str(e))
+	return snap, name, f
+
+
+def _check(engine, v, call):
+	snap, name, f = engine
+	password, salt, N, r, p, expected = v
+	if name in _slow and N * r * p > _slow_work:
+		pytest.skip('too slow for the ' + name + ' engine')
+	try:
+		h = call(snap, f, password, salt, N, r, p, len(expected))
+	except pwh_scrypt._Unsupported as e:
+		pytest.skip(str(e))
+	assert bytes(h) == expected
+
+
+@pytest.mark.parametrize('v', _vectors, ids=_vector_id)
+def test_hash(engine, v):
+	_check(engine, v, lambda snap, f, password, salt, N, r, p, buflen:
+		f(snap, password, salt, N, r, p, buflen))
+
+
+@pytest.mark.parametrize('v', _vectors, ids=_vector_id)
+def test_key_material(engine, v):
+	def call(snap, f, password, salt, N, r, p, buflen):
+		km = pwh_scrypt._key_material(snap, f, password, salt,
+			{'N': N, 'r': r, 'p': p, 'dklen': buflen})
+		try:
+			return bytes(km)
+		finally:
+			km.wipe()
+	_check(engine, v, call)
+
+
+@pytest.mark.parametrize('v', _vectors, ids=_vector_id)
+def test_scratch(engine, v):
+	from pwhash.plugins.pwh_scrypt import scratch
+	def call(snap, f, password, salt, N, r, p, buflen):
+		mapped = scratch.MappedScratch(scratch.scrypt_size(N, r, p))
+		try:
+			return f(snap, password, salt, N, r, p, buflen, mapped.buffer)
+		finally:
+			mapped.close()
+	_check(engine, v, call)
+
+
+def test_chosen_backend_passes_selftest(pwh):
+	chain = pwh_scrypt._backend_chain(pwh.snapshot())
+	assert chain and chain[0] in dict(pwh_scrypt._backends)
@@ -0,0 +1,115 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# scrypt's 'batch' (_scrypt_hash_many) must give each salt the hash that
+# _scrypt_hash gives it alone, whichever backends take its jobs, and
+# generate_many() must hand it the salts of a scheme that pays to batch.
+
+
+import pytest
+
+from pwhash.plugins import pwh_scrypt
+from pwhash.plugins.pwh_scrypt import npscrypt
+
+
+_master = 'correct horse battery staple'
+
+
+def _params(N, r, p):
+	return {'N': N, 'r': r, 'p': p, 'dklen': 64}
+
+# lanes of several jobs in lockstep, mixed p in one N and r, and a job wide
+# enough for the lane engine on its own
+_jobs = ([('%d.example.com' % i, _params(1 << 8, 1, 1)) for i in range(36)] +
+	[('p2-%d.example.com' % i, _params(1 << 8, 1, 2)) for i in range(3)] +
+	[('wide.example.com', _params(1 << 6, 2, 32)),
+	 ('odd.example.com', _params(1 << 7, 2, 1))])
+
+
+def _force(pwh, monkeypatch, name):
+	monkeypatch.setitem(pwh_scrypt._chosen_backend,
+		pwh.user_settings.get('lib-version', ''), name)
+	if not pwh_scrypt._backend(pwh.snapshot(), name):
+		pytest.skip('scrypt backend ' + name + ' unavailable')
+
+
+@pytest.mark.parametrize('name', ['scrypthash', 'numpy'])
+def test_batch_matches_scrypt_hash(pwh, monkeypatch, name):
+	_force(pwh, monkeypatch, name)
+	mixes = []
+	mix_many = npscrypt.mix_many
+	def counted_mix_many(jobs, *args, **kwargs):
+		mixes.append(len(jobs))
+		return mix_many(jobs, *args, **kwargs)
+	monkeypatch.setattr(npscrypt, 'mix_many', counted_mix_many)
+	snap = pwh.snapshot()
+	hashes = pwh_scrypt._scrypt_hash_many(snap, _master, _jobs)
+	assert len(hashes) == len(_jobs)
+	if name == 'numpy':
+		# the p=1 and p=2 jobs together, and the wide one
+		assert sorted(mixes) == [1, 39]
+	else:
+		assert mixes == []
+	for (salt, params), h in zip(_jobs, hashes):
+		alone = pwh_scrypt._scrypt_hash(snap, params, _master, salt)
+		try:
+			assert bytes(h) == bytes(alone), salt
+		finally:
+			alone.wipe()
+			h.wipe()
+
+
+def test_generate_many_batches(pwh, monkeypatch):
+	# p=1 derivations are slower on the pure Python engine one by one than
+	# on the NumPy engine's lanes in lockstep
+	_force(pwh, monkeypatch, 'numpy')
+	pwh.user_hashschemes = dict(pwh.user_hashschemes, tiny={
+		'hashfunctionid': 'scrypt',
+		'hashparams': _params(1 << 8, 1, 1)})
+	pwh.merge_config()
+	cost = pwh.hash_cost('tiny')
+	assert cost['backend'] == 'python' and cost['batch'] == npscrypt.min_lanes
+	sds = [{'value': '%d.example.com' % i, 'hashschemeid': 'tiny',
+		'wordschemeid': 'alphanum-12-aA1'} for i in range(2 * cost['batch'])]
+	batches = []
+	derive_keys = pwh._derive_keys
+	def counted_derive_keys(snap, salts, *args):
+		batches.append(len(salts))
+		return derive_keys(snap, salts, *args)
+	monkeypatch.setattr(pwh, '_derive_keys', counted_derive_keys)
+	passwords = dict([(sd['value'], password)
+		for sd, password in pwh.generate_many(sds, _master, workers=1)])
+	assert batches == [len(sds)]
+	for sd in sds:
+		assert passwords[sd['value']] == pwh.generate_password(sd, _master)
+	# a batch for each worker, while each is still large enough to pay
+	del batches[:]
+	assert dict([(sd['value'], password) for sd, password in
+		pwh.generate_many(sds, _master, workers=2)]) == passwords
+	assert batches == [cost['batch']] * 2
+	# too few to pay: one by one
+	del batches[:]
+	assert len(list(pwh.generate_many(sds[:2], _master, workers=4))) == 2
+	assert batches == []
@@ -0,0 +1,53 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Calibration (pwh_scrypt's 'calibrate'): the scheme it picks, and every
+# trial on the way, must fit in the memory it was given, counting a V for
+# each lane that runs at once.
+
+
+import pytest
+
+from pwhash.plugins import pwh_scrypt
+
+
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_calibrated_scheme_fits_in_memory(pwh, monkeypatch, threads):
+	if not pwh_scrypt._backend(pwh.snapshot(), 'scrypthash'):
+		pytest.skip('scrypt backend scrypthash unavailable')
+	monkeypatch.setitem(pwh_scrypt._chosen_backend,
+		pwh.user_settings.get('lib-version', ''), 'scrypthash')
+	pwh.update_setting('scrypt-threads', lambda old: threads)
+	# room for N=2^12 with B and XY, and no more
+	memory = (4 << 20) + (1 << 16)
+	trials = []
+	sid, measured = pwh.calibrate_hashscheme(0.5, memory,
+		lambda params, seconds: trials.append(dict(params)))
+	snap = pwh.snapshot()
+	hashp = snap.hashschemes[sid]['hashparams']
+	assert hashp in trials
+	for params in trials:
+		assert pwh_scrypt._cost(snap, params)['memory'] <= memory
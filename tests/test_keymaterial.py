@@ -0,0 +1,209 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# The derived key must not outlive generate_password(): the key material is
+# wiped, and neither the hash function's plumbing nor the word function may
+# keep a copy of it.  The scan below covers live objects (those reachable
+# from the garbage collector's containers); memory that was freed is out of
+# reach of Python code and of this test.
+
+
+import os
+import gc
+import json
+import base64
+import hashlib
+import tracemalloc
+
+import pytest
+
+from pwhash import keymaterial
+from pwhash.plugins import pwh_scrypt
+
+
+
+_master = 'key-material-test'
+_salt = 'heap.example.com'
+_hashsid = 'scrypt-14-8-4-512'
+
+
+def _derived_key():
+	return hashlib.scrypt(_master.encode(), salt=_salt.encode(),
+		n=1 << 14, r=8, p=4, maxmem=1 << 26, dklen=512)
+
+
+def _live_objects():
+	# the containers the collector tracks and what they refer to, which
+	# takes in the bytes, bytearrays and strs held anywhere reachable
+	gc.collect()
+	seen = set()
+	for o in gc.get_objects():
+		for x in [o] + gc.get_referents(o):
+			if id(x) not in seen:
+				seen.add(id(x))
+				yield x
+
+
+def _copies(needles, strneedles, exclude):
+	found = []
+	for o in _live_objects():
+		if id(o) in exclude:
+			continue
+		if isinstance(o, memoryview):
+			try:
+				o = o.tobytes()
+			except ValueError:
+				continue
+		if isinstance(o, (bytes, bytearray)):
+			if any(n in o for n in needles):
+				found.append(type(o).__name__ + ' of ' + str(len(o)))
+		elif isinstance(o, str):
+			if any(n in o for n in strneedles):
+				found.append('str of ' + str(len(o)))
+	return found
+
+
+def _use_backend(pwh, monkeypatch, name):
+	if not pwh_scrypt._backend(pwh.snapshot(), name):
+		pytest.skip('scrypt backend ' + name + ' unavailable')
+	monkeypatch.setitem(pwh_scrypt._chosen_backend,
+		pwh.user_settings.get('lib-version', ''), name)
+
+
+def _track_key_material(monkeypatch):
+	# every KeyMaterial made from now on, PBKDF2KeyMaterial included
+	made = []
+	init = keymaterial.KeyMaterial.__init__
+	def __init__(self, *args, **kwargs):
+		init(self, *args, **kwargs)
+		made.append(self)
+	monkeypatch.setattr(keymaterial.KeyMaterial, '__init__', __init__)
+	return made
+
+
+def _assert_wiped(made):
+	for km in made:
+		assert km._wiped and not any(km._data)
+		with pytest.raises(ValueError):
+			km[:16]
+
+
+# scrypthash hands over the mixed lanes (PBKDF2KeyMaterial, computed as it
+# is read); hashlib the whole key (KeyMaterial of its bytes)
+@pytest.mark.parametrize('backend', ['scrypthash', 'hashlib'])
+@pytest.mark.parametrize('wordsid', ['base64-16-!@-aA1', 'alphanum-12-aA1',
+	'base32-10', 'pin-4'])
+def test_no_key_copies_after_generate_password(pwh, monkeypatch, backend,
+	wordsid):
+	_use_backend(pwh, monkeypatch, backend)
+	sd = {'value': _salt, 'hashschemeid': _hashsid, 'wordschemeid': wordsid}
+	made = _track_key_material(monkeypatch)
+	password = pwh.generate_password(sd, _master)
+	assert len(made) == 1
+	_assert_wiped(made)
+	del made[:]
+	#
+	key = _derived_key()
+	needles = [key[i:i + 16] for i in range(0, len(key), 16)]
+	strneedles = [base64.b64encode(key[i:i + 24], b'!@').decode()
+		for i in range(0, 96, 24)]
+	assert not [n for n in strneedles if n in password]
+	exclude = set(map(id, [key, needles, strneedles] + needles + strneedles))
+	assert _copies(needles, strneedles, exclude) == []
+
+
+@pytest.mark.parametrize('backend', ['scrypthash', 'hashlib'])
+def test_no_key_copies_after_session_scheme(pwh, monkeypatch, backend):
+	# the root scrypt's key material is wiped once the intermediate key is
+	# taken from it; that key is held until the session ends, and the
+	# account key made from it is wiped like any other
+	from pwhash.plugins import pwh_session
+	_use_backend(pwh, monkeypatch, backend)
+	scheme = dict(pwh.hashschemes['session-scrypt-18-8-1-512'])
+	scheme['hashparams'] = dict(scheme['hashparams'],
+		rootparams={'N': 1 << 12, 'r': 8, 'p': 1})
+	pwh.user_hashschemes = dict(pwh.user_hashschemes,
+		**{'session-scrypt-12-8-1-512': scheme})
+	pwh.merge_config()
+	sd = {'value': _salt, 'hashschemeid': 'session-scrypt-12-8-1-512',
+		'wordschemeid': 'base64-16-!@-aA1'}
+	made = _track_key_material(monkeypatch)
+	password = pwh.generate_password(sd, _master)
+	assert len(made) == 2
+	_assert_wiped(made)
+	del made[:]
+	#
+	with open(os.path.join(pwh.config_dir, 'session-salts')) as f:
+		profilesalt = json.loads(f.read())['narvi']
+	root = hashlib.scrypt(_master.encode(), salt=profilesalt.encode(),
+		n=1 << 12, r=8, p=1, dklen=32)
+	key = bytes(pwh_session._hkdf(root, _salt.encode(),
+		b'narvi account key', 512))
+	needles = [key[i:i + 16] for i in range(0, len(key), 16)]
+	strneedles = [base64.b64encode(key[i:i + 24], b'!@').decode()
+		for i in range(0, 96, 24)]
+	rootneedles = [root[:16], root[16:]]
+	exclude = set(map(id, [root, key, needles, strneedles, rootneedles] +
+		needles + strneedles + rootneedles))
+	assert _copies(needles, strneedles, exclude) == []
+	pwh.close()
+	assert _copies(rootneedles, [], exclude) == []
+
+
+def test_key_material_slices_are_views():
+	key = bytearray(_derived_key()[:64])
+	km = keymaterial.KeyMaterial(key)
+	s = km[8:24]
+	assert isinstance(s, memoryview) and s.obj is key
+	km.wipe()
+	assert s.tobytes() == bytes(16) and key == bytearray(64)
+
+
+def test_pbkdf2_key_material_wipes_lanes():
+	lanes = bytearray(b'\x5a' * 128)
+	km = keymaterial.PBKDF2KeyMaterial(b'pw', lanes, 96)
+	assert lanes == bytearray(128)
+	assert km[:32].tobytes() == hashlib.pbkdf2_hmac('sha256', b'pw',
+		b'\x5a' * 128, 1, 32)
+	assert km.available() == 32
+	km.wipe()
+	assert not any(km._data) and km._prf is None
+
+
+def test_derivation_allocations(pwh, monkeypatch):
+	# with the lanes mixed in native memory and the key read as views, a
+	# derivation allocates a few KiB on the Python heap; V (16 MiB here)
+	# and B stay in the native lib's memory
+	_use_backend(pwh, monkeypatch, 'scrypthash')
+	sd = {'value': _salt, 'hashschemeid': _hashsid,
+		'wordschemeid': 'base64-16-!@-aA1'}
+	pwh.generate_password(sd, _master)
+	tracemalloc.start()
+	try:
+		pwh.generate_password(sd, _master)
+		size, peak = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	assert peak < 64 * 1024
@@ -0,0 +1,96 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Session schemes (pwh_session.py): each profile's salt is made once and
+# kept in ~/.narvi/session-salts, the only way to get its passwords back, so
+# a salts file that cannot be read must stop hashing rather than be
+# replaced.
+
+
+import os
+import json
+
+import pytest
+
+import pwhash
+from pwhash.plugins import pwh_session
+
+
+
+_master = 'session-test'
+
+
+@pytest.fixture
+def session(pwh):
+	# a cheap session scheme, and its salt definition
+	scheme = dict(pwh.hashschemes['session-scrypt-18-8-1-512'])
+	scheme['hashparams'] = dict(scheme['hashparams'],
+		rootparams={'N': 1 << 10, 'r': 8, 'p': 1})
+	pwh.user_hashschemes = dict(pwh.user_hashschemes,
+		**{'session-scrypt-10-8-1-512': scheme})
+	pwh.merge_config()
+	pwh_session._salts.clear()
+	yield {'value': 'session.example.com',
+		'hashschemeid': 'session-scrypt-10-8-1-512',
+		'wordschemeid': 'base64-16-!@-aA1'}
+	pwh_session._salts.clear()
+
+
+def _salts_file(pwh):
+	return os.path.join(pwh.config_dir, 'session-salts')
+
+
+def test_profile_salt_is_made_once(pwh, session):
+	password = pwh.generate_password(session, _master)
+	with open(_salts_file(pwh)) as f:
+		salts = json.loads(f.read())
+	assert list(salts) == ['narvi'] and len(salts['narvi']) == 64
+	pwh.close()
+	pwh_session._salts.clear()
+	assert pwh.generate_password(session, _master) == password
+	with open(_salts_file(pwh)) as f:
+		assert json.loads(f.read()) == salts
+
+
+@pytest.mark.parametrize('content', [
+	'{"other": "00ff", "narvi',
+	'not json',
+	'["narvi"]',
+	'{"other": 7}'
+	])
+def test_corrupt_salts_file_is_left_alone(pwh, session, content):
+	with open(_salts_file(pwh), 'w') as f:
+		f.write(content)
+	with pytest.raises(pwhash.PWHashError):
+		pwh.generate_password(session, _master)
+	with open(_salts_file(pwh)) as f:
+		assert f.read() == content
+
+
+def test_unreadable_salts_file_is_left_alone(pwh, session):
+	os.mkdir(_salts_file(pwh))
+	with pytest.raises(pwhash.PWHashError):
+		pwh.generate_password(session, _master)
+	assert os.path.isdir(_salts_file(pwh))
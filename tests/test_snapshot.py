@@ -0,0 +1,193 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Derivations read only the snapshot they start with (see snapshot.py):
+# while another thread changes the settings and schemes, every password
+# must be the one its snapshot's schemes make, and the backend must read the
+# settings of that snapshot, not those of an earlier one.  As reading the
+# config takes no lock, derivations on separate threads run in parallel.
+
+
+import os
+import time
+import threading
+
+import pytest
+
+from pwhash.plugins import pwh_scrypt
+
+
+
+_master = 'snapshot-test'
+_derivers = 4
+_rounds = 12
+
+
+def _hashscheme(logN):
+	return {
+		'hashfunctionid': 'scrypt',
+		'hashparams': {'N': 1 << logN, 'r': 8, 'p': 4, 'dklen': 512}
+		}
+
+
+def _wordscheme(pwlen):
+	return {
+		'wordfunctionid': 'encoder',
+		'wordparams': {'pwlen': pwlen, 'encoder': 'base64', 'altchars': '!@'}
+		}
+
+
+# (log2 N, password length) of the 'stress' schemes, in turn
+_variants = [(10, 12), (11, 16), (10, 20), (11, 8)]
+
+
+def _use_variant(pwh, variant):
+	logN, pwlen = variant
+	pwh.user_hashschemes = dict(pwh.user_hashschemes,
+		stress=_hashscheme(logN))
+	pwh.user_wordschemes = dict(pwh.user_wordschemes,
+		stress=_wordscheme(pwlen))
+	pwh.merge_config()
+
+
+def _variant_of(snap):
+	return (snap.hashschemes['stress']['hashparams']['N'].bit_length() - 1,
+		snap.wordschemes['stress']['wordparams']['pwlen'])
+
+
+def test_derivations_follow_their_snapshot(pwh, monkeypatch):
+	if not pwh_scrypt._backend(pwh.snapshot(), 'scrypthash'):
+		pytest.skip('scrypt backend scrypthash unavailable')
+	monkeypatch.setitem(pwh_scrypt._chosen_backend,
+		pwh.user_settings.get('lib-version', ''), 'scrypthash')
+	salts = ['%d.example.com' % i for i in range(_derivers)]
+	sd = lambda salt: {'value': salt, 'hashschemeid': 'stress',
+		'wordschemeid': 'stress'}
+	# a first derivation imports the plugin, whose functions then replace
+	# the manifest's stand-ins, before they are wrapped here
+	_use_variant(pwh, _variants[0])
+	pwh.generate_password(sd(salts[0]), _master)
+	#
+	# which snapshot each derivation started with, and whether the
+	# backend read its settings from that one
+	current = threading.local()
+	mismatches = []
+	scrypt = dict(pwh.hashfunctions['scrypt'])
+	def started(f):
+		# 'cost', which generate_password() calls first, and 'f'
+		def wrapper(snap, *args):
+			current.snap = snap
+			return f(snap, *args)
+		return wrapper
+	scrypt['cost'] = started(scrypt['cost'])
+	scrypt['f'] = started(scrypt['f'])
+	monkeypatch.setitem(pwh.hashfunctions, 'scrypt', scrypt)
+	lane_workers = pwh_scrypt._lane_workers
+	def _lane_workers(snap, N, r, p):
+		if snap is not current.snap:
+			mismatches.append((snap.version, current.snap.version))
+		return lane_workers(snap, N, r, p)
+	monkeypatch.setattr(pwh_scrypt, '_lane_workers', _lane_workers)
+	#
+	# the passwords each variant makes, one derivation at a time
+	expected = {}
+	for variant in _variants:
+		_use_variant(pwh, variant)
+		for salt in salts:
+			expected[(variant, salt)] = pwh.generate_password(sd(salt),
+				_master)
+	assert len(set(expected.values())) == len(expected)
+	del mismatches[:]
+	#
+	stop = threading.Event()
+	results = []
+	errors = []
+	def change():
+		i = 0
+		while not stop.is_set():
+			i += 1
+			_use_variant(pwh, _variants[i % len(_variants)])
+			pwh.update_setting('scrypt-threads', lambda old: 1 + i % 3)
+			pwh.update_setting('hugepages', lambda old: not old)
+	def derive(salt):
+		try:
+			for n in range(_rounds):
+				password = pwh.generate_password(sd(salt), _master)
+				results.append((_variant_of(current.snap), salt, password))
+		except Exception as e:
+			errors.append(e)
+	changer = threading.Thread(target=change)
+	derivers = [threading.Thread(target=derive, args=(salt,))
+		for salt in salts]
+	changer.start()
+	for t in derivers:
+		t.start()
+	for t in derivers:
+		t.join()
+	stop.set()
+	changer.join()
+	#
+	assert errors == []
+	assert len(results) == _derivers * _rounds
+	assert mismatches == []
+	for variant, salt, password in results:
+		assert password == expected[(variant, salt)]
+	assert len(set([variant for variant, salt, password in results])) > 1
+
+
+_scaling_threads = 4
+
+
+@pytest.mark.skipif((os.cpu_count() or 1) < _scaling_threads,
+	reason='needs %d CPUs' % _scaling_threads)
+def test_derivations_scale_with_threads(pwh, monkeypatch):
+	# _scaling_threads threads, each deriving as much as one thread alone,
+	# take well under _scaling_threads times as long
+	if not pwh_scrypt._backend(pwh.snapshot(), 'scrypthash'):
+		pytest.skip('scrypt backend scrypthash unavailable')
+	monkeypatch.setitem(pwh_scrypt._chosen_backend,
+		pwh.user_settings.get('lib-version', ''), 'scrypthash')
+	pwh.update_setting('scrypt-threads', lambda old: 1)
+	pwh.user_hashschemes = dict(pwh.user_hashschemes, scaling={
+		'hashfunctionid': 'scrypt',
+		'hashparams': {'N': 1 << 12, 'r': 8, 'p': 1, 'dklen': 64}})
+	pwh.merge_config()
+	def derive(i):
+		for n in range(_rounds * 4):
+			pwh.generate_password({'value': '%d-%d' % (i, n),
+				'hashschemeid': 'scaling', 'wordschemeid': 'pin-4'}, _master)
+	derive(-1)
+	start = time.time()
+	derive(0)
+	alone = time.time() - start
+	threads = [threading.Thread(target=derive, args=(i,))
+		for i in range(_scaling_threads)]
+	start = time.time()
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	together = time.time() - start
+	assert together < 0.6 * _scaling_threads * alone
@@ -0,0 +1,135 @@
+
+# Copyright (c) 2014, Brian Boylston
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# * Redistributions of source code must retain the above copyright notice, this
+#   list of conditions and the following disclaimer.
+# 
+# * Redistributions in binary form must reproduce the above copyright notice,
+#   this list of conditions and the following disclaimer in the documentation
+#   and/or other materials provided with the distribution.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Derivations with a deadline or memory limit run in a child process (see
+# worker.py), which must neither inherit the parent's locks, as a forked
+# child of a threaded process would, nor be waited on for good.
+
+
+import time
+import hashlib
+import threading
+
+import pytest
+
+import pwhash
+from pwhash import worker
+from pwhash.plugins import pwh_scrypt
+
+
+
+_master = 'worker-test'
+
+pytestmark = pytest.mark.skipif(not worker.available(),
+	reason='no worker processes here')
+
+
+def _sd(hashsid='scrypt-14-8-4-512'):
+	return {'value': 'worker.example.com', 'hashschemeid': hashsid,
+		'wordschemeid': 'base64-16-!@-aA1'}
+
+
+def test_worker_matches_in_process(pwh):
+	expected = pwh.generate_password(_sd(), _master)
+	assert pwh.generate_password(_sd(), _master, deadline=60) == expected
+	assert pwh.generate_password(_sd(), _master,
+		memlimit=1 << 31) == expected
+
+
+def test_worker_ignores_locks_held_by_other_threads(pwh, monkeypatch):
+	# Another thread takes the cost model's lock just before the child
+	# starts, and holds it until the derivation is done.  A bare fork() would copy
+	# the lock held, and the child would wait on it for ever when it
+	# records its timing.
+	expected = pwh.generate_password(_sd(), _master)
+	held = threading.Event()
+	done = threading.Event()
+	def hold():
+		with pwh_scrypt._cost_lock:
+			held.set()
+			done.wait(60)
+	t = threading.Thread(target=hold)
+	run = worker.run
+	def held_run(*args, **kwargs):
+		t.start()
+		held.wait()
+		return run(*args, **kwargs)
+	monkeypatch.setattr(worker, 'run', held_run)
+	try:
+		start = time.time()
+		assert pwh.generate_password(_sd(), _master,
+			deadline=30) == expected
+		assert time.time() - start < 30
+	finally:
+		done.set()
+		t.join()
+
+
+def test_worker_deadline(pwh):
+	start = time.time()
+	with pytest.raises(pwhash.PWHashError):
+		pwh.generate_password(_sd('scrypt-20-8-1-512'), _master,
+			deadline=0.5)
+	assert time.time() - start < 10
+
+
+def test_worker_progress(pwh):
+	# an unsaved scheme, from the snapshot
+	seen = []
+	scheme = {'hashfunctionid': 'scrypt',
+		'hashparams': {'N': 1 << 8, 'r': 1, 'p': 1, 'dklen': 64}}
+	pwh.user_hashschemes = dict(pwh.user_hashschemes, tiny=scheme)
+	pwh.merge_config()
+	km = worker.run(worker.job(pwh.snapshot(), 'tiny', _master, 'tiny'),
+		progress=lambda done, total: seen.append((done, total)))
+	assert bytes(km) == hashlib.scrypt(_master.encode(),
+		salt=b'tiny', n=1 << 8, r=1, p=1, dklen=64)
+	assert seen and seen[-1][0] == seen[-1][1]
+
+
+def test_generate_many_isolates_the_python_engine(pwh, monkeypatch):
+	# the pure Python engine does not run in parallel on threads, so
+	# generate_many() gives its derivations a worker process each, from
+	# the scheduler's threads
+	monkeypatch.setitem(pwh_scrypt._chosen_backend,
+		pwh.user_settings.get('lib-version', ''), 'python')
+	pwh.user_hashschemes = dict(pwh.user_hashschemes, tiny={
+		'hashfunctionid': 'scrypt',
+		'hashparams': {'N': 1 << 8, 'r': 1, 'p': 1, 'dklen': 64}})
+	pwh.merge_config()
+	assert pwh._isolate(pwh.snapshot(), 'tiny')
+	sds = [dict(_sd('tiny'), value='%d.example.com' % i) for i in range(4)]
+	runs = []
+	run = worker.run
+	def counted_run(*args, **kwargs):
+		runs.append(1)
+		return run(*args, **kwargs)
+	monkeypatch.setattr(worker, 'run', counted_run)
+	passwords = dict([(sd['value'], password)
+		for sd, password in pwh.generate_many(sds, _master, workers=4)])
+	assert len(runs) == len(sds)
+	monkeypatch.setattr(worker, 'run', run)
+	for sd in sds:
+		assert passwords[sd['value']] == pwh.generate_password(sd, _master)